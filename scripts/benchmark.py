@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# -*- coding=utf-8 -*-
+r"""
+benchmark of the cache-generation with synthetic media
+
+creates test-videos (ffmpeg testsrc2) and galleries (Pillow) in a temporary directory, times
+Cache.find_generators() and every stage of the generators and writes the results as json.
+results of another run (e.g. of another commit) can be passed with --compare
+
+usage: python3 scripts/benchmark.py --videos 2 --duration 300 --galleries 2 -o results.json
+       python3 scripts/benchmark.py --set cache.video.extraction.method=seek --compare results.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import argparse
+import statistics
+import functools
+import subprocess
+import typing as t
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+
+from configlib import ConfigInterface  # noqa: E402
+import jarklin  # noqa: E402
+from jarklin.cache import Cache  # noqa: E402
+from jarklin.cache.generator import CacheGenerator  # noqa: E402
+from jarklin._commands._config_model import ConfigModel  # noqa: E402
+
+
+# in call-order. generate_extra includes the storyboard, chapters and subtitles
+STAGES = [
+    'mark_cache',
+    'generate_meta',
+    'generate_previews',
+    'generate_image_preview',
+    'generate_animated_preview',
+    'generate_extra',
+    'generate_storyboard',
+    'generate_chapters_webvtt',
+    'generate_subtitles_webvtt',
+    'generate_type',
+    'cleanup',
+]
+
+
+def parse_size(value: str) -> t.Tuple[int, int]:
+    width, _, height = value.lower().partition("x")
+    return int(width), int(height)
+
+
+def parse_setting(value: str) -> t.Tuple[t.List[str], t.Any]:
+    key, sep, raw = value.partition("=")
+    if not sep:
+        raise argparse.ArgumentTypeError(f"expected key=value: {value!r}")
+    try:
+        return key.split("."), json.loads(raw)
+    except ValueError:  # plain string
+        return key.split("."), raw
+
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument('--videos', type=int, default=2, help="number of videos")
+parser.add_argument('--duration', type=float, default=120, help="length of the videos in seconds")
+parser.add_argument('--video-size', type=parse_size, default=(1920, 1080), help="WIDTHxHEIGHT of the videos")
+parser.add_argument('--fps', type=int, default=30, help="framerate of the videos")
+parser.add_argument('--galleries', type=int, default=2, help="number of galleries")
+parser.add_argument('--images', type=int, default=20, help="number of images per gallery")
+parser.add_argument('--image-size', type=parse_size, default=(1600, 2400), help="WIDTHxHEIGHT of the gallery-images")
+parser.add_argument('--repeat', type=int, default=1, help="how often the generation is repeated")
+parser.add_argument('--set', dest='settings', type=parse_setting, action='append', default=[],
+                    help="config-value for the run (e.g. cache.video.extraction.method=seek)")
+parser.add_argument('--workdir', type=Path, default=None, help="directory for the media (default: temporary)")
+parser.add_argument('--keep', action='store_true', help="don't delete the media afterwards")
+parser.add_argument('-o', '--output', type=Path, default=None, help="file for the results (default: stdout)")
+parser.add_argument('--compare', type=Path, default=None, help="results of a previous run to compare with")
+
+
+def main() -> None:
+    args = parser.parse_args()
+
+    config = ConfigInterface({'cache': {'workers': 1}})
+    for keys, value in args.settings:
+        config.merge(functools.reduce(lambda acc, key: {key: acc}, reversed(keys), value))
+    config.validate(ConfigModel, update=False)
+
+    workdir = args.workdir or Path(tempfile.mkdtemp(prefix="jarklin-benchmark-"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    try:
+        log(f"creating media in {workdir}")
+        synthesis = time.perf_counter()
+        create_media(workdir, args)
+        log(f"media created in {time.perf_counter() - synthesis:.1f}s")
+        results = run(workdir, config=config, repeat=args.repeat)
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = dict(
+        environment=environment(),
+        parameters=dict(
+            videos=args.videos, duration=args.duration, video_size=args.video_size, fps=args.fps,
+            galleries=args.galleries, images=args.images, image_size=args.image_size, repeat=args.repeat,
+            settings={'.'.join(keys): value for keys, value in args.settings},
+        ),
+        **results,
+    )
+    output = json.dumps(report, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        args.output.write_text(output)
+        log(f"results written to {args.output}")
+
+    if args.compare is not None:
+        compare(json.loads(args.compare.read_text()), report)
+
+
+def log(message: str) -> None:
+    print(message, file=sys.stderr)
+
+
+# ---------------------------------------------------------------------------------------------------------------- #
+
+
+def create_media(workdir: Path, args: argparse.Namespace) -> None:
+    from PIL import Image
+
+    width, height = args.video_size
+    for i in range(args.videos):
+        fp = workdir / f"video-{i + 1}.mp4"
+        subprocess.run([
+            'ffmpeg', '-hide_banner', '-loglevel', "error", '-y',
+            '-f', "lavfi", '-i', f"testsrc2=size={width}x{height}:rate={args.fps}:duration={args.duration}",
+            '-f', "lavfi", '-i', f"sine=frequency={220 * (i + 1)}:duration={args.duration}",
+            '-c:v', "libx264", '-preset', "ultrafast", '-g', f"{args.fps * 10}",
+            '-c:a', "aac", '-shortest',
+            str(fp),
+        ], check=True)
+
+    width, height = args.image_size
+    for i in range(args.galleries):
+        directory = workdir / f"gallery-{i + 1}"
+        directory.mkdir(exist_ok=True)
+        for n in range(args.images):
+            # mandelbrot-section instead of a flat color so the encoders have something to work with
+            shift = n / max(1, args.images)
+            image = Image.effect_mandelbrot((width, height), (-2 + shift, -1.5, 1 + shift, 1.5), 64 + n)
+            image.convert("RGB").save(directory / f"{n + 1:03}.jpg", quality=90)
+
+
+def run(workdir: Path, config: ConfigInterface, repeat: int) -> dict:
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        find_generators = []
+        entries = []
+        for iteration in range(repeat):
+            shutil.rmtree(workdir / ".jarklin", ignore_errors=True)
+            cache = Cache(config=config)
+
+            start = time.perf_counter()
+            generators = cache.find_generators()
+            find_generators.append(time.perf_counter() - start)
+            log(f"[{iteration + 1}/{repeat}] found {len(generators)} generators in {find_generators[-1]:.3f}s")
+
+            for generator in generators:
+                entry = time_generator(generator)
+                entry['iteration'] = iteration
+                entries.append(entry)
+                log(f"[{iteration + 1}/{repeat}] {entry['kind']} {entry['name']}: {entry['total']:.3f}s")
+    finally:
+        os.chdir(cwd)
+
+    return dict(
+        find_generators=summarize(find_generators),
+        entries=entries,
+        summary={
+            kind: {
+                'total': summarize([entry['total'] for entry in entries if entry['kind'] == kind]),
+                'stages': {
+                    stage: summarize([entry['stages'][stage] for entry in entries
+                                      if entry['kind'] == kind and stage in entry['stages']])
+                    for stage in STAGES
+                    if any(stage in entry['stages'] for entry in entries if entry['kind'] == kind)
+                },
+            }
+            for kind in sorted({entry['kind'] for entry in entries})
+        },
+    )
+
+
+def time_generator(generator: CacheGenerator) -> dict:
+    r"""
+    runs the generation with every stage wrapped in a timer. nested stages are part of their parent (generate_extra)
+    """
+    stages: t.Dict[str, float] = {}
+
+    def timed(name: str, method: t.Callable) -> t.Callable:
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                stages[name] = stages.get(name, 0.0) + time.perf_counter() - start
+        return wrapper
+
+    for stage in STAGES:
+        method = getattr(generator, stage, None)
+        if method is not None:
+            setattr(generator, stage, timed(stage, method))
+
+    start = time.perf_counter()
+    generator.generate()
+    total = time.perf_counter() - start
+    return dict(
+        kind=type(generator).__name__.removesuffix("CacheGenerator").lower(),
+        name=generator.source.name,
+        total=total,
+        stages=stages,
+    )
+
+
+def summarize(values: t.List[float]) -> dict:
+    if not values:
+        return {}
+    return dict(
+        mean=statistics.mean(values),
+        median=statistics.median(values),
+        min=min(values),
+        max=max(values),
+        stdev=statistics.stdev(values) if len(values) > 1 else 0.0,
+    )
+
+
+def environment() -> dict:
+    def output(*command: str) -> t.Optional[str]:
+        try:
+            return subprocess.run(command, capture_output=True, text=True, cwd=ROOT).stdout.strip() or None
+        except OSError:
+            return None
+
+    ffmpeg_version = output('ffmpeg', '-hide_banner', '-version')
+    return dict(
+        jarklin=jarklin.__version__,
+        commit=output('git', 'rev-parse', 'HEAD'),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        cpu_count=os.cpu_count(),
+        ffmpeg=ffmpeg_version.splitlines()[0] if ffmpeg_version else None,
+        timestamp=time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    )
+
+
+def compare(previous: dict, current: dict) -> None:
+    def line(label: str, before: dict, after: dict) -> None:
+        if not before or not after:
+            return
+        change = (after['mean'] - before['mean']) / before['mean'] * 100 if before['mean'] else 0.0
+        log(f"{label:<40} {before['mean']:>9.3f}s -> {after['mean']:>9.3f}s  ({change:+.1f}%)")
+
+    log(f"comparing {previous['environment'].get('commit')} -> {current['environment'].get('commit')}")
+    line("find_generators", previous.get('find_generators', {}), current['find_generators'])
+    for kind, summary in current['summary'].items():
+        before = previous.get('summary', {}).get(kind, {})
+        line(f"{kind}", before.get('total', {}), summary['total'])
+        for stage, values in summary['stages'].items():
+            line(f"  {stage}", before.get('stages', {}).get(stage, {}), values)
+
+
+if __name__ == '__main__':
+    main()
@@ -18,11 +18,17 @@ class WebConfigModel(v.StrictConfigModel):
     debug: bool = None
     baseurl: v.constr(strip_whitespace=True, pattern=r'^/.*$') = None
     server: v.Optional['ServerConfigModel'] = None
+    server_mode: v.Union[v.Literal["threaded"], v.Literal["async"]] = None
     session: v.Optional['SessionConfigModel'] = None
     auth: v.Optional['AuthConfigModel'] = None
     gzip: bool = None
     optimize: v.Optional['OptimizeConfigModel'] = None
     image_optimization_minimum_size: v.PositiveInt = None
+    optimization_cache: v.Optional['OptimizationCacheConfigModel'] = None
+    transcoding: v.Optional['TranscodingConfigModel'] = None
+    limits: v.Optional['LimitsConfigModel'] = None
+    sendfile: v.Optional['SendfileConfigModel'] = None
+    metrics: v.Optional['MetricsConfigModel'] = None
     proxy_fix: v.Optional['ProxyFixConfigModel'] = None
 
     class ServerConfigModel(v.FlexibleConfigModel):  # yes. allow extra parameters
@@ -51,6 +57,47 @@ class WebConfigModel(v.StrictConfigModel):
         image: bool = None
         video: bool = None
 
+    class OptimizationCacheConfigModel(v.StrictConfigModel):
+        image: v.Optional['CacheConfigModel'] = None
+        video: v.Optional['CacheConfigModel'] = None
+
+        class CacheConfigModel(v.StrictConfigModel):
+            enabled: bool = None
+            max_size: v.PositiveInt = None  # in bytes
+
+    class TranscodingConfigModel(v.StrictConfigModel):
+        capacity: v.PositiveFloat = None  # in 720p30-transcodes
+        overload: v.Union[v.Literal["downgrade"], v.Literal["refuse"]] = None
+        profiles: v.Optional[v.Mapping[str, 'ProfileConfigModel']] = None
+
+        class ProfileConfigModel(v.StrictConfigModel):
+            video_bitrate: str = None
+            audio_bitrate: str = None
+            preset: v.Union[
+                v.Literal["ultrafast"], v.Literal["superfast"], v.Literal["veryfast"], v.Literal["faster"],
+                v.Literal["fast"], v.Literal["medium"], v.Literal["slow"], v.Literal["slower"],
+                v.Literal["veryslow"],
+            ] = None
+            crf: v.conint(ge=0, le=51) = None
+            threads: v.NonNegativeInt = None
+            keyint: v.PositiveFloat = None
+
+    class LimitsConfigModel(v.StrictConfigModel):
+        image: v.Optional['LimitConfigModel'] = None
+        video: v.Optional['LimitConfigModel'] = None
+
+        class LimitConfigModel(v.StrictConfigModel):
+            concurrent: v.PositiveInt = None
+            queue_timeout: v.NonNegativeFloat = None  # in seconds
+
+    class SendfileConfigModel(v.StrictConfigModel):
+        method: v.Union[v.Literal["none"], v.Literal["x-sendfile"], v.Literal["x-accel-redirect"]] = None
+        prefix: v.constr(strip_whitespace=True, pattern=r'^/.*$') = None
+
+    class MetricsConfigModel(v.StrictConfigModel):
+        enabled: bool = None
+        public: bool = None  # otherwise the login is required (basic-auth for the scraper)
+
     class ProxyFixConfigModel(v.StrictConfigModel):
         x_forwarded_for: v.NonNegativeInt = None
         x_forwarded_proto: v.NonNegativeInt = None
@@ -63,10 +110,23 @@ class CacheConfigModel(v.StrictConfigModel):
     gallery: v.Optional['GalleryConfigModel'] = None
     video: v.Optional['VideoConfigModel'] = None
     ignore: v.Optional[v.Sequence[str]] = None
+    workers: v.PositiveInt = None
+    ffmpeg_processes: v.PositiveInt = None
+    priority: v.Optional[v.Sequence[v.Union[
+        v.Literal["requested"], v.Literal["newest"], v.Literal["cheapest"], v.Literal["name"],
+    ]]] = None
+    watch: v.Optional['WatchConfigModel'] = None
+
+    class WatchConfigModel(v.StrictConfigModel):
+        enabled: bool = None
+        method: v.Union[v.Literal["auto"], v.Literal["inotify"], v.Literal["polling"]] = None
+        delay: v.PositiveFloat = None
+        polling_interval: v.PositiveFloat = None
 
     class GalleryConfigModel(v.StrictConfigModel):
         dimensions: v.Optional['DimensionsModel'] = None
         animated: v.Optional['AnimatedConfigModel'] = None
+        variants: v.Optional[v.Sequence[v.PositiveInt]] = None  # widths of the pre-rendered images
 
         class DimensionsModel(v.StrictConfigModel):
             width: v.PositiveInt = None
@@ -79,6 +139,8 @@ class CacheConfigModel(v.StrictConfigModel):
     class VideoConfigModel(v.StrictConfigModel):
         dimensions: v.Optional['DimensionsModel'] = None
         animated: v.Optional['AnimatedConfigModel'] = None
+        extraction: v.Optional['ExtractionConfigModel'] = None
+        thumbnails: v.Optional['ThumbnailsConfigModel'] = None
 
         class DimensionsModel(v.StrictConfigModel):
             width: v.PositiveInt = None
@@ -88,6 +150,20 @@ class CacheConfigModel(v.StrictConfigModel):
             scene_length: v.PositiveFloat = None
             fps: v.PositiveInt = None
 
+        class ExtractionConfigModel(v.StrictConfigModel):
+            method: v.Union[v.Literal["decode"], v.Literal["seek"]] = None
+            parallel: v.PositiveInt = None
+
+        class ThumbnailsConfigModel(v.StrictConfigModel):
+            enabled: bool = None
+            delay: v.PositiveFloat = None
+            dimensions: v.Optional['DimensionsModel'] = None
+            mode: v.Union[v.Literal["decode"], v.Literal["keyframes"]] = None
+
+            class DimensionsModel(v.StrictConfigModel):
+                width: v.PositiveInt = None
+                height: v.PositiveInt = None
+
 
 class LoggingConfigModel(v.StrictConfigModel):
     level: v.Union[
@@ -73,14 +73,77 @@ def run() -> None:
         config.getint('web', 'image_optimization_minimum_size', fallback=1024*1024)
     app.config['VIDEO_OPTIMIZATION_MINIMUM_SIZE'] = \
         config.getint('web', 'video_optimization_minimum_size', fallback=1024 * 1024 * 50)
+    if config.getbool('web', 'optimization_cache', 'video', 'enabled', fallback=True):
+        app.config['VIDEO_OPTIMIZATION_CACHE_SIZE'] = \
+            config.getint('web', 'optimization_cache', 'video', 'max_size', fallback=1024 * 1024 * 1024 * 4)
+    if config.getbool('web', 'optimization_cache', 'image', 'enabled', fallback=True):
+        app.config['IMAGE_OPTIMIZATION_CACHE_SIZE'] = \
+            config.getint('web', 'optimization_cache', 'image', 'max_size', fallback=1024 * 1024 * 1024)
+
+    if config.has('web', 'limits', 'image', 'concurrent'):
+        app.config['IMAGE_OPTIMIZATION_LIMIT'] = config.getint('web', 'limits', 'image', 'concurrent')
+    app.config['IMAGE_OPTIMIZATION_QUEUE_TIMEOUT'] = \
+        config.getfloat('web', 'limits', 'image', 'queue_timeout', fallback=0.5)
+    if config.has('web', 'limits', 'video', 'concurrent'):
+        app.config['VIDEO_OPTIMIZATION_LIMIT'] = config.getint('web', 'limits', 'video', 'concurrent')
+    app.config['VIDEO_OPTIMIZATION_QUEUE_TIMEOUT'] = \
+        config.getfloat('web', 'limits', 'video', 'queue_timeout', fallback=5)
+
+    if config.has('web', 'transcoding', 'capacity'):
+        app.config['TRANSCODE_CAPACITY'] = config.getfloat('web', 'transcoding', 'capacity')
+    app.config['TRANSCODE_OVERLOAD'] = config.getstr('web', 'transcoding', 'overload', fallback="downgrade")
+    if config.has('web', 'transcoding', 'profiles'):
+        from ...web.optimization import VIDEO_BITRATE_MAP
+        app.config['VIDEO_PROFILES'] = {}
+        for name in config.get('web', 'transcoding', 'profiles').keys():
+            if name not in VIDEO_BITRATE_MAP:
+                raise ValueError(f"web.transcoding.profiles: unknown resolution {name!r}")
+            profile = config.getinterface('web', 'transcoding', 'profiles', name)
+            app.config['VIDEO_PROFILES'][name] = {
+                key: getter(key) for key, getter in [
+                    ('video_bitrate', profile.getstr), ('audio_bitrate', profile.getstr),
+                    ('preset', profile.getstr), ('crf', profile.getint),
+                    ('threads', profile.getint), ('keyint', profile.getfloat),
+                ] if profile.has(key)
+            }
+        logging.debug(f"video-profiles: {app.config['VIDEO_PROFILES']}")
+
+    # requested paths are generated first by the cache
+    from ...cache.priority import DEFAULT_PRIORITY
+    app.config['TRACK_REQUESTS'] = "requested" in config.getsplit('cache', 'priority', fallback=DEFAULT_PRIORITY)
+
+    metrics_enabled = config.getbool('web', 'metrics', 'enabled', fallback=False)
+    if metrics_enabled:
+        from ...web.metrics import MetricsMiddleware, ROUTE_KEY
+        logging.debug("enabling request-metrics")
+        app.config['METRICS_ENABLED'] = True
+        app.config['METRICS_PUBLIC'] = config.getbool('web', 'metrics', 'public', fallback=False)
+
+        @app.before_request
+        def remember_route() -> None:
+            rule = flask.request.url_rule
+            flask.request.environ[ROUTE_KEY] = rule.rule if rule is not None else "<unmatched>"
+
+        app.wsgi_app = MetricsMiddleware(app.wsgi_app)
 
     if config.getbool('web', 'gzip', fallback=True):
         from flask_compress import Compress  # no need to load unless required
         logging.debug("enabling gzip compression")
-        Compress(app)
+        compress = Compress()
+        if metrics_enabled:
+            from ...web.metrics import phase_timer
+            compress.after_request = phase_timer("gzip")(compress.after_request)
+        compress.init_app(app)
 
-    # pip install flask-kaccel for nginx
-    # app.config['USE_X_SENDFILE'] = config.getboolean('web', 'x_sendfile', fallback=False)
+    # let the front-proxy send the files (after the auth- and path-checks)
+    sendfile_method = config.getstr('web', 'sendfile', 'method', fallback="none")
+    if sendfile_method not in {"none", "x-sendfile", "x-accel-redirect"}:
+        raise ValueError(f"web.sendfile.method: unknown method {sendfile_method!r}")
+    if sendfile_method != "none":
+        logging.debug(f"sending files via {sendfile_method}")
+        app.config['SENDFILE_METHOD'] = sendfile_method
+        # x-accel-redirect: the internal nginx-location that maps to the root-directory
+        app.config['SENDFILE_PREFIX'] = config.getstr('web', 'sendfile', 'prefix', fallback="/_jarklin_files/")
 
     if config.has('web', 'proxy_fix'):
         proxy_fix = config.getinterface('web', 'proxy_fix')
@@ -102,6 +165,30 @@ def run() -> None:
             # port=config.getint('web', 'port', fallback=None),
             **config.get('web', 'server', fallback={})
         )
+    elif config.getstr('web', 'server_mode', fallback="threaded") == "async":
+        try:
+            import uvicorn
+        except ModuleNotFoundError:
+            raise ModuleNotFoundError("web.server_mode 'async' requires uvicorn (pip install uvicorn)") from None
+        from ...web.asgi import AsgiBridge
+        logging.debug("using uvicorn async server")
+        server = config.getinterface('web', 'server', fallback={})
+        host = server.getstr('host', fallback="0.0.0.0")
+        unsupported = set(config.get('web', 'server', fallback={}).keys()) \
+            - {"host", "port", "unix_socket", "threads", "backlog"}
+        if unsupported:
+            logging.warning(f"web.server options not supported in async server-mode: {', '.join(sorted(unsupported))}")
+        uvicorn.run(
+            AsgiBridge(app, threads=server.getint('threads', fallback=16)),
+            host="0.0.0.0" if host == "*" else host,
+            port=server.getint('port', fallback=8080),
+            uds=server.getstr('unix_socket', fallback=None),
+            backlog=server.getint('backlog', fallback=2048),
+            lifespan="on",
+            proxy_headers=False,  # web.proxy_fix
+            server_header=False,
+            log_config=None,
+        )
     else:
         import waitress
         logging.debug("using waitress production server")
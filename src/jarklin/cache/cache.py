@@ -13,8 +13,14 @@ from filelock import FileLock
 from configlib import ConfigInterface
 from ..common.types import MediaEntry, ProblemEntry
 from ..common import dot_ignore, scheduling
+from ..common.media import JsonListWriter
+from ..common.ffprobe import FFProbeCache, get_ffprobe_cache
+from .watcher import Watcher, create_watcher
 from .generator import CacheGenerator, GalleryCacheGenerator, VideoCacheGenerator
-from .util import is_video_file, is_gallery, is_deprecated, get_creation_time, get_modification_time, is_cache
+from .index import ScanIndex
+from .priority import JobQueue, DEFAULT_PRIORITY
+from .stats import CacheStats, StageTiming
+from .util import is_video_file, is_deprecated, get_creation_time, get_modification_time, is_cache
 try:
     from better_exceptions import format_exception
 except ModuleNotFoundError:
@@ -25,6 +31,28 @@ __all__ = ['Cache']
 
 
 logger = logging.getLogger(__name__)
+_worker_config: t.Optional[ConfigInterface] = None
+
+
+def _init_worker(config: ConfigInterface, ffmpeg_limiter: t.Optional[t.ContextManager]) -> None:
+    r"""
+    initializer for the worker-processes of Cache.generate()
+    """
+    global _worker_config
+    from ..common import ffmpeg
+    _worker_config = config
+    ffmpeg.set_limiter(ffmpeg_limiter)
+
+
+def _run_generator(generator_cls: t.Type[CacheGenerator], source: Path, dest: Path) \
+        -> t.Tuple[t.Dict[str, StageTiming], float]:
+    r"""
+    runs in a worker-process. the generator is recreated as only the paths are send to the worker.
+    returns the timings of the stages and the total wall-time as the generator itself stays in the worker
+    """
+    generator = generator_cls(source=source, dest=dest, config=_worker_config)
+    generator.generate()
+    return generator.timings, generator.wall
 
 
 class Cache:
@@ -64,14 +92,72 @@ class Cache:
     def cache_lock(self) -> FileLock:
         return FileLock(self.jarklin_path / "cache.lock")
 
-    # todo: replace with file-system-monitoring
+    @cached_property
+    def media_writer(self) -> JsonListWriter[MediaEntry]:
+        return JsonListWriter(self.jarklin_path / 'media.json', key='path')
+
+    @cached_property
+    def problems_writer(self) -> JsonListWriter[ProblemEntry]:
+        return JsonListWriter(self.jarklin_path / 'problems.json', key='file')
+
+    @cached_property
+    def stats(self) -> CacheStats:
+        return CacheStats(self.jarklin_path)
+
+    @cached_property
+    def scan_index(self) -> ScanIndex:
+        return ScanIndex(
+            fp=self.jarklin_path / "scan-index.db",
+            root=self.root,
+            ignored=self.ignorer.ignored,
+            fingerprint=json.dumps(self._config.getsplit('cache', 'ignore', fallback=[])),
+        )
+
+    @cached_property
+    def ffprobe_cache(self) -> FFProbeCache:
+        return get_ffprobe_cache(self.root)
+
+    @cached_property
+    def workers(self) -> int:
+        return self._config.getint('cache', 'workers', fallback=1)
+
+    @cached_property
+    def ffmpeg_processes(self) -> t.Optional[int]:
+        return self._config.getint('cache', 'ffmpeg_processes', fallback=None)
+
+    @cached_property
+    def priority(self) -> t.List[str]:
+        return self._config.getsplit('cache', 'priority', fallback=DEFAULT_PRIORITY)
+
+    @cached_property
+    def watch_enabled(self) -> bool:
+        return self._config.getbool('cache', 'watch', 'enabled', fallback=False)
+
+    @cached_property
+    def watch_method(self) -> str:
+        return self._config.getstr('cache', 'watch', 'method', fallback="auto")
+
+    @cached_property
+    def watch_delay(self) -> float:
+        return self._config.getfloat('cache', 'watch', 'delay', fallback=10)
+
+    @cached_property
+    def watch_polling_interval(self) -> float:
+        return self._config.getfloat('cache', 'watch', 'polling_interval', fallback=60)
+
     def run(self) -> None:
         import time
         import schedule
 
         scheduler = schedule.Scheduler()
-        scheduler.every(1).hour.at(":00").do(self.iteration)
-        shutdown_event, thread = scheduling.run_continuously(scheduler, interval=5)
+        watcher = None
+        if self.watch_enabled:
+            watcher = create_watcher(root=self.root, ignored=self.is_ignored, method=self.watch_method,
+                                     polling_interval=self.watch_polling_interval)
+            scheduler.every(self.watch_delay).seconds.do(self.process_changes, watcher=watcher)
+        else:
+            scheduler.every(1).hour.at(":00").do(self.iteration)
+        shutdown_event, thread = scheduling.run_continuously(scheduler, interval=1 if watcher else 5)
         self._shutdown_event = shutdown_event
         try:
             while thread.is_alive():
@@ -84,6 +170,8 @@ class Cache:
                 time.sleep(1)
         finally:
             self._shutdown_event = None
+            if watcher is not None:
+                watcher.stop()
 
     def shutdown(self) -> None:
         if self._shutdown_event is None:
@@ -96,47 +184,115 @@ class Cache:
         """
         shutil.rmtree(self.jarklin_cache, ignore_errors=ignore_errors)
 
-    def iteration(self) -> None:
+    def is_ignored(self, path: Path) -> bool:
+        r"""
+        checks if the path or any of its parents (up to the root) is ignored
+        """
+        path = Path(path)
+        if path == self.root:
+            return False
+        if self.root not in path.parents:
+            return True
+        return any(self.ignorer.ignored(fp) for fp in (path, *path.parents) if self.root in fp.parents)
+
+    def process_changes(self, watcher: Watcher) -> None:
+        r"""
+        runs an iteration for the paths the watcher reported. paths that are still being written to are deferred
+        """
+        import time
+
+        changes = watcher.pop_changes()
+        if changes is None:
+            logger.info("Cache - full rescan")
+            self.iteration()
+            return
+        if not changes:
+            return
+
+        settled: t.Set[Path] = set()
+        pending: t.Set[Path] = set()
+        for path in changes:
+            try:
+                mtime = path.stat().st_mtime
+            except OSError:
+                mtime = 0
+            (pending if time.time() - mtime < self.watch_delay else settled).add(path)
+        if pending:
+            logger.debug(f"Cache - deferring {len(pending)} recently modified paths")
+            watcher.requeue(pending)
+        if settled:
+            logger.info(f"Cache - processing {len(settled)} changed paths")
+            self.iteration(paths=settled)
+
+    def iteration(self, paths: t.Optional[t.Iterable[Path]] = None) -> None:
         r"""
         runs invalidate() and then generate() with simple lock against other instances
         """
+        if paths is not None:
+            paths = list(paths)
         with self.cache_lock:
-            self.invalidate()
-            self.generate()
+            self.invalidate(paths=paths)
+            self.generate(paths=paths)
 
-    def invalidate(self) -> None:
+    def invalidate(self, paths: t.Optional[t.List[Path]] = None) -> None:
         r"""
-        removes all cache entries that don't have their counterpart, are deprecated our incomplete
+        removes all cache entries that don't have their counterpart, are deprecated our incomplete.
+        if paths are given only the entries of these (and their parent-directories) are checked
         """
         logger.info("cache.invalidate()")
-        for root, dirnames, files in os.walk(self.jarklin_cache):
+        if paths is None:
+            self._invalidate_tree(self.jarklin_cache)
+            self.ffprobe_cache.prune()
+            return
+
+        for path in paths:
+            dest = self.jarklin_cache.joinpath(path.relative_to(self.root))
+            if dest.is_dir():
+                self._invalidate_entry(dest)
+                self._invalidate_tree(dest)
+            if path.parent != self.root:
+                self._invalidate_entry(dest.parent)
+
+    def _invalidate_tree(self, top: Path) -> None:
+        for root, dirnames, files in os.walk(top):
             if not dirnames and not files:
                 os.rmdir(root)
                 continue
 
             for dirname in dirnames:
-                dest = Path(root, dirname)
-                source = dest.relative_to(self.jarklin_cache)
-                if not is_cache(fp=dest):
-                    continue
-                if (
-                    not source.exists()
-                    or is_deprecated(source=source, dest=dest)
-                    or CacheGenerator.is_incomplete(fp=dest)
-                ):
-                    logger.info(f"removing {str(source)!r} from cache")
-                    CacheGenerator.remove(fp=dest)
-
-    def generate(self) -> None:
+                self._invalidate_entry(Path(root, dirname))
+
+    def _invalidate_entry(self, dest: Path) -> None:
+        if not is_cache(fp=dest):
+            return
+        source = self.root.joinpath(dest.relative_to(self.jarklin_cache))
+        if (
+            not source.exists()
+            or is_deprecated(source=source, dest=dest)
+            or (CacheGenerator.is_incomplete(fp=dest) and not CacheGenerator.is_resumable(fp=dest))
+        ):
+            logger.info(f"removing {str(source)!r} from cache")
+            CacheGenerator.remove(fp=dest)
+
+    def generate(self, paths: t.Optional[t.List[Path]] = None) -> None:
         r"""
-        generates the missing or deprecated entries into the cache
+        generates the missing or deprecated entries into the cache.
+        if paths are given only these (and their parent-directories) are checked
         """
         logger.info("cache.generate()")
-        media: t.List[MediaEntry] = []
-        problems: t.List[ProblemEntry] = []
-        generators: t.List[CacheGenerator] = self.find_generators()
+        generators: t.List[CacheGenerator] = self.find_generators(paths=paths)
         jobs: t.List[CacheGenerator] = []
 
+        if paths is None:
+            self.media_writer.clear()
+            self.problems_writer.clear()
+        else:
+            def is_affected(key: str) -> bool:
+                return self._is_affected(self.root.joinpath(key), paths)
+
+            self.media_writer.discard(is_affected)
+            self.problems_writer.discard(is_affected)
+
         # adds existing cache entries into media-list
         for generator in generators:
             source = generator.source
@@ -146,31 +302,84 @@ class Cache:
                 jobs.append(generator)
             else:
                 logger.debug(f"Cache - adding info for {source!s}")
-                media.append(self._get_media_entry(generator))
+                self.media_writer.update(self._get_media_entry(generator))
 
-        self._write_media(media=media)
+        self.media_writer.flush()
+        self.problems_writer.flush()
 
         # generate missing cache entries and add them to media-list
-        for generator in jobs:
-            source = generator.source
-            dest = generator.dest
-            logger.info(f"Cache - generating {generator}")
-            try:
-                generator.generate()
-            except Exception as error:
-                logger.error(f"Cache: generation failed ({generator})", exc_info=error)
-                problems.append(ProblemEntry(
-                    file=str(source.relative_to(self.root)),
-                    type=type(error).__name__,
-                    description=str(error),
-                    traceback='\n'.join(format_exception(type(error), error, error.__traceback__))
-                ))
-                if dest.is_dir():
-                    CacheGenerator.remove(fp=dest)
-                self._write_problems(problems=problems)
-            else:
-                media.append(self._get_media_entry(generator=generator))
-                self._write_media(media=media)
+        self.stats.start_generation(jobs=len(jobs))
+        try:
+            for generator, error in self._run_jobs(jobs=jobs):
+                source = generator.source
+                dest = generator.dest
+                self.stats.add(
+                    kind=generator.kind, path=str(source.relative_to(self.root)),
+                    timings=generator.timings, wall=generator.wall, failed=error is not None,
+                )
+                if error is not None:
+                    logger.error(f"Cache: generation failed ({generator})", exc_info=error)
+                    self.problems_writer.add(ProblemEntry(
+                        file=str(source.relative_to(self.root)),
+                        type=type(error).__name__,
+                        description=str(error),
+                        traceback='\n'.join(format_exception(type(error), error, error.__traceback__))
+                    ))
+                    if dest.is_dir():
+                        CacheGenerator.remove(fp=dest)
+                else:
+                    self.media_writer.add(self._get_media_entry(generator=generator))
+        finally:
+            self.media_writer.flush()
+            self.problems_writer.flush()
+            self.stats.finish_generation()
+
+    def _run_jobs(self, jobs: t.List[CacheGenerator]) \
+            -> t.Iterator[t.Tuple[CacheGenerator, t.Optional[Exception]]]:
+        r"""
+        runs the generators and yields them together with their error (if any) once they are done.
+        with cache.workers > 1 the generators run in a process-pool. results are still handled in this process.
+        the next generator is only taken from the queue (cache.priority) once a worker is free
+        """
+        queue = JobQueue(jobs, priority=self.priority, root=self.root,
+                         requested_fp=self.jarklin_path / "requested.json")
+        if self.workers <= 1 or len(jobs) <= 1:
+            while queue:
+                generator = queue.pop()
+                logger.info(f"Cache - generating {generator}")
+                try:
+                    generator.generate()
+                except Exception as error:
+                    yield generator, error
+                else:
+                    yield generator, None
+            return
+
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+        ffmpeg_limiter = None
+        if self.ffmpeg_processes is not None:
+            logger.debug(f"Cache - limiting to {self.ffmpeg_processes} concurrent ffmpeg processes")
+            ffmpeg_limiter = multiprocessing.BoundedSemaphore(self.ffmpeg_processes)
+
+        logger.info(f"Cache - generating with {self.workers} workers")
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                 initargs=(self._config, ffmpeg_limiter)) as executor:
+            running = {}
+            while queue or running:
+                while queue and len(running) < self.workers:
+                    generator = queue.pop()
+                    logger.info(f"Cache - queueing {generator}")
+                    future = executor.submit(_run_generator, type(generator), generator.source, generator.dest)
+                    running[future] = generator
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    generator = running.pop(future)
+                    error = future.exception()
+                    if error is None:
+                        generator.timings, generator.wall = future.result()
+                    yield generator, error
 
     def _get_media_entry(self, generator: CacheGenerator) -> MediaEntry:
         source, dest = generator.source, generator.dest
@@ -183,50 +392,63 @@ class Cache:
             meta=json.loads(dest.joinpath("meta.json").read_bytes()),
         )
 
-    def _write_media(self, media: t.List[MediaEntry]) -> None:
-        logger.info("Cache - updating media.json")
-        with open(self.jarklin_path / 'media.json', 'w') as fp:
-            fp.write(json.dumps(media))
-
-    def _write_problems(self, problems: t.List[ProblemEntry]) -> None:
-        logger.info("Cache - updating problems.json")
-        with open(self.jarklin_path / 'problems.json', 'w') as fp:
-            fp.write(json.dumps(problems))
+    @staticmethod
+    def _is_affected(source: Path, paths: t.Iterable[Path]) -> bool:
+        r"""
+        checks if source is one of the paths, below one of them or the directory of one of them
+        """
+        return any(source == path or path in source.parents or source == path.parent for path in paths)
 
-    def find_generators(self) -> t.List[CacheGenerator]:
+    def find_generators(self, paths: t.Optional[t.List[Path]] = None) -> t.List[CacheGenerator]:
         r"""
-        finds all possible source-entries that should be in the cache
+        finds all possible source-entries that should be in the cache.
+        if paths are given only these (and their parent-directories) are checked
         """
         logger.info("Collecting Generators")
-        generators: t.List[CacheGenerator] = []
-
-        for root, dirnames, filenames in os.walk(self.root):
-            # galleries
-            for dirname in dirnames[:]:
-                source = Path(root, dirname)
-                dest = self.jarklin_cache.joinpath(source.relative_to(self.root))
-
-                if self.ignorer.ignored(source):
-                    logger.debug(f"Cache - ignoring {source!s}")
-                    dirnames.remove(dirname)
-                    continue
-
-                if is_gallery(source):
-                    logger.debug(f"Cache - found gallery {source!s}")
-                    generators.append(GalleryCacheGenerator(source=source, dest=dest, config=self._config))
-
-            # videos
-            for filename in filenames[:]:
-                source = Path(root, filename)
-                dest = self.jarklin_cache.joinpath(source.relative_to(self.root))
-
-                if self.ignorer.ignored(source):
-                    logger.debug(f"Cache - ignoring {source!s}")
-                    filenames.remove(filename)
-                    continue
-
-                if is_video_file(source):
-                    logger.debug(f"Cache - found video {source!s}")
-                    generators.append(VideoCacheGenerator(source=source, dest=dest, config=self._config))
-
-        return sorted(generators, key=lambda g: str(g.source).lower())
+        generators: t.Dict[Path, CacheGenerator] = {}
+
+        with self.scan_index as index:
+            if paths is None:
+                tops = [self.root]
+            else:
+                tops = []
+                for path in paths:
+                    if self.is_ignored(path):
+                        continue
+                    if path.is_dir():
+                        tops.append(path)
+                    elif path.is_file():
+                        self._add_video_generator(generators, source=path)
+                    if path.parent != self.root and not self.is_ignored(path.parent):
+                        info = index.scan(path.parent)
+                        if info is not None and info.is_gallery:
+                            self._add_gallery_generator(generators, source=path.parent)
+
+            for top in tops:
+                for directory, info, is_link in index.walk(top):
+                    if info.is_gallery:
+                        self._add_gallery_generator(generators, source=directory)
+                    if is_link:  # like os.walk(), linked directories are only listed but not entered
+                        continue
+                    for filename in info.videos:
+                        self._add_video_generator(generators, source=directory.joinpath(filename))
+
+            if paths is None:
+                index.prune()
+
+        return sorted(generators.values(), key=lambda g: str(g.source).lower())
+
+    def _add_gallery_generator(self, generators: t.Dict[Path, CacheGenerator], source: Path) -> None:
+        if source == self.root or source in generators:
+            return
+        logger.debug(f"Cache - found gallery {source!s}")
+        dest = self.jarklin_cache.joinpath(source.relative_to(self.root))
+        generators[source] = GalleryCacheGenerator(source=source, dest=dest, config=self._config)
+
+    def _add_video_generator(self, generators: t.Dict[Path, CacheGenerator], source: Path) -> None:
+        if source in generators:
+            return
+        if is_video_file(source):
+            logger.debug(f"Cache - found video {source!s}")
+            dest = self.jarklin_cache.joinpath(source.relative_to(self.root))
+            generators[source] = VideoCacheGenerator(source=source, dest=dest, config=self._config)
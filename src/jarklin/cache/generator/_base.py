@@ -10,7 +10,12 @@ r"""
 ├─ meta.json
 ├─ {gallery,video}.type
 ├─ is-cache
+├─ stages.json      only while generating. completed stages that are skipped when an interrupted generation resumes
 """
+import json
+import time
+import shutil
+import hashlib
 import logging
 import functools
 import typing as t
@@ -18,18 +23,31 @@ from pathlib import Path
 from abc import abstractmethod
 from configlib import ConfigInterface
 from ...common.types import PathSource
+from ...common.atomic import atomic_write
+from ..stats import StageTiming, measure
 
 
 logger = logging.getLogger(__name__)
+STAGES_FILE = "stages.json"
 
 
 class CacheGenerator:
+    kind: t.ClassVar[str]  # name in the statistics
+    # stages that need the in-memory results of another stage. the other stage is repeated when they resume
+    stage_requirements: t.ClassVar[t.Dict[str, t.Tuple[str, ...]]] = {
+        'generate_image_preview': ('generate_previews',),
+        'generate_animated_preview': ('generate_previews',),
+    }
+
     def __init__(self, source: PathSource, dest: PathSource, config: ConfigInterface):
         self.source = Path(source)
         if not self.source.exists():
             raise FileNotFoundError(str(self.source))
         self.dest = Path(dest)
         self.config = config
+        self.timings: t.Dict[str, StageTiming] = {}  # resource-usage per stage of the last generate()
+        self.wall = 0.0  # wall-time of the last generate()
+        self._completed: t.Set[str] = set()
 
     @functools.cached_property
     def root(self) -> Path:
@@ -55,8 +73,10 @@ class CacheGenerator:
             fp/"meta.json",
             fp/"preview.webp",
             fp/"animated.webp",
+            fp/"storyboard.webp",
             next(fp.glob("*.type"), None),
             *fp.glob("*.vtt"),
+            fp/STAGES_FILE,
             fp/"is-cache",
         ]
         for f in files:
@@ -64,6 +84,10 @@ class CacheGenerator:
                 logger.debug(f"Removing {f!s}")
                 f.unlink()
 
+        # temporary images of an interrupted generation
+        shutil.rmtree(fp/".animated", ignore_errors=True)
+        shutil.rmtree(fp/".frames", ignore_errors=True)
+
         previews = fp/"previews"
         if previews.is_dir():
             for f in previews.glob("*.webp"):
@@ -75,6 +99,22 @@ class CacheGenerator:
             else:
                 logger.debug(f"Not removing {previews!s} as it contains unknown files")
 
+        variants = fp/"variants"
+        if variants.is_dir():
+            for directory in variants.iterdir():
+                if not directory.is_dir():
+                    continue
+                for f in directory.glob("*.webp"):
+                    logger.debug(f"Removing {f!s}")
+                    f.unlink()
+                if next(directory.iterdir(), None) is None:
+                    directory.rmdir()
+            if next(variants.iterdir(), None) is None:
+                logger.debug(f"Removing {variants!s}")
+                variants.rmdir()
+            else:
+                logger.debug(f"Not removing {variants!s} as it contains unknown files")
+
         if next(fp.iterdir(), None) is None:
             logger.debug(f"Removing {previews!s}")
             fp.rmdir()
@@ -101,6 +141,9 @@ class CacheGenerator:
         if not fp.joinpath("is-cache").is_file():
             logger.debug(f"missing is-cache")
             return True
+        if fp.joinpath(STAGES_FILE).is_file():
+            logger.debug(f"generation was interrupted")
+            return True
 
         previews = fp/"previews"
         if not previews.is_dir():
@@ -113,35 +156,102 @@ class CacheGenerator:
         logger.debug(f"{fp!s} is not incomplete")
         return False
 
+    @staticmethod
+    def is_resumable(fp: PathSource) -> bool:
+        r"""
+        checks if fp is from an interrupted generation that can be continued
+        """
+        return Path(fp).joinpath(STAGES_FILE).is_file()
+
     @t.final
     def generate(self) -> None:
         logger.info(f"{self}.generate()")
-        if self.dest.is_dir():
+        stages = (self.mark_cache, self.generate_meta, self.generate_previews, self.generate_image_preview,
+                  self.generate_animated_preview, self.generate_extra, self.generate_type, self.cleanup)
+
+        self._completed = self._load_completed_stages()
+        if self._completed:
+            for stage in stages:
+                if stage.__name__ not in self._completed:
+                    self._completed.difference_update(self.stage_requirements.get(stage.__name__, ()))
+            self.restore()
+            logger.info(f"{self} - resuming interrupted generation ({len(self._completed)} stages completed)")
+        elif self.dest.is_dir():
             CacheGenerator.remove(fp=self.dest)
         self.dest.mkdir(parents=True, exist_ok=True)
 
+        self.timings = {}
+        start = time.perf_counter()
         try:
-            logger.info(f"{self}.mark_cache()")
-            self.mark_cache()
-            logger.info(f"{self}.generate_meta()")
-            self.generate_meta()
-            logger.info(f"{self}.generate_previews()")
-            self.generate_previews()
-            logger.info(f"{self}.generate_image_preview()")
-            self.generate_image_preview()
-            logger.info(f"{self}.generate_animated_preview()")
-            self.generate_animated_preview()
-            logger.info(f"{self}.generate_extra()")
-            self.generate_extra()
-            logger.info(f"{self}.generate_type()")
-            self.generate_type()
-            logger.info(f"{self}.cleanup()")
-            self.cleanup()
+            for stage in stages:
+                self._run_stage(stage)
+            self.dest.joinpath(STAGES_FILE).unlink(missing_ok=True)
         except Exception as err:
             logger.error(f"Exception while generating cache ({type(err).__name__}). doing cleanup before re-raising")
             self.cleanup()
             self.remove(self.dest)
             raise err
+        finally:
+            self.wall = time.perf_counter() - start
+
+    def restore(self) -> None:
+        r"""
+        called before an interrupted generation continues.
+        restores what the completed stages kept on disk for the following ones
+        """
+
+    def _run_stage(self, stage: t.Callable[[], None]) -> None:
+        r"""
+        runs the stage unless it was completed before the generation got interrupted.
+        subclasses can use this for the parts of their stages (e.g. in generate_extra()).
+        the timing of a stage excludes the stages that run inside of it, so the timings never overlap
+        """
+        name = stage.__name__
+        if name in self._completed:
+            logger.info(f"{self}.{name}() was completed in a previous run")
+            return
+        logger.debug(f"{self}.{name}()")
+        nested_before = self._timings_except(name)
+        with measure(self.timings, name):
+            stage()
+        timing = self.timings[name]
+        self.timings[name] = timing - (self._timings_except(name) - nested_before)
+        logger.info(f"{self}.{name}() took {timing.wall:.2f}s (cpu: {timing.cpu:.2f}s, "
+                    f"children: {timing.children_cpu:.2f}s, read: {timing.read_bytes / 1024 ** 2:.1f}MiB, "
+                    f"written: {timing.write_bytes / 1024 ** 2:.1f}MiB)")
+        self._completed.add(name)
+        atomic_write(self.dest.joinpath(STAGES_FILE), json.dumps(dict(
+            fingerprint=self._fingerprint,
+            completed=sorted(self._completed),
+        )))
+
+    def _timings_except(self, name: str) -> StageTiming:
+        return sum((timing for stage, timing in self.timings.items() if stage != name), StageTiming())
+
+    def _load_completed_stages(self) -> t.Set[str]:
+        try:
+            state = json.loads(self.dest.joinpath(STAGES_FILE).read_bytes())
+        except (FileNotFoundError, ValueError):
+            return set()
+        if state.get('fingerprint') != self._fingerprint:
+            logger.info(f"{self} - source or config changed since the interrupted generation. starting over")
+            return set()
+        return set(state.get('completed', []))
+
+    @functools.cached_property
+    def _fingerprint(self) -> str:
+        r"""
+        completed stages are only reused for the same source and cache-configuration
+        """
+        config = json.dumps(self.config.get('cache', self.kind, fallback={}), sort_keys=True, default=str)
+        return f"{self.source_fingerprint()}-{hashlib.sha1(config.encode('utf-8')).hexdigest()}"
+
+    def source_fingerprint(self) -> str:
+        r"""
+        changes if the source changes
+        """
+        stat = self.source.stat()
+        return f"{stat.st_size}-{stat.st_mtime_ns}"
 
     @t.final
     def mark_cache(self):
@@ -13,12 +13,17 @@ gallery/
 ├─ previews/
 │  ├─ 1.webp
 │  ├─ 2.webp
+├─ variants/  (optional. cache.gallery.variants)
+│  ├─ 1280/
+│  │  ├─ {filename}.webp
 ├─ meta.json
 ├─ gallery.type
 ├─ is-cache
 """
+import os
 import re
 import shutil
+import hashlib
 import logging
 import mimetypes
 import typing as t
@@ -35,6 +40,8 @@ logger = logging.getLogger(__name__)
 
 
 class GalleryCacheGenerator(CacheGenerator):
+    kind = "gallery"
+
     @cached_property
     def max_dimensions(self) -> t.Tuple[int, int]:
         width = self.config.getint('cache', 'gallery', 'dimensions', 'width', fallback=None)
@@ -53,6 +60,10 @@ class GalleryCacheGenerator(CacheGenerator):
     def animated_max_images(self) -> int:
         return self.config.getint('cache', 'gallery', 'animated', 'max_images', fallback=20)
 
+    @cached_property
+    def variant_widths(self) -> t.List[int]:
+        return sorted(set(self.config.getsplit('cache', 'gallery', 'variants', fallback=[], cast=int)))
+
     # ---------------------------------------------------------------------------------------------------------------- #
 
     def generate_meta(self) -> None:
@@ -124,6 +135,31 @@ class GalleryCacheGenerator(CacheGenerator):
             first.save(self.dest.joinpath("animated.webp"), format="WEBP", save_all=True, minimize_size=True,
                        append_images=frames, duration=round(self.frame_time * 1000), loop=0, method=6, quality=80)
 
+    def generate_extra(self) -> None:
+        r"""
+        pre-renders the images in the configured widths so the web doesn't have to optimize them on request
+        """
+        if not self.variant_widths:
+            return
+
+        for info in self.meta['images']:
+            if info['is_animated']:  # served unchanged
+                continue
+            fp = self.source.joinpath(info['filename'])
+            widths = [width for width in self.variant_widths if width < info['width']]  # no upscaling
+            if not widths:
+                continue
+            with Image.open(fp) as image:
+                # jpeg can decode directly at a lower scale which is a lot faster for large scans
+                image.draft(image.mode, (widths[-1], round(image.height * widths[-1] / image.width)))
+                for width in widths:
+                    logger.debug(f"{self}: {fp.name} - rendering variant with width {width}")
+                    height = round(info['height'] * width / info['width'])
+                    variant = image.resize((width, height), resample=Image.Resampling.LANCZOS)
+                    directory = self.dest.joinpath("variants", str(width))
+                    directory.mkdir(parents=True, exist_ok=True)
+                    variant.save(directory.joinpath(f"{fp.name}.webp"), format='WEBP', method=6, quality=80)
+
     def generate_type(self) -> None:
         self.dest.joinpath("gallery.type").touch()
 
@@ -137,6 +173,16 @@ class GalleryCacheGenerator(CacheGenerator):
         path.mkdir(parents=True)
         return path
 
+    def source_fingerprint(self) -> str:
+        r"""
+        the stat of the directory misses images that were overwritten in-place
+        """
+        files = []
+        for fp in self.get_relevant_files_for_source(self.source):
+            stat = os.stat(fp)
+            files.append(f"{Path(fp).name}:{stat.st_size}:{stat.st_mtime_ns}")
+        return hashlib.sha1("\n".join(files).encode('utf-8')).hexdigest()
+
     @cached_property
     def meta(self) -> GalleryMeta:
         relevant_files = self.get_relevant_files_for_source(self.source)
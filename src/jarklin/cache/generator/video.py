@@ -9,21 +9,26 @@ video.mp4/
 ├─ meta.json
 ├─ video.type
 ├─ is-cache
+├─ .frames/         only while generating. the extracted frames, so a resumed generation doesn't decode again
 """
+import re
+import json
 import shutil
 import logging
 import mimetypes
 import typing as t
 from pathlib import Path
-from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor
 from functools import cached_property
 import undertext
 from PIL import Image, ImageStat
+from configlib import ConfigInterface
 from ...common.types import (
-    VideoMeta, VideoStreamMeta, AudioStreamMeta, SubtitleStreamMeta, ChapterMeta
+    PathSource, VideoMeta, VideoStreamMeta, AudioStreamMeta, SubtitleStreamMeta, ChapterMeta
 )
-from ...common.ffmpeg import ffmpeg
-from ...common.ffprobe import ffprobe
+from ...common.atomic import atomic_write
+from ...common.ffmpeg import ffmpeg, FramePipe, open_frame
+from ...common.ffprobe import get_ffprobe_cache
 from ...common.ffprobe.model import (
     FFProbe as FFProbeResult,
     Chapter as FFProbeChapter,
@@ -34,7 +39,27 @@ from ._base import CacheGenerator
 logger = logging.getLogger(__name__)
 
 
+SHOWINFO_PTS_TIME = re.compile(r"\[Parsed_showinfo.*\bpts_time:\s*(-?[0-9.]+)")
+# containers without (reliable) index where input-seeking is inaccurate
+UNSEEKABLE_FORMATS = {'mpegts', 'mpeg', 'mpegvideo', 'h264', 'hevc', 'm4v', 'rawvideo', 'yuv4mpegpipe'}
+# relative difference of r_frame_rate and avg_frame_rate above which a video counts as variable frame-rate
+VFR_TOLERANCE = 0.01
+FRAMES_DIR = ".frames"
+FRAMES_STATE = "extracted.json"
+
+
 class VideoCacheGenerator(CacheGenerator):
+    kind = "video"
+    stage_requirements = {}  # the frames are kept on disk (see restore())
+
+    def __init__(self, source: PathSource, dest: PathSource, config: ConfigInterface):
+        super().__init__(source=source, dest=dest, config=config)
+        # frames received from ffmpeg (compressed, see open_frame()).
+        # the previews are grouped by scene (main-frame + following frames of the scene)
+        self.preview_images: t.List[bytes] = []
+        self.thumbnail_images: t.List[bytes] = []
+        self._thumbnail_timestamps: t.Optional[t.List[float]] = None
+
     @cached_property
     def max_dimensions(self) -> t.Tuple[int, int]:
         width = self.config.getint('cache', 'video', 'dimensions', 'width', fallback=None)
@@ -57,6 +82,14 @@ class VideoCacheGenerator(CacheGenerator):
     def scene_offset(self) -> float:
         return self.config.getfloat('cache', 'video', 'animated', 'scene_offset', fallback=5)
 
+    @cached_property
+    def extraction_method(self) -> str:
+        return self.config.getstr('cache', 'video', 'extraction', 'method', fallback="decode")
+
+    @cached_property
+    def extraction_parallel(self) -> int:
+        return self.config.getint('cache', 'video', 'extraction', 'parallel', fallback=2)
+
     @cached_property
     def thumbnails_enabled(self) -> bool:
         return self.config.getbool('cache', 'video', 'thumbnails', 'enabled', fallback=True)
@@ -65,6 +98,10 @@ class VideoCacheGenerator(CacheGenerator):
     def thumbnails_delay(self) -> float:
         return self.config.getfloat('cache', 'video', 'thumbnails', 'delay', fallback=15)
 
+    @cached_property
+    def thumbnails_mode(self) -> str:
+        return self.config.getstr('cache', 'video', 'thumbnails', 'mode', fallback="decode")
+
     @cached_property
     def thumbnails_dimensions(self) -> t.Tuple[int, int]:
         width = self.config.getint('cache', 'video', 'thumbnails', 'dimensions', 'width', fallback=None)
@@ -81,11 +118,323 @@ class VideoCacheGenerator(CacheGenerator):
     # ---------------------------------------------------------------------------------------------------------------- #
 
     def generate_meta(self) -> None:
-        import json
         with open(self.dest / "meta.json", 'w') as file:
             file.write(json.dumps(self.meta))
 
     def generate_previews(self) -> None:
+        if self.extraction_method == "seek":
+            if self.is_seekable:
+                try:
+                    self.extract_previews_by_seeking()
+                except Exception as error:
+                    logger.warning(f"{self} - seeking failed. falling back to decoding", exc_info=error)
+            else:
+                logger.info(f"{self} - can't seek accurately. decoding instead")
+        # after seeking, decoding only for the thumbnails would undo the gain. generate_storyboard() uses keyframes then
+        seeked = 'previews' in self._extracted
+        self.extract(previews=True, thumbnails=self.thumbnails_enabled and self.thumbnails_mode == "decode"
+                     and not seeked, subtitles=True)
+
+        actual_previews = len(self.preview_images)
+        expected_previews = len(self.preview_frames)
+        if actual_previews != expected_previews:
+            message = (f"The number of extracted frames does not match the expected amount."
+                       f" (actual={actual_previews} != expected={expected_previews})")
+            logger.error(f"{self} - {message}")
+            raise RuntimeError(message)
+
+        logger.debug(f"{self} - saving main-frames to previews/")
+        for i, frame in enumerate(self.main_images):
+            with open_frame(frame) as image:
+                image.save(self.previews_dir.joinpath(f"{i+1}.webp"), format='WEBP', minimize_size=True, method=6,
+                           quality=80)
+        self.save_frames()
+
+    def save_frames(self) -> None:
+        r"""
+        keeps the extracted frames in .frames/ until cleanup(). the stage only completes once they are written
+        """
+        directory = self.dest.joinpath(FRAMES_DIR)
+        counts = {}
+        for kind, frames in (("previews", self.preview_images), ("thumbnails", self.thumbnail_images)):
+            if kind not in self._extracted:
+                continue
+            directory.joinpath(kind).mkdir(parents=True, exist_ok=True)
+            for i, frame in enumerate(frames):
+                directory.joinpath(kind, f"{i+1}.webp").write_bytes(frame)
+            counts[kind] = len(frames)
+        atomic_write(directory.joinpath(FRAMES_STATE), json.dumps(dict(
+            extracted=sorted(self._extracted),
+            counts=counts,
+            thumbnail_timestamps=self._thumbnail_timestamps,
+        )))
+
+    def restore(self) -> None:
+        if 'generate_previews' not in self._completed:
+            return
+        directory = self.dest.joinpath(FRAMES_DIR)
+        try:
+            state = json.loads(directory.joinpath(FRAMES_STATE).read_bytes())
+            frames = {kind: [directory.joinpath(kind, f"{i+1}.webp").read_bytes() for i in range(count)]
+                      for kind, count in state['counts'].items()}
+        except (OSError, ValueError, KeyError) as error:
+            logger.warning(f"{self} - failed to restore the extracted frames ({error}). extracting again")
+            self._completed.discard('generate_previews')
+            return
+        self.preview_images = frames.get('previews', [])
+        self.thumbnail_images = frames.get('thumbnails', [])
+        self._thumbnail_timestamps = state.get('thumbnail_timestamps')
+        self._extracted.update(state['extracted'])
+        logger.debug(f"{self} - restored {len(self.preview_images)} previews"
+                     f" and {len(self.thumbnail_images)} thumbnails")
+
+    def extract(self, previews: bool = False, thumbnails: bool = False, subtitles: bool = False) -> None:
+        r"""
+        decodes the video only once and outputs the requested preview-frames, storyboard-thumbnails
+        and text-subtitles. outputs that were already extracted are skipped
+        """
+        previews = previews and 'previews' not in self._extracted
+        thumbnails = thumbnails and 'thumbnails' not in self._extracted
+        subtitles = subtitles and 'subtitles' not in self._extracted
+        if not (previews or thumbnails or subtitles):
+            return
+
+        video_input = f"0:{self.ffprobe.main_video_stream.index}"
+        filters: t.List[str] = []
+        outputs: t.List[t.Union[str, FramePipe]] = []
+        previews_pipe, thumbnails_pipe = FramePipe(), FramePipe()
+        labels: t.List[str] = []
+        if previews:
+            labels.append("previews")
+        if thumbnails:
+            labels.append("thumbnails")
+        if len(labels) > 1:
+            filters.append(f"[{video_input}]split={len(labels)}" + "".join(f"[{label}]" for label in labels))
+        elif labels:
+            labels = [video_input]
+
+        if previews:
+            scale = self.preview_scale
+            filters.append(f"[{labels.pop(0)}]" + ",".join((
+                "select=" + "+".join(f"eq(n\\,{frame})" for frame in self.preview_frames),  # the frames we want
+                f'scale={scale[0]}:{scale[1]}',  # re-scale images. (remove and with Pillow?)
+            )) + "[previews_out]")
+            outputs.extend([
+                '-map', "[previews_out]",
+                '-vframes', f"{len(self.preview_frames)}",  # number of frames to output. maybe could help slightly
+                '-vsync', f"{0}",  # don't know why anymore
+                *FramePipe.FORMAT,
+                previews_pipe,
+            ])
+
+        if thumbnails:
+            width, height = self.storyboard_dimensions
+            filters.append(f"[{labels.pop(0)}]fps=1/{self.thumbnails_delay},scale={width}:{height}[thumbnails_out]")
+            outputs.extend([
+                '-map', "[thumbnails_out]",
+                *FramePipe.FORMAT,
+                thumbnails_pipe,
+            ])
+
+        subtitle_outputs = self.subtitle_outputs if subtitles else {}
+        for index, fp in subtitle_outputs.items():
+            outputs.extend([
+                '-map', f"0:{index}",  # maps subtitle-stream to output-stream
+                str(fp),
+            ])
+
+        if not outputs:
+            self._extracted.add('subtitles')
+            return
+
+        logger.debug(f"{self}: running ffmpeg to extract"
+                     f" {'previews ' if previews else ''}{'thumbnails ' if thumbnails else ''}"
+                     f"{'subtitles' if subtitle_outputs else ''}")
+        args: t.List[t.Union[str, FramePipe]] = ['-i', str(self.source)]
+        if filters:
+            args.extend(['-filter_complex', ";".join(filters)])
+        args.extend([
+            '-y',  # overwrite if existing. prevent blocking
+            *outputs,
+        ])
+        try:
+            ffmpeg(args)
+        except Exception as error:
+            if not subtitle_outputs:
+                raise
+            # a broken subtitle-stream should not prevent the previews
+            logger.error(f"{self} - combined extraction failed. retrying without subtitles", exc_info=error)
+            for fp in subtitle_outputs.values():
+                fp.unlink(missing_ok=True)
+            self.extract(previews=previews, thumbnails=thumbnails)
+            self.extract_subtitles_separately()
+            return
+
+        if previews:
+            self.preview_images = previews_pipe.frames
+            self._extracted.add('previews')
+        if thumbnails:
+            self.thumbnail_images = thumbnails_pipe.frames
+            self._extracted.add('thumbnails')
+        if subtitles:
+            self._extracted.add('subtitles')
+
+    def extract_previews_by_seeking(self) -> None:
+        r"""
+        seeks to every scene and only decodes the few frames of it instead of the whole video.
+        results in the same frames as extract()
+        """
+        if 'previews' in self._extracted:
+            return
+        n_offsets = len(self.scene_offsets)
+        scenes = [self.preview_frames[i:i + n_offsets] for i in range(0, len(self.preview_frames), n_offsets)]
+        logger.debug(f"{self} - seeking to {len(scenes)} scenes")
+
+        def extract_scene(frames: t.List[int]) -> t.List[bytes]:
+            pipe = FramePipe()
+            start = frames[0]
+            # half a frame earlier so rounding can't skip the first frame
+            timestamp = max(0.0, float((start - 0.5) / self.stat_fps))
+            ffmpeg([
+                '-ss', f"{timestamp:.6f}",  # input-seeking. only decodes from the keyframe before
+                '-i', str(self.source),
+                '-map', f"0:{self.ffprobe.main_video_stream.index}",
+                '-vf', ",".join((
+                    "select=" + "+".join(f"eq(n\\,{frame - start})" for frame in frames),
+                    f'scale={self.preview_scale[0]}:{self.preview_scale[1]}',
+                )),
+                '-frames:v', f"{len(frames)}",
+                '-vsync', f"{0}",
+                *FramePipe.FORMAT,
+                pipe,
+            ])
+            return pipe.frames
+
+        with ThreadPoolExecutor(max_workers=self.extraction_parallel) as executor:
+            images = [image for frames in executor.map(extract_scene, scenes) for image in frames]
+
+        if len(images) != len(self.preview_frames):
+            raise RuntimeError(f"seeking extracted {len(images)} instead of {len(self.preview_frames)} frames")
+        self.preview_images = images
+        self._extracted.add('previews')
+
+    @cached_property
+    def is_seekable(self) -> bool:
+        r"""
+        whether input-seeking lands on the same frames as counting them while decoding.
+        the timestamp of a frame is only known for a constant frame-rate
+        """
+        format_names = set(self.ffprobe.format.format_name.split(","))
+        if format_names & UNSEEKABLE_FORMATS:
+            logger.debug(f"{self} - {self.ffprobe.format.format_name!r} has no reliable index")
+            return False
+        stream = self.ffprobe.main_video_stream
+        if not stream.avg_frame_rate or not stream.r_frame_rate \
+                or abs(stream.r_frame_rate - stream.avg_frame_rate) > stream.r_frame_rate * VFR_TOLERANCE:
+            logger.debug(f"{self} - variable frame-rate ({float(stream.r_frame_rate):.3f}fps "
+                         f"vs {float(stream.avg_frame_rate):.3f}fps on average)")
+            return False
+        return True
+
+    @cached_property
+    def preview_scale(self) -> t.Tuple[int, int]:
+        vw, vh = self.stat_width, self.stat_height
+        return (min(self.max_dimensions[0], vw), -2) if (vw > vh) else (-2, min(self.max_dimensions[1], vh))
+
+    def extract_keyframe_thumbnails(self) -> None:
+        r"""
+        only decodes keyframes and takes the first one after every thumbnails_delay seconds.
+        the timestamps of the used keyframes are remembered for the storyboard.vtt
+        """
+        if 'thumbnails' in self._extracted:
+            return
+        width, height = self.storyboard_dimensions
+        logger.debug(f"{self} - extracting keyframes as thumbnails")
+        pipe = FramePipe()
+        try:
+            result = ffmpeg([
+                '-skip_frame', 'nokey',  # the decoder drops all non-keyframes
+                '-i', str(self.source),
+                '-map', f"0:{self.ffprobe.main_video_stream.index}",
+                '-vf', ",".join((
+                    f"select=isnan(prev_selected_t)+gte(t-prev_selected_t\\,{self.thumbnails_delay})",
+                    f"scale={width}:{height}",
+                    "showinfo",  # reports the timestamps of the selected frames
+                )),
+                '-vsync', f"{0}",
+                *FramePipe.FORMAT,
+                pipe,
+            ])
+        except Exception as error:
+            logger.warning(f"{self} - keyframe extraction failed. falling back to decoding", exc_info=error)
+            return
+
+        start_time = self.ffprobe.format.start_time
+        timestamps = [max(0.0, float(match.group(1)) - start_time)
+                      for match in SHOWINFO_PTS_TIME.finditer(result.stderr.decode(errors='replace'))]
+        actual = len(pipe.frames)
+        if not timestamps or actual != len(timestamps):
+            logger.warning(f"{self} - got {actual} keyframes but {len(timestamps)} timestamps. falling back to decoding")
+            return
+        logger.debug(f"{self} - {actual} keyframes used as thumbnails")
+        self.thumbnail_images = pipe.frames
+        self._thumbnail_timestamps = timestamps
+        self._extracted.add('thumbnails')
+
+    @property
+    def main_images(self) -> t.List[bytes]:
+        return self.preview_images[::len(self.scene_offsets)]
+
+    @cached_property
+    def _extracted(self) -> t.Set[str]:
+        return set()
+
+    @cached_property
+    def storyboard_dimensions(self) -> t.Tuple[int, int]:
+        width, height = self.thumbnails_dimensions
+
+        aspect_ratio = self.stat_width / self.stat_height
+        if (width / height) >= aspect_ratio:
+            width = round(height * aspect_ratio)
+        else:
+            height = round(width / aspect_ratio)
+        logger.debug(f"{self} - storyboard thumbnail size: {width}x{height}")
+        return width, height
+
+    @cached_property
+    def subtitle_outputs(self) -> t.Dict[int, Path]:
+        r"""
+        stream-index to output-file of the extractable subtitle-streams
+        """
+        image_codecs = {'dvb_subtitle', 'dvd_subtitle', 'hdmv_pgs_subtitle', 'xsub'}
+        text_codecs = {'ass', 'jacosub', 'microdvd', 'mov_text', 'mpl2', 'pjs', 'realtext', 'sami', 'srt', 'ssa', 'stl',
+                       'subrip', 'subviewer', 'subviewer1', 'text', 'vplayer', 'webvtt'}
+
+        outputs: t.Dict[int, Path] = {}
+        for subtitle in self.ffprobe.subtitle_streams:
+            index = subtitle.index
+            codec = subtitle.codec_name
+            lang = subtitle.tags.get('language')
+            fp = self.dest.joinpath(f"subtitles.{lang}.vtt")
+
+            if codec in image_codecs:
+                logger.warning(f"image-based-subtitles extraction is currently not supported (#{index}:{lang})")
+            elif codec in text_codecs:
+                if fp in outputs.values():
+                    logger.warning(f"{self} - multiple subtitles for {lang}. only the first is extracted (#{index})")
+                    continue
+                outputs[index] = fp
+            else:
+                logger.error(f"{self} - Unsupported subtitle formast: {codec}")
+        return outputs
+
+    @cached_property
+    def scene_offsets(self) -> t.List[int]:
+        return [round((self.stat_fps / self.scene_fps) * i)
+                for i in range(round(self.seconds_per_scene * self.scene_fps))]
+
+    @cached_property
+    def preview_frames(self) -> t.List[int]:
         main_frames: t.List[int]
         total_frames = self.stat_nb_frames
         logger.debug(f"{self} - total frames: {total_frames}")
@@ -105,106 +454,49 @@ class VideoCacheGenerator(CacheGenerator):
                 round(every_n_seconds * self.stat_fps),  # every x frame
             ))
 
-        scene_offsets = [round((self.stat_fps / self.scene_fps) * i)
-                         for i in range(round(self.seconds_per_scene * self.scene_fps))]
-
-        extract_frames = [round(main + offset)
-                          for main in main_frames
-                          for offset in scene_offsets]
-
-        vw, vh = self.stat_width, self.stat_height
-        scale = (min(self.max_dimensions[0], vw), -2) if (vw > vh) else (-2, min(self.max_dimensions[1], vh))
-
-        logger.debug(f"{self}: running ffmpeg to extract images")
-        ffmpeg([
-            '-i', str(self.source),  # input
-            '-vf', ','.join((
-                "select=" + "+".join(f"eq(n\\,{frame})" for frame in extract_frames),  # specify the frames we want
-                f'scale={scale[0]}:{scale[1]}',  # re-scale images. (remove and with Pillow?)
-            )),
-            '-vframes', f"{len(extract_frames)}",  # number of frames to output. maybe could help slightly
-            '-vsync', f"{0}",  # don't know why anymore
-            '-codec', 'libwebp',
-            '-lossless', f"{1}",  # no loss is better for resulting images
-            # todo: maybe slightly higher compression-level/quality for reduced file size
-            '-compression_level', f"{0}", '-quality', f"{0}",  # I am speed.
-            '-y',  # overwrite if existing. prevent blocking
-            str(self.previews_cache / "%d.webp"),
-        ])
-        actual_previews = len(list(self.previews_cache.glob("*.webp")))
-        expected_previews = len(extract_frames)
-        if actual_previews != expected_previews:
-            message = (f"The number of extracted frames does not match the expected amount."
-                       f" (actual={actual_previews} != expected={expected_previews})")
-            logger.error(f"{self} - {message}")
-            raise RuntimeError(message)
-
-        logger.debug(f"{self} - copying main-frames to previews/")
-        for i, j in enumerate(range(0, len(extract_frames), len(scene_offsets))):
-            source = self.previews_cache.joinpath(f"{j+1}.webp")
-            dest = self.previews_dir.joinpath(f"{i+1}.webp")
-            if not source.is_file():
-                logger.error(f"{self} - frame {dest.name} not found")
-            with Image.open(source) as image:
-                image.save(dest, format='WEBP', minimize_size=True, method=6, quality=80)
+        return [round(main + offset)
+                for main in main_frames
+                for offset in self.scene_offsets]
 
     def generate_image_preview(self) -> None:
         # algorythm to prevent frames/previews of basically only one color.
         # (like completely black from scene-transfer or intro)
-        for fp in sorted(self.previews_dir.glob("*.webp"), key=lambda f: int(f.stem)):
-            with Image.open(fp) as image:
+        for i, frame in enumerate(self.main_images):
+            with open_frame(frame) as image:
                 stat = ImageStat.Stat(image)
-                if max(stat.stddev) > 40:  # check if at least one channel contains vastly different colors
-                    logger.debug(f"{self} - Selecting preview {fp.stem} as cover")
-                    preview_source = fp
-                    break
+            if max(stat.stddev) > 40:  # check if at least one channel contains vastly different colors
+                logger.debug(f"{self} - Selecting preview {i+1} as cover")
+                preview_source = self.previews_dir.joinpath(f"{i+1}.webp")
+                break
         else:
             logger.debug(f"{self} - Fallback to first preview as cover")
             preview_source = self.previews_dir.joinpath("1.webp")
         shutil.copyfile(preview_source, self.dest.joinpath("preview.webp"))
 
     def generate_animated_preview(self) -> None:
-        filepaths = sorted(self.previews_cache.glob("*.webp"), key=lambda f: int(f.stem))
-        with ExitStack() as stack:
-            images: t.List[Image.Image] = [stack.enter_context(Image.open(fp)) for fp in filepaths]
-            first, *frames = images
-            first.save(self.dest.joinpath("animated.webp"), format="WEBP", save_all=True, minimize_size=True,
-                       append_images=frames, duration=round(1000 / self.scene_fps), loop=0, method=6, quality=80)
+        first, *frames = map(open_frame, self.preview_images)  # the encoder needs all frames at once
+        first.save(self.dest.joinpath("animated.webp"), format="WEBP", save_all=True, minimize_size=True,
+                   append_images=frames, duration=round(1000 / self.scene_fps), loop=0, method=6, quality=80)
 
     def generate_extra(self) -> None:
-        self.generate_storyboard()
-        self.generate_chapters_webvtt()
-        self.generate_subtitles_webvtt()
+        self._run_stage(self.generate_storyboard)
+        self._run_stage(self.generate_chapters_webvtt)
+        self._run_stage(self.generate_subtitles_webvtt)
 
     def generate_storyboard(self) -> None:
         if not self.thumbnails_enabled:
             return
         logger.debug(f"{self} - Generating storyboard")
 
-        width, height = self.thumbnails_dimensions
-
-        aspect_ratio = self.stat_width / self.stat_height
-        if (width / height) >= aspect_ratio:
-            width = round(height * aspect_ratio)
-        else:
-            height = round(width / aspect_ratio)
-        logger.debug(f"{self} - storyboard thumbnail size: {width}x{height}")
-
-        logger.debug(f"{self}: running ffmpeg to extract thumbnails")
-        ffmpeg([
-            '-i', str(self.source),  # input
-            '-an',
-            '-sn',
-            '-vf', f"fps=1/{self.thumbnails_delay},scale={width}:{height}",
-            '-codec', 'libwebp',
-            '-lossless', f"{1}",  # no loss is better for resulting images
-            # todo: maybe slightly higher compression-level/quality for reduced file size
-            '-compression_level', f"{0}", '-quality', f"{0}",  # I am speed.
-            '-y',  # overwrite if existing. prevent blocking
-            str(self.thumbnails_cache / "%d.webp"),
-        ])
+        if self.thumbnails_mode == "keyframes" or self.extraction_method == "seek":
+            self.extract_keyframe_thumbnails()
+        self.extract(thumbnails=True)  # fallback
+        width, height = self.storyboard_dimensions
 
-        thumbnails = sorted(self.thumbnails_cache.glob("*.webp"), key=lambda f: int(f.stem))
+        thumbnails = self.thumbnail_images
+        timestamps = self._thumbnail_timestamps or [i * self.thumbnails_delay for i in range(len(thumbnails))]
+        # each thumbnail is shown until the next one starts
+        ends = [*timestamps[1:], max(self.stat_duration, timestamps[-1] + self.thumbnails_delay) if timestamps else 0]
 
         n_horizontal: int = 10
         n_vertical: int = len(thumbnails) // n_horizontal + 1
@@ -214,16 +506,15 @@ class VideoCacheGenerator(CacheGenerator):
         vtt_parts: t.List[undertext.Caption] = []
         logger.debug(f"{self} - generating storyboard.{{vtt,webp}}")
         with Image.new('RGB', size) as storyboard:
-            for i, fn in enumerate(thumbnails):
+            for i, frame in enumerate(thumbnails):
                 iy, ix = divmod(i, n_horizontal)
                 logger.debug(f"{self} - processing thumbnail {i} at {ix}x{iy}")
                 x, y = ix * width, iy * height
-                with Image.open(fn) as img:
+                with open_frame(frame) as img:
                     storyboard.paste(img, (x, y))
-                    start_ts = i * self.thumbnails_delay
                     vtt_parts.append(undertext.Caption(
-                        start=start_ts,
-                        end=start_ts+self.thumbnails_delay,
+                        start=timestamps[i],
+                        end=ends[i],
                         text=f'storyboard.webp#xywh={x},{y},{img.width},{img.height}'
                     ))
             logger.debug(f"{self} - saving storyboard.webp")
@@ -249,52 +540,34 @@ class VideoCacheGenerator(CacheGenerator):
         if not self.ffprobe.subtitle_streams:
             logger.debug(f"{self} - no subtitles found. no subtitles.{{lang}}.vtt are generated")
             return
-
-        image_codecs = {'dvb_subtitle', 'dvd_subtitle', 'hdmv_pgs_subtitle', 'xsub'}
-        text_codecs = {'ass', 'jacosub', 'microdvd', 'mov_text', 'mpl2', 'pjs', 'realtext', 'sami', 'srt', 'ssa', 'stl',
-                       'subrip', 'subviewer', 'subviewer1', 'text', 'vplayer', 'webvtt'}
-
-        for subtitle in self.ffprobe.subtitle_streams:
-            index = subtitle.index
-            codec = subtitle.codec_name
-            lang = subtitle.tags.get('language')
-            fp = self.previews_cache.joinpath(f"subtitles.{lang}.vtt")
-
-            if codec in image_codecs:
-                logger.warning(f"image-based-subtitles extraction is currently not supported (#{index}:{lang})")
-            elif codec in text_codecs:
-                try:
-                    ffmpeg([
-                        '-i', str(self.source),
-                        '-map', f"0:{index}",  # maps subtitle-stream to output-stream
-                        '-y',  # overwrite if existing. prevent blocking
-                        str(fp),
-                    ])
-                except Exception as error:
-                    logger.error(f"{self} - Failed to extract {fp.name}", exc_info=error)
-            else:
-                logger.error(f"{self} - Unsupported subtitle formast: {codec}")
+        self.extract(subtitles=True)
+
+    def extract_subtitles_separately(self) -> None:
+        r"""
+        one ffmpeg run per subtitle-stream so one broken stream does not affect the others
+        """
+        for index, fp in self.subtitle_outputs.items():
+            try:
+                ffmpeg([
+                    '-i', str(self.source),
+                    '-map', f"0:{index}",  # maps subtitle-stream to output-stream
+                    '-y',  # overwrite if existing. prevent blocking
+                    str(fp),
+                ])
+            except Exception as error:
+                logger.error(f"{self} - Failed to extract {fp.name}", exc_info=error)
+        self._extracted.add('subtitles')
 
     def generate_type(self):
         self.dest.joinpath("video.type").touch()
 
     def cleanup(self) -> None:
-        shutil.rmtree(self.previews_cache, ignore_errors=True)
-        shutil.rmtree(self.thumbnails_cache, ignore_errors=True)
-
-    @cached_property
-    def previews_cache(self) -> Path:
-        path = self.dest.joinpath(".previews")
-        shutil.rmtree(path, ignore_errors=True)
-        path.mkdir(parents=True)
-        return path
-
-    @cached_property
-    def thumbnails_cache(self) -> Path:
-        path = self.dest.joinpath(".thumbnails")
-        shutil.rmtree(path, ignore_errors=True)
-        path.mkdir(parents=True)
-        return path
+        self.preview_images = []
+        self.thumbnail_images = []
+        shutil.rmtree(self.dest.joinpath(FRAMES_DIR), ignore_errors=True)
+        # temporary frame-directories of older versions
+        shutil.rmtree(self.dest.joinpath(".previews"), ignore_errors=True)
+        shutil.rmtree(self.dest.joinpath(".thumbnails"), ignore_errors=True)
 
     @staticmethod
     def scenes_for_duration(duration: float) -> int:
@@ -318,7 +591,7 @@ class VideoCacheGenerator(CacheGenerator):
 
     @cached_property
     def ffprobe(self) -> FFProbeResult:
-        return ffprobe(self.source)
+        return get_ffprobe_cache(self.root).probe(self.source)
 
     @property
     def chapters(self) -> t.List[FFProbeChapter]:
@@ -0,0 +1,156 @@
+# -*- coding=utf-8 -*-
+r"""
+persistent index of the scanned directories.
+directories with the same modification-time and inode as during the last scan are not listed again
+"""
+import os
+import json
+import time
+import sqlite3
+import logging
+import typing as t
+from pathlib import Path
+from ..common.types import PathSource
+from .util import is_video_file, is_gallery_listing
+
+
+__all__ = ['ScanIndex', 'DirectoryInfo']
+
+
+logger = logging.getLogger(__name__)
+
+
+class DirectoryInfo(t.NamedTuple):
+    is_gallery: bool
+    directories: t.List[str]  # not ignored sub-directories
+    links: t.List[str]  # not ignored symlinks to directories (not entered, like os.walk())
+    videos: t.List[str]  # not ignored video-files
+
+
+class ScanIndex:
+    VERSION = 1
+    # directories modified within this time are not stored as filesystems can have a coarse mtime
+    SETTLE_TIME = 2.0
+
+    def __init__(self, fp: PathSource, root: PathSource, ignored: t.Callable[[Path], bool], fingerprint: str = ""):
+        self.fp = Path(fp)
+        self.root = Path(root)
+        self._ignored = ignored
+        self._fingerprint = f"{self.VERSION}:{fingerprint}"
+        self._connection: t.Optional[sqlite3.Connection] = None
+        self._visited: t.Set[str] = set()
+        self._hits = 0
+        self._misses = 0
+
+    def __repr__(self):
+        return f"<{type(self).__name__}: {self.fp!s}>"
+
+    def __enter__(self) -> 'ScanIndex':
+        try:
+            self._connection = self._connect()
+        except sqlite3.DatabaseError as error:
+            logger.warning(f"{self} - index is broken and gets recreated ({error})")
+            self.fp.unlink(missing_ok=True)
+            self._connection = self._connect()
+        self._visited.clear()
+        self._hits = self._misses = 0
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        logger.debug(f"{self} - {self._hits} directories reused, {self._misses} directories scanned")
+        try:
+            if exc_type is None:
+                self._connection.commit()
+        finally:
+            self._connection.close()
+            self._connection = None
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.fp)
+        connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        connection.execute("CREATE TABLE IF NOT EXISTS directories ("
+                           " path TEXT PRIMARY KEY, mtime_ns INTEGER NOT NULL, inode INTEGER NOT NULL,"
+                           " is_gallery INTEGER NOT NULL, directories TEXT NOT NULL, links TEXT NOT NULL,"
+                           " videos TEXT NOT NULL)")
+        row = connection.execute("SELECT value FROM meta WHERE key = 'fingerprint'").fetchone()
+        if row is None or row[0] != self._fingerprint:
+            logger.info(f"{self} - index is outdated and gets rebuild")
+            connection.execute("DELETE FROM directories")
+            connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('fingerprint', ?)",
+                               (self._fingerprint,))
+            connection.commit()
+        return connection
+
+    def scan(self, directory: Path) -> t.Optional[DirectoryInfo]:
+        r"""
+        returns the (cached) info about the directory. returns None if the directory does not exist
+        """
+        key = str(directory.relative_to(self.root))
+        try:
+            stat = directory.stat()
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        self._visited.add(key)
+
+        row = self._connection.execute(
+            "SELECT is_gallery, directories, links, videos FROM directories"
+            " WHERE path = ? AND mtime_ns = ? AND inode = ?",
+            (key, stat.st_mtime_ns, stat.st_ino)
+        ).fetchone()
+        if row is not None:
+            self._hits += 1
+            return DirectoryInfo(is_gallery=bool(row[0]), directories=json.loads(row[1]),
+                                 links=json.loads(row[2]), videos=json.loads(row[3]))
+
+        self._misses += 1
+        logger.debug(f"{self} - scanning {directory!s}")
+        names: t.List[str] = []
+        directories: t.List[str] = []
+        links: t.List[str] = []
+        videos: t.List[str] = []
+        with os.scandir(directory) as it:
+            for entry in it:
+                names.append(entry.name)
+                if entry.is_dir():
+                    if not self._ignored(Path(entry.path)):
+                        (links if entry.is_symlink() else directories).append(entry.name)
+                elif entry.is_file():
+                    if is_video_file(entry.name) and not self._ignored(Path(entry.path)):
+                        videos.append(entry.name)
+        info = DirectoryInfo(is_gallery=is_gallery_listing(names), directories=sorted(directories),
+                             links=sorted(links), videos=sorted(videos))
+
+        if time.time() - stat.st_mtime > self.SETTLE_TIME:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO directories (path, mtime_ns, inode, is_gallery, directories, links, videos)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, stat.st_mtime_ns, stat.st_ino, info.is_gallery,
+                 json.dumps(info.directories), json.dumps(info.links), json.dumps(info.videos))
+            )
+        return info
+
+    def walk(self, top: Path) -> t.Iterator[t.Tuple[Path, DirectoryInfo, bool]]:
+        r"""
+        like os.walk() but with the info of the directories and whether it is a symlink.
+        ignored directories and symlinks are not entered
+        """
+        stack = [(top, False)]
+        while stack:
+            directory, is_link = stack.pop()
+            info = self.scan(directory)
+            if info is None:
+                continue
+            yield directory, info, is_link
+            if not is_link:
+                stack.extend((directory.joinpath(name), True) for name in reversed(info.links))
+                stack.extend((directory.joinpath(name), False) for name in reversed(info.directories))
+
+    def prune(self) -> None:
+        r"""
+        removes all directories from the index that were not visited since entering
+        """
+        stale = [(path,) for path, in self._connection.execute("SELECT path FROM directories")
+                 if path not in self._visited]
+        if stale:
+            logger.debug(f"{self} - removing {len(stale)} directories from the index")
+            self._connection.executemany("DELETE FROM directories WHERE path = ?", stale)
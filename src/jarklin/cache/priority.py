@@ -0,0 +1,115 @@
+# -*- coding=utf-8 -*-
+r"""
+order in which the cache generates the missing entries (cache.priority)
+
+requested   paths that were recently requested through the web-server (.jarklin/requested.json)
+newest      most recently modified first
+cheapest    smallest first (file-size or the size of the images of a gallery)
+name        alphabetical
+
+the criteria are applied in the configured order. ties are always resolved alphabetically
+"""
+import os
+import logging
+import typing as t
+from pathlib import Path
+from ..common.requested import read_requested
+from .generator import CacheGenerator, GalleryCacheGenerator
+from .util import get_modification_time, is_image_file
+
+
+__all__ = ['JobQueue', 'PRIORITIES', 'DEFAULT_PRIORITY']
+
+
+logger = logging.getLogger(__name__)
+PRIORITIES = ("requested", "newest", "cheapest", "name")
+DEFAULT_PRIORITY = ["requested", "newest"]
+
+
+class JobQueue:
+    r"""
+    the requested-file is re-read (if it changed) with every pop(),
+    so paths that are requested while the generation is running are still preferred
+    """
+
+    def __init__(self, jobs: t.Iterable[CacheGenerator], priority: t.Sequence[str], root: Path,
+                 requested_fp: Path):
+        unknown = set(priority) - set(PRIORITIES)
+        if unknown:
+            raise ValueError(f"cache.priority: unknown criteria {', '.join(sorted(unknown))}")
+        self.priority = priority
+        self.root = root
+        self.requested_fp = requested_fp
+        self._jobs = list(jobs)
+        self._keys: t.Dict[Path, t.Tuple[float, int]] = {}  # static part of the sort-keys
+        self._requested: t.Dict[str, float] = {}
+        self._requested_version: t.Optional[int] = None
+        self._ordered = False
+
+    def __repr__(self):
+        return f"<{type(self).__name__}: {len(self)} jobs ({', '.join(self.priority)})>"
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def pop(self) -> CacheGenerator:
+        if "requested" in self.priority and self._refresh_requested():
+            self._ordered = False
+        if not self._ordered:
+            self._jobs.sort(key=self._key, reverse=True)  # the next job is at the end
+            self._ordered = True
+        return self._jobs.pop()
+
+    def _refresh_requested(self) -> bool:
+        try:
+            version = os.stat(self.requested_fp).st_mtime_ns
+        except FileNotFoundError:
+            version = None
+        if version == self._requested_version:
+            return False
+        self._requested_version = version
+        self._requested = {}
+        for path, timestamp in read_requested(self.requested_fp).items():
+            # images of a gallery count for the gallery
+            for candidate in (path, os.path.dirname(path)):
+                self._requested[candidate] = max(timestamp, self._requested.get(candidate, 0))
+        logger.debug(f"{self} - {len(self._requested)} requested paths")
+        return True
+
+    def _key(self, generator: CacheGenerator) -> tuple:
+        key = []
+        for criterion in self.priority:
+            if criterion == "requested":
+                timestamp = self._requested.get(str(generator.source.relative_to(self.root)))
+                key.append((0, -timestamp) if timestamp is not None else (1, 0))
+            elif criterion == "newest":
+                key.append(self._static_key(generator)[0])
+            elif criterion == "cheapest":
+                key.append(self._static_key(generator)[1])
+            else:
+                key.append(str(generator.source).lower())
+        key.append(str(generator.source).lower())
+        return tuple(key)
+
+    def _static_key(self, generator: CacheGenerator) -> t.Tuple[float, int]:
+        r"""
+        (newest, cheapest)-parts of the key. these don't change during the generation
+        """
+        key = self._keys.get(generator.source)
+        if key is None:
+            try:
+                key = (-get_modification_time(generator.source), estimate_cost(generator))
+            except OSError:  # removed in the meantime. fails once it is generated
+                key = (0, 0)
+            self._keys[generator.source] = key
+        return key
+
+
+def estimate_cost(generator: CacheGenerator) -> int:
+    r"""
+    size of the source in bytes. for galleries the summed size of the images
+    """
+    if isinstance(generator, GalleryCacheGenerator):
+        with os.scandir(generator.source) as entries:
+            return sum(entry.stat().st_size for entry in entries if entry.is_file() and is_image_file(entry.name))
+    return generator.source.stat().st_size
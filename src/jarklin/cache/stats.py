@@ -0,0 +1,202 @@
+# -*- coding=utf-8 -*-
+r"""
+resource-usage of the cache-generation
+
+every stage of a generator is measured (wall-time, cpu-time, cpu-time of child-processes like ffmpeg and
+the bytes read from and written to the storage). stages that run inside another stage are not counted for the outer
+one, so the stages of an item add up to its total. the cache aggregates these and writes them to
+.jarklin/stats.json      aggregated counters and the timings of the last generators
+.jarklin/metrics.prom    the same counters in the prometheus text-format (e.g. for the node-exporter textfile-collector)
+"""
+import os
+import json
+import time
+import logging
+import contextlib
+import collections
+import typing as t
+from pathlib import Path
+from ..common.atomic import atomic_write
+try:
+    import resource
+except ModuleNotFoundError:  # windows
+    resource = None
+
+
+__all__ = ['StageTiming', 'measure', 'CacheStats']
+
+
+logger = logging.getLogger(__name__)
+RECENT_LIMIT = 100
+
+
+class StageTiming(t.NamedTuple):
+    wall: float = 0.0
+    cpu: float = 0.0
+    children_cpu: float = 0.0  # only includes children that finished (e.g. the ffmpeg-processes)
+    read_bytes: int = 0  # from the storage. reads from the page-cache are not counted
+    write_bytes: int = 0
+
+    def __add__(self, other: 'StageTiming') -> 'StageTiming':  # type: ignore[override]
+        return StageTiming(*(a + b for a, b in zip(self, other)))
+
+    def __sub__(self, other: 'StageTiming') -> 'StageTiming':
+        return StageTiming(*(a - b for a, b in zip(self, other)))
+
+
+def _snapshot() -> StageTiming:
+    times = os.times()
+    read_bytes = write_bytes = 0
+    if resource is not None:
+        for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+            usage = resource.getrusage(who)
+            read_bytes += usage.ru_inblock * 512  # counted in 512-byte blocks
+            write_bytes += usage.ru_oublock * 512
+    return StageTiming(
+        wall=time.perf_counter(),
+        cpu=times.user + times.system,
+        children_cpu=times.children_user + times.children_system,
+        read_bytes=read_bytes,
+        write_bytes=write_bytes,
+    )
+
+
+@contextlib.contextmanager
+def measure(timings: t.Dict[str, StageTiming], name: str) -> t.Iterator[None]:
+    r"""
+    adds the resource-usage of the block to timings[name].
+    the usage is per process, so parallel work in the same process (threads) is included
+    """
+    start = _snapshot()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, StageTiming()) + (_snapshot() - start)
+
+
+class CacheStats:
+    r"""
+    counters of the cache-generation. they start at zero with every start of the process
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.started = time.time()
+        self.generated: t.Dict[str, int] = collections.Counter()
+        self.failures: t.Dict[str, int] = collections.Counter()
+        self.stages: t.Dict[t.Tuple[str, str], StageTiming] = {}
+        self.stage_runs: t.Dict[t.Tuple[str, str], int] = collections.Counter()
+        self.recent: t.Deque[dict] = collections.deque(maxlen=RECENT_LIMIT)
+        self.queue_depth = 0
+        self.generation_seconds = 0.0
+        self.last_generation: t.Optional[dict] = None
+        self._generation_start: t.Optional[float] = None
+        self._generation_done = 0
+
+    def start_generation(self, jobs: int) -> None:
+        self.queue_depth = jobs
+        self._generation_start = time.time()
+        self._generation_done = 0
+        self.write()
+
+    def add(self, kind: str, path: str, timings: t.Dict[str, StageTiming], wall: float, failed: bool) -> None:
+        self.queue_depth = max(0, self.queue_depth - 1)
+        self._generation_done += 1
+        (self.failures if failed else self.generated)[kind] += 1
+        for stage, timing in timings.items():
+            self.stages[kind, stage] = self.stages.get((kind, stage), StageTiming()) + timing
+            self.stage_runs[kind, stage] += 1
+        self.recent.append(dict(
+            path=path,
+            kind=kind,
+            failed=failed,
+            finished=time.time(),
+            wall=wall,
+            stages={stage: timing._asdict() for stage, timing in timings.items()},
+        ))
+        self.write()
+
+    def finish_generation(self) -> None:
+        if self._generation_start is None:
+            return
+        duration = time.time() - self._generation_start
+        self.generation_seconds += duration
+        self.last_generation = dict(
+            started=self._generation_start,
+            duration=duration,
+            items=self._generation_done,
+            items_per_hour=self._generation_done / duration * 3600 if duration > 0 else 0.0,
+        )
+        self._generation_start = None
+        self.queue_depth = 0
+        self.write()
+
+    @property
+    def items_per_hour(self) -> float:
+        r"""
+        throughput while generating. idle time between the iterations doesn't count
+        """
+        seconds = self.generation_seconds
+        if self._generation_start is not None:
+            seconds += time.time() - self._generation_start
+        done = sum(self.generated.values()) + sum(self.failures.values())
+        return done / seconds * 3600 if seconds > 0 else 0.0
+
+    def write(self) -> None:
+        try:
+            atomic_write(self.directory / "stats.json", json.dumps(self.to_json(), indent=2))
+            atomic_write(self.directory / "metrics.prom", self.to_prometheus())
+        except OSError as error:  # statistics should never stop the generation
+            logger.warning(f"failed to write the cache-statistics: {error}")
+
+    def to_json(self) -> dict:
+        return dict(
+            started=self.started,
+            updated=time.time(),
+            queue_depth=self.queue_depth,
+            items_per_hour=self.items_per_hour,
+            generated=dict(self.generated),
+            failures=dict(self.failures),
+            last_generation=self.last_generation,
+            stages={
+                kind: {
+                    stage: dict(runs=self.stage_runs[kind, stage], **timing._asdict())
+                    for (stage_kind, stage), timing in self.stages.items() if stage_kind == kind
+                }
+                for kind in sorted({kind for kind, _ in self.stages})
+            },
+            recent=list(self.recent),
+        )
+
+    def to_prometheus(self) -> str:
+        lines = []
+
+        def metric(name: str, kind: str, help_text: str, samples: t.Iterable[t.Tuple[str, float]]) -> None:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{labels} {value}")
+
+        kinds = sorted({*self.generated, *self.failures})
+        metric("jarklin_cache_started_timestamp_seconds", "gauge", "start of the cache-process",
+               [("", self.started)])
+        metric("jarklin_cache_queue_depth", "gauge", "generators that are waiting or running",
+               [("", self.queue_depth)])
+        metric("jarklin_cache_items_per_hour", "gauge", "generated items per hour of generation-time",
+               [("", self.items_per_hour)])
+        metric("jarklin_cache_generated_total", "counter", "successfully generated cache-entries",
+               [(f'{{kind="{kind}"}}', self.generated[kind]) for kind in kinds])
+        metric("jarklin_cache_failures_total", "counter", "failed generations",
+               [(f'{{kind="{kind}"}}', self.failures[kind]) for kind in kinds])
+        metric("jarklin_cache_generation_seconds_total", "counter", "time spent generating",
+               [("", self.generation_seconds)])
+        stages = sorted(self.stages.items())
+        metric("jarklin_cache_stage_runs_total", "counter", "runs of the generator-stages",
+               [(f'{{kind="{kind}",stage="{stage}"}}', self.stage_runs[kind, stage]) for (kind, stage), _ in stages])
+        metric("jarklin_cache_stage_seconds_total", "counter", "time spent in the generator-stages",
+               [(f'{{kind="{kind}",stage="{stage}",clock="{clock}"}}', getattr(timing, clock))
+                for (kind, stage), timing in stages for clock in ("wall", "cpu", "children_cpu")])
+        metric("jarklin_cache_stage_bytes_total", "counter", "bytes read from or written to the storage",
+               [(f'{{kind="{kind}",stage="{stage}",direction="{direction}"}}', getattr(timing, f"{direction}_bytes"))
+                for (kind, stage), timing in stages for direction in ("read", "write")])
+        return "\n".join(lines) + "\n"
@@ -4,6 +4,7 @@ r"""
 """
 import re
 import mimetypes
+import typing as t
 import os.path as p
 from pathlib import Path
 from ..common.types import PathSource
@@ -37,8 +38,15 @@ def is_gallery(fp: PathSource, boundary: int = 5) -> bool:
     checks if fp is a directory with at least $boundary image that contain numbers
     """
     fp = Path(fp)
-    return fp.is_dir() and len([
-        fn for fn in fp.iterdir()
+    return fp.is_dir() and is_gallery_listing(fp.iterdir(), boundary=boundary)
+
+
+def is_gallery_listing(files: t.Iterable[PathSource], boundary: int = 5) -> bool:
+    r"""
+    checks if the directory-listing contains at least $boundary image that contain numbers
+    """
+    return len([
+        fn for fn in map(Path, files)
         if any_number.search(fn.stem) is not None
         and is_image_file(fn)
     ]) > boundary
@@ -0,0 +1,333 @@
+# -*- coding=utf-8 -*-
+r"""
+collects the paths that changed below the root-directory.
+uses inotify on linux and falls back to polling the directory-tree on other systems or when inotify fails
+"""
+import os
+import sys
+import errno
+import select
+import struct
+import logging
+import threading
+import typing as t
+from pathlib import Path
+from abc import abstractmethod
+from ..common.types import PathSource
+
+
+__all__ = ['Watcher', 'InotifyWatcher', 'PollingWatcher', 'create_watcher']
+
+
+logger = logging.getLogger(__name__)
+
+
+class Watcher:
+    def __init__(self, root: PathSource, ignored: t.Callable[[Path], bool]):
+        self.root = Path(root).absolute()
+        self._ignored = ignored
+        self._lock = threading.Lock()
+        self._changes: t.Set[Path] = set()
+        self._rescan = True  # the first consumer has to do a full scan
+        self._stop_event = threading.Event()
+        self._thread: t.Optional[threading.Thread] = None
+        self._report_to: Watcher = self  # another watcher if this one is used as fallback
+
+    def __repr__(self):
+        return f"<{type(self).__name__}: {self.root!s}>"
+
+    def start(self) -> None:
+        if self._thread is not None:
+            raise RuntimeError("watcher is already running")
+        self._setup()
+        self._thread = threading.Thread(target=self._run, name="watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def pop_changes(self) -> t.Optional[t.Set[Path]]:
+        r"""
+        returns the changed paths since the last call. returns None if a full rescan is required
+        """
+        with self._lock:
+            changes, self._changes = self._changes, set()
+            rescan, self._rescan = self._rescan, False
+        return None if rescan else changes
+
+    def requeue(self, paths: t.Iterable[Path]) -> None:
+        r"""
+        puts paths back that should not be processed yet
+        """
+        with self._lock:
+            self._changes.update(paths)
+
+    def _add_change(self, path: Path) -> None:
+        if self._ignored(path):
+            return
+        logger.debug(f"{self} - change detected: {path!s}")
+        target = self._report_to
+        with target._lock:
+            target._changes.add(path)
+
+    def _request_rescan(self) -> None:
+        logger.warning(f"{self} - lost track of changes. requesting full rescan")
+        target = self._report_to
+        with target._lock:
+            target._rescan = True
+
+    def _run_fallback(self, fallback: 'Watcher') -> None:
+        r"""
+        continues with another watcher in the current thread. it reports to this one and stops with it
+        """
+        fallback._report_to = self
+        fallback._stop_event = self._stop_event
+        fallback._setup()
+        fallback._run()
+
+    def _walk(self, top: Path) -> t.Iterator[Path]:
+        r"""
+        yields all not ignored directories (including top)
+        """
+        if self._ignored(top):
+            return
+        yield top
+        for root, dirnames, _ in os.walk(top):
+            for dirname in dirnames[:]:
+                path = Path(root, dirname)
+                if self._ignored(path):
+                    dirnames.remove(dirname)
+                else:
+                    yield path
+
+    def _setup(self) -> None:
+        pass
+
+    @abstractmethod
+    def _run(self) -> None: ...
+
+
+class InotifyWatcher(Watcher):
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_DONT_FOLLOW = 0x02000000
+    IN_ISDIR = 0x40000000
+    IN_CLOEXEC = 0o2000000
+
+    WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+                  | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW)
+    EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+
+    def __init__(self, root: PathSource, ignored: t.Callable[[Path], bool], polling_interval: float = 60):
+        super().__init__(root=root, ignored=ignored)
+        self.polling_interval = polling_interval  # of the fallback if inotify fails while running
+        import ctypes
+        import ctypes.util
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or "libc.so.6", use_errno=True)
+        self._fd: t.Optional[int] = None
+        self._watches: t.Dict[int, Path] = {}
+
+    def _setup(self) -> None:
+        import ctypes
+        fd = self._libc.inotify_init1(self.IN_CLOEXEC)
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_init1 failed: {os.strerror(err)}")
+        self._fd = fd
+        try:
+            for path in self._walk(self.root):
+                self._add_watch(path)
+        except OSError:
+            os.close(self._fd)
+            self._fd = None
+            raise
+        logger.info(f"{self} - watching {len(self._watches)} directories")
+
+    def _add_watch(self, path: Path) -> None:
+        import ctypes
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), self.WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err in (errno.ENOENT, errno.ENOTDIR):  # already gone again
+                return
+            if err == errno.ENOSPC:
+                raise OSError(err, "inotify watch limit reached (see /proc/sys/fs/inotify/max_user_watches)")
+            raise OSError(err, f"inotify_add_watch failed for {path!s}: {os.strerror(err)}")
+        self._watches[wd] = path
+
+    def _run(self) -> None:
+        try:
+            self._watch()
+        except Exception as error:
+            logger.error(f"{self} - inotify failed. falling back to polling", exc_info=error)
+            self._request_rescan()  # changes since the failure are unknown
+            self._run_fallback(PollingWatcher(root=self.root, ignored=self._ignored, interval=self.polling_interval))
+
+    def _watch(self) -> None:
+        try:
+            while not self._stop_event.is_set():
+                readable, _, _ = select.select([self._fd], [], [], 1.0)
+                if not readable:
+                    continue
+                self._process(os.read(self._fd, 64 * 1024))
+        finally:
+            os.close(self._fd)
+            self._fd = None
+            self._watches.clear()
+
+    def _process(self, buffer: bytes) -> None:
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _cookie, length = self.EVENT_HEADER.unpack_from(buffer, offset)
+            offset += self.EVENT_HEADER.size
+            name = os.fsdecode(buffer[offset:offset + length].rstrip(b"\0"))
+            offset += length
+
+            if mask & self.IN_Q_OVERFLOW:
+                self._request_rescan()
+                continue
+            if mask & self.IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+            directory = self._watches.get(wd)
+            if directory is None:
+                continue
+
+            path = directory.joinpath(name) if name else directory
+            self._add_change(path)
+
+            # the paths of moved directories are outdated. moves within the root are re-added with IN_MOVED_TO
+            if mask & self.IN_ISDIR and mask & self.IN_MOVED_FROM:
+                self._remove_watches(path)
+            elif mask & self.IN_MOVE_SELF:
+                self._remove_watches(directory)
+
+            if mask & self.IN_ISDIR and mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                try:
+                    for new in self._walk(path):
+                        self._add_watch(new)
+                except OSError as error:
+                    logger.error(f"{self} - failed to watch {path!s}", exc_info=error)
+                    self._request_rescan()
+
+
+    def _remove_watches(self, directory: Path) -> None:
+        r"""
+        stops watching the directory and everything below it
+        """
+        for wd, path in list(self._watches.items()):
+            if path == directory or directory in path.parents:
+                self._libc.inotify_rm_watch(self._fd, wd)
+                del self._watches[wd]
+
+
+class PollingWatcher(Watcher):
+    r"""
+    only stats the directories and scans those whose modification-time changed.
+    note: in-place modification of files is not detected
+    """
+
+    class _Snapshot(t.NamedTuple):
+        mtime_ns: int
+        entries: t.Dict[str, t.Tuple[bool, int, int, int]]  # name: (is_dir, inode, size, mtime_ns)
+
+    def __init__(self, root: PathSource, ignored: t.Callable[[Path], bool], interval: float = 60):
+        super().__init__(root=root, ignored=ignored)
+        self.interval = interval
+        self._snapshots: t.Dict[Path, PollingWatcher._Snapshot] = {}
+
+    def _setup(self) -> None:
+        for path in self._walk(self.root):
+            snapshot = self._snapshot(path)
+            if snapshot is not None:
+                self._snapshots[path] = snapshot
+        logger.info(f"{self} - polling {len(self._snapshots)} directories every {self.interval}s")
+
+    @classmethod
+    def _snapshot(cls, directory: Path) -> t.Optional['PollingWatcher._Snapshot']:
+        try:
+            mtime_ns = directory.stat().st_mtime_ns
+            entries = {}
+            with os.scandir(directory) as it:
+                for entry in it:
+                    try:
+                        stat = entry.stat(follow_symlinks=False)
+                        entries[entry.name] = (entry.is_dir(follow_symlinks=False),
+                                               stat.st_ino, stat.st_size, stat.st_mtime_ns)
+                    except FileNotFoundError:
+                        pass
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        return cls._Snapshot(mtime_ns=mtime_ns, entries=entries)
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            self._poll()
+
+    def _poll(self) -> None:
+        for directory, old in list(self._snapshots.items()):
+            try:
+                if directory.stat().st_mtime_ns == old.mtime_ns:
+                    continue
+            except (FileNotFoundError, NotADirectoryError):
+                self._forget(directory)
+                self._add_change(directory)
+                continue
+
+            new = self._snapshot(directory)
+            if new is None:
+                continue
+            self._snapshots[directory] = new
+
+            for name in old.entries.keys() | new.entries.keys():
+                before, after = old.entries.get(name), new.entries.get(name)
+                if before == after:
+                    continue
+                path = directory.joinpath(name)
+                self._add_change(path)
+                if before is not None and before[0] and (after is None or not after[0]):
+                    self._forget(path)
+                if after is not None and after[0] and path not in self._snapshots:
+                    for new_directory in self._walk(path):
+                        snapshot = self._snapshot(new_directory)
+                        if snapshot is not None:
+                            self._snapshots[new_directory] = snapshot
+
+    def _forget(self, directory: Path) -> None:
+        for path in list(self._snapshots.keys()):
+            if path == directory or directory in path.parents:
+                del self._snapshots[path]
+
+
+def create_watcher(root: PathSource, ignored: t.Callable[[Path], bool],
+                   method: str = "auto", polling_interval: float = 60) -> Watcher:
+    r"""
+    creates and starts a watcher. method can be 'auto', 'inotify' or 'polling'
+    """
+    if method in {"auto", "inotify"} and sys.platform.startswith("linux"):
+        try:
+            watcher = InotifyWatcher(root=root, ignored=ignored, polling_interval=polling_interval)
+            watcher.start()
+            return watcher
+        except OSError as error:
+            if method == "inotify":
+                raise
+            logger.warning(f"inotify is not available ({error}). falling back to polling")
+    elif method == "inotify":
+        raise OSError(errno.ENOSYS, "inotify is only supported on linux")
+
+    watcher = PollingWatcher(root=root, ignored=ignored, interval=polling_interval)
+    watcher.start()
+    return watcher
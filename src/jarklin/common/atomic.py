@@ -0,0 +1,48 @@
+# -*- coding=utf-8 -*-
+r"""
+
+"""
+import os
+import typing as t
+from pathlib import Path
+from .types import PathSource
+
+
+__all__ = ['atomic_write']
+
+
+def atomic_write(fp: PathSource, data: t.Union[str, bytes]) -> None:
+    r"""
+    writes into a temporary file first that replaces fp once it is completely written to the disk.
+    readers therefore see either the old or the new content but never a partially written file
+    """
+    fp = Path(fp)
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    tmp = fp.with_name(f".{fp.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp, 'wb') as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp, fp)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    _fsync_directory(fp.parent)
+
+
+def _fsync_directory(directory: Path) -> None:
+    r"""
+    persists the rename. not supported on every system
+    """
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
@@ -4,22 +4,66 @@ r"""
 """
 import shlex
 import logging
+import contextlib
 import typing as t
 import subprocess as sp
 from configlib import config
+from .frames import FramePipe, open_frame
 
 
-__all__ = ['ffmpeg']
+__all__ = ['ffmpeg', 'set_limiter', 'FramePipe', 'open_frame']
 
 
 logger = logging.getLogger(__name__)
+_limiter: t.ContextManager = contextlib.nullcontext()
 
 
-def ffmpeg(args: t.Iterable[str]):
+def set_limiter(limiter: t.Optional[t.ContextManager]) -> None:
+    r"""
+    limits how many ffmpeg processes can run at once (e.g. a semaphore shared between worker-processes)
+    """
+    global _limiter
+    _limiter = contextlib.nullcontext() if limiter is None else limiter
+
+
+def ffmpeg(args: t.Iterable[t.Union[str, FramePipe]]) -> sp.CompletedProcess:
+    r"""
+    runs ffmpeg and raises CalledProcessError on failure.
+    FramePipe objects in the arguments are replaced by pipes (or temporary files) and receive the frames of that output
+    """
     ffmpeg_executable = config.getstr('ffmpeg', fallback="ffmpeg")
 
     args = [ffmpeg_executable, '-hide_banner', *args]
+    pipes = [arg for arg in args if isinstance(arg, FramePipe)]
 
-    logger.debug(f"running: {shlex.join(args)}")
+    with _limiter:
+        if not pipes:
+            logger.debug(f"running: {shlex.join(args)}")
+            return sp.run(args, check=True, capture_output=True)
 
-    return sp.run(args, check=True, capture_output=True)
+        args = [arg.open() if isinstance(arg, FramePipe) else arg for arg in args]
+        logger.debug(f"running: {shlex.join(args)}")
+        try:
+            pass_fds = [pipe.write_fd for pipe in pipes if pipe.write_fd is not None]
+            with sp.Popen(args, stdout=sp.PIPE, stderr=sp.PIPE, pass_fds=pass_fds) as process:
+                for pipe in pipes:
+                    pipe.close_writer()  # so the readers see the end once ffmpeg exits
+                stdout, stderr = process.communicate()
+        except BaseException:
+            for pipe in pipes:
+                with contextlib.suppress(Exception):
+                    pipe.join()  # stops the reader and removes temporary files
+            raise
+        finally:
+            for pipe in pipes:
+                pipe.close_writer()
+        if process.returncode:
+            for pipe in pipes:
+                try:
+                    pipe.join()
+                except Exception:  # the failed process is the actual error
+                    pass
+            raise sp.CalledProcessError(process.returncode, args, output=stdout, stderr=stderr)
+        for pipe in pipes:
+            pipe.join()
+        return sp.CompletedProcess(args, process.returncode, stdout=stdout, stderr=stderr)
@@ -0,0 +1,131 @@
+# -*- coding=utf-8 -*-
+r"""
+receives the frames of an ffmpeg-output through a pipe instead of temporary image-files.
+without inheritable pipe-descriptors (windows) the frames are written to a temporary file and read afterwards.
+the frames are kept as lossless webp in memory (a fraction of the raw size) and decoded once they are used
+"""
+import io
+import os
+import shutil
+import logging
+import tempfile
+import threading
+import typing as t
+from PIL import Image
+
+
+__all__ = ['FramePipe', 'open_frame']
+
+
+logger = logging.getLogger(__name__)
+
+
+class FramePipe:
+    r"""
+    placeholder for an output-file in the ffmpeg() arguments.
+    the output-options have to be FramePipe.FORMAT so every frame is a self-describing ppm-image
+
+    >>> pipe = FramePipe()
+    >>> ffmpeg(['-i', 'video.mp4', '-vf', 'fps=1', *FramePipe.FORMAT, pipe])
+    >>> with open_frame(pipe.frames[0]) as image:
+    ...     image.save('frame.jpg')
+    """
+
+    FORMAT = ['-f', 'image2pipe', '-codec', 'ppm', '-pix_fmt', 'rgb24']
+    USE_PIPES = os.name != "nt"  # subprocess.Popen(pass_fds=...) is posix-only
+
+    def __init__(self):
+        self.frames: t.List[bytes] = []  # lossless webp. see open_frame()
+        self._read_fd: t.Optional[int] = None
+        self._write_fd: t.Optional[int] = None
+        self._temp_dir: t.Optional[str] = None
+        self._thread: t.Optional[threading.Thread] = None
+        self._error: t.Optional[BaseException] = None
+
+    def __repr__(self):
+        return f"<{type(self).__name__}: {len(self.frames)} frames>"
+
+    def open(self) -> str:
+        r"""
+        creates the pipe and starts reading from it. returns the output-url for ffmpeg
+        """
+        self.frames.clear()
+        self._error = None
+        if not self.USE_PIPES:
+            self._temp_dir = tempfile.mkdtemp(prefix="jarklin-frames-")
+            return os.path.join(self._temp_dir, "frames.ppm")
+        self._read_fd, self._write_fd = os.pipe()
+        self._thread = threading.Thread(target=self._run, name="frame-pipe", daemon=True)
+        self._thread.start()
+        return f"pipe:{self._write_fd}"
+
+    @property
+    def write_fd(self) -> t.Optional[int]:
+        r"""
+        has to be inherited by the ffmpeg-process. None if a temporary file is used
+        """
+        return self._write_fd
+
+    def close_writer(self) -> None:
+        r"""
+        closes our copy of the write-end. has to be called once the ffmpeg-process got its own copy
+        """
+        if self._write_fd is not None:
+            os.close(self._write_fd)
+            self._write_fd = None
+
+    def join(self) -> None:
+        r"""
+        waits until all frames were read. raises if the stream was broken
+        """
+        self.close_writer()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._temp_dir is not None:
+            try:
+                with open(os.path.join(self._temp_dir, "frames.ppm"), 'rb') as file:
+                    self._read(file)
+            except BaseException as error:
+                self._error = error
+            finally:
+                shutil.rmtree(self._temp_dir, ignore_errors=True)
+                self._temp_dir = None
+        if self._error is not None:
+            raise self._error
+
+    def _run(self) -> None:
+        try:
+            with open(self._read_fd, 'rb') as file:
+                self._read(file)
+        except BaseException as error:
+            self._error = error
+            logger.debug(f"{self} - failed to read frames", exc_info=error)
+        finally:
+            self._read_fd = None
+
+    def _read(self, file: t.BinaryIO) -> None:
+        while True:
+            magic = file.readline()
+            if not magic:
+                break
+            if magic.strip() != b"P6":
+                raise ValueError(f"unexpected frame-header {magic[:16]!r}")
+            width, height = map(int, file.readline().split())
+            file.readline()  # maxval. always 255 for rgb24
+            size = width * height * 3
+            data = file.read(size)
+            if len(data) != size:
+                raise ValueError(f"incomplete frame ({len(data)}/{size} bytes)")
+            with Image.frombytes('RGB', (width, height), data) as image:
+                buffer = io.BytesIO()
+                image.save(buffer, format='WEBP', lossless=True, quality=0, method=0)  # fastest lossless setting
+            self.frames.append(buffer.getvalue())
+
+
+def open_frame(data: bytes) -> Image.Image:
+    r"""
+    decodes a frame of FramePipe.frames
+    """
+    with Image.open(io.BytesIO(data)) as file:
+        return file.copy()  # without the decoder (and its canvas) of the webp-file
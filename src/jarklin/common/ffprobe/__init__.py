@@ -11,15 +11,16 @@ import subprocess as sp
 from pydantic import ValidationError
 from ..executables import ffprobe_executable
 from ...common.ffprobe.model import FFProbe
+from .cache import FFProbeCache, get_ffprobe_cache
 
 
-__all__ = ['ffprobe']
+__all__ = ['ffprobe', 'ffprobe_json', 'FFProbeCache', 'get_ffprobe_cache']
 
 
 logger = logging.getLogger(__name__)
 
 
-def ffprobe(fp: t.Union[str, PathLike]) -> FFProbe:
+def ffprobe_json(fp: t.Union[str, PathLike]) -> t.Dict[str, t.Any]:
     args = [
         ffprobe_executable(),
         '-hide_banner',
@@ -30,7 +31,11 @@ def ffprobe(fp: t.Union[str, PathLike]) -> FFProbe:
     logger.debug(f"running: {shlex.join(args)}")
 
     result = sp.run(args, check=True, capture_output=True, text=True)
-    result = json.loads(result.stdout)
+    return json.loads(result.stdout)
+
+
+def ffprobe(fp: t.Union[str, PathLike]) -> FFProbe:
+    result = ffprobe_json(fp)
     try:
         return FFProbe.model_validate(result)
     except (ValidationError, TypeError, ValueError) as e:
@@ -0,0 +1,130 @@
+# -*- coding=utf-8 -*-
+r"""
+persistent cache of the ffprobe-results.
+an entry is only reused while the file has the same size, modification-time and inode
+"""
+import os
+import json
+import zlib
+import sqlite3
+import logging
+import threading
+import typing as t
+from pathlib import Path
+from functools import cache
+from contextlib import closing
+from collections import OrderedDict
+from ..types import PathSource
+from .model import FFProbe
+
+
+__all__ = ['FFProbeCache', 'get_ffprobe_cache']
+
+
+logger = logging.getLogger(__name__)
+
+
+class FFProbeCache:
+    VERSION = 1
+    # number of validated results that are additionally kept in memory
+    MEMORY_SIZE = 256
+
+    def __init__(self, fp: PathSource, root: PathSource):
+        self.fp = Path(fp)
+        self.root = Path(root).absolute()
+        self._lock = threading.Lock()
+        self._memory: t.OrderedDict[t.Tuple[str, int, int, int], FFProbe] = OrderedDict()
+        self._setup_done = False
+
+    def __repr__(self):
+        return f"<{type(self).__name__}: {self.fp!s}>"
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.fp, timeout=30)
+        if not self._setup_done:
+            connection.execute("PRAGMA journal_mode=WAL")  # readers don't block the writing cache-workers
+            connection.execute("CREATE TABLE IF NOT EXISTS probes ("
+                               " path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL,"
+                               " inode INTEGER NOT NULL, version INTEGER NOT NULL, result BLOB NOT NULL)")
+            connection.commit()
+            self._setup_done = True
+        return connection
+
+    def _key(self, source: Path) -> str:
+        source = source.absolute()
+        try:
+            return str(source.relative_to(self.root))
+        except ValueError:
+            return str(source)
+
+    def probe(self, source: PathSource) -> FFProbe:
+        r"""
+        returns the (cached) ffprobe-result of the file
+        """
+        from . import ffprobe_json
+
+        source = Path(source)
+        stat = source.stat()
+        key = self._key(source)
+        identity = (key, stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+        with self._lock:
+            result = self._memory.get(identity)
+            if result is not None:
+                self._memory.move_to_end(identity)
+                return result
+
+        data = None
+        try:
+            with closing(self._connect()) as connection, connection:
+                row = connection.execute(
+                    "SELECT result FROM probes WHERE path = ? AND size = ? AND mtime_ns = ? AND inode = ?"
+                    " AND version = ?",
+                    (*identity, self.VERSION)
+                ).fetchone()
+            if row is not None:
+                data = json.loads(zlib.decompress(row[0]))
+        except (sqlite3.Error, zlib.error, ValueError) as error:
+            logger.warning(f"{self} - failed to read cached result of {key}", exc_info=error)
+
+        if data is None:
+            data = ffprobe_json(source)
+            try:
+                with closing(self._connect()) as connection, connection:
+                    connection.execute(
+                        "INSERT OR REPLACE INTO probes (path, size, mtime_ns, inode, version, result)"
+                        " VALUES (?, ?, ?, ?, ?, ?)",
+                        (*identity, self.VERSION, zlib.compress(json.dumps(data, separators=(',', ':')).encode()))
+                    )
+            except sqlite3.Error as error:
+                logger.warning(f"{self} - failed to store result of {key}", exc_info=error)
+
+        result = FFProbe.model_validate(data)
+        with self._lock:
+            self._memory[identity] = result
+            if len(self._memory) > self.MEMORY_SIZE:
+                self._memory.popitem(last=False)
+        return result
+
+    def prune(self) -> None:
+        r"""
+        removes the entries of files that no longer exist
+        """
+        try:
+            with closing(self._connect()) as connection, connection:
+                stale = [(path,) for path, in connection.execute("SELECT path FROM probes")
+                         if not os.path.isfile(self.root.joinpath(path))]
+                if stale:
+                    logger.debug(f"{self} - removing {len(stale)} results")
+                    connection.executemany("DELETE FROM probes WHERE path = ?", stale)
+        except sqlite3.Error as error:
+            logger.warning(f"{self} - failed to prune", exc_info=error)
+
+
+@cache
+def get_ffprobe_cache(root: PathSource) -> FFProbeCache:
+    r"""
+    the shared cache of a media-root (stored under {root}/.jarklin/)
+    """
+    root = Path(root).absolute()
+    return FFProbeCache(fp=root.joinpath(".jarklin", "ffprobe.db"), root=root)
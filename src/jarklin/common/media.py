@@ -0,0 +1,137 @@
+# -*- coding=utf-8 -*-
+r"""
+{name}.json          full list of entries. only rewritten in batches
+{name}.journal.jsonl one entry per line. entries that were added since the last full write
+{name}.generation    counter that increases with every change of the other two files
+"""
+import json
+import time
+import logging
+import typing as t
+from pathlib import Path
+from .types import PathSource
+from .atomic import atomic_write
+
+
+__all__ = ['JsonListWriter', 'read_json_list', 'read_generation', 'journal_path', 'generation_path']
+
+
+logger = logging.getLogger(__name__)
+Entry = t.TypeVar('Entry', bound=t.Mapping[str, t.Any])
+
+
+def journal_path(fp: PathSource) -> Path:
+    fp = Path(fp)
+    return fp.with_name(f"{fp.stem}.journal.jsonl")
+
+
+def generation_path(fp: PathSource) -> Path:
+    fp = Path(fp)
+    return fp.with_name(f"{fp.stem}.generation")
+
+
+def read_generation(fp: PathSource) -> int:
+    r"""
+    returns the current generation of the list. cheap way to check for changes
+    """
+    try:
+        return int(generation_path(fp).read_text())
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def read_json_list(fp: PathSource, key: str) -> t.List[t.Any]:
+    r"""
+    reads the full list and applies the journal on top of it. entries with the same key are replaced
+    """
+    fp = Path(fp)
+    try:
+        entries = {entry[key]: entry for entry in json.loads(fp.read_bytes())}
+    except FileNotFoundError:
+        entries = {}
+    try:
+        with open(journal_path(fp), 'rb') as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:  # the last line could be currently written
+                    continue
+                entries[entry[key]] = entry
+    except FileNotFoundError:
+        pass
+    return list(entries.values())
+
+
+class JsonListWriter(t.Generic[Entry]):
+    r"""
+    keeps the entries in memory. added entries are appended to the journal and the full list is only
+    written once max_pending entries were added or max_delay seconds passed since the last write
+    """
+
+    def __init__(self, fp: PathSource, key: str, max_pending: int = 100, max_delay: float = 30):
+        self.fp = Path(fp)
+        self.journal_fp = journal_path(self.fp)
+        self.generation_fp = generation_path(self.fp)
+        self.key = key
+        self.max_pending = max_pending
+        self.max_delay = max_delay
+        self.entries: t.Dict[str, Entry] = {}
+        self._pending = 0
+        self._dirty = False
+        self._last_write = time.monotonic()
+        self.generation = read_generation(self.fp)
+
+    def __repr__(self):
+        return f"<{type(self).__name__}: {self.fp.name}>"
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self._dirty = True
+
+    def discard(self, predicate: t.Callable[[str], bool]) -> None:
+        r"""
+        removes all entries where predicate(key) is true. only visible to readers after the next flush()
+        """
+        for key in [key for key in self.entries.keys() if predicate(key)]:
+            del self.entries[key]
+            self._dirty = True
+
+    def update(self, entry: Entry) -> None:
+        r"""
+        sets the entry without writing it to the journal. only visible to readers after the next flush()
+        """
+        self.entries[entry[self.key]] = entry
+        self._dirty = True
+
+    def add(self, entry: Entry) -> None:
+        r"""
+        sets the entry and appends it to the journal. writes the full list if a threshold is reached
+        """
+        self.entries[entry[self.key]] = entry
+        with open(self.journal_fp, 'a') as file:
+            file.write(json.dumps(entry) + "\n")
+        self._next_generation()
+        self._pending += 1
+        self._dirty = True
+        if self._pending >= self.max_pending or time.monotonic() - self._last_write >= self.max_delay:
+            self.flush()
+
+    def flush(self) -> None:
+        r"""
+        writes the full list (if anything changed) and empties the journal
+        """
+        if not self._dirty:
+            return
+        logger.info(f"updating {self.fp.name}")
+        atomic_write(self.fp, json.dumps(list(self.entries.values())))
+        if self.journal_fp.exists():
+            with open(self.journal_fp, 'w'):
+                pass
+        self._next_generation()
+        self._pending = 0
+        self._dirty = False
+        self._last_write = time.monotonic()
+
+    def _next_generation(self) -> None:
+        self.generation += 1
+        atomic_write(self.generation_fp, str(self.generation))
@@ -0,0 +1,72 @@
+# -*- coding=utf-8 -*-
+r"""
+.jarklin/requested.json     {path: timestamp} of the paths that were recently requested through the web-server.
+                            the cache generates these first (cache.priority: requested)
+"""
+import json
+import time
+import logging
+import threading
+import typing as t
+from pathlib import Path
+from .types import PathSource
+from .atomic import atomic_write
+
+
+__all__ = ['RequestLog', 'read_requested']
+
+
+logger = logging.getLogger(__name__)
+
+
+def read_requested(fp: PathSource) -> t.Dict[str, float]:
+    r"""
+    no-fail read of the requested paths (relative to the root)
+    """
+    try:
+        requested = json.loads(Path(fp).read_bytes())
+    except (FileNotFoundError, ValueError):
+        return {}
+    if not isinstance(requested, dict):
+        return {}
+    return requested
+
+
+class RequestLog:
+    r"""
+    collects the requested paths in memory and writes them max_delay seconds after the first new request.
+    only the max_entries most recent paths are kept
+    """
+
+    def __init__(self, fp: PathSource, max_entries: int = 1000, max_delay: float = 10):
+        self.fp = Path(fp)
+        self.max_entries = max_entries
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self._entries = read_requested(self.fp)
+        self._timer: t.Optional[threading.Timer] = None
+
+    def __repr__(self):
+        return f"<{type(self).__name__}: {self.fp.name}>"
+
+    def record(self, path: str) -> None:
+        with self._lock:
+            self._entries.pop(path, None)  # re-insert to keep the dict ordered by time
+            self._entries[path] = time.time()
+            if self._timer is None:
+                self._timer = threading.Timer(self.max_delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            while len(self._entries) > self.max_entries:
+                del self._entries[next(iter(self._entries))]
+            data = json.dumps(self._entries)
+        try:
+            atomic_write(self.fp, data)
+        except OSError as error:  # e.g. read-only mount of the root-directory
+            logger.debug(f"{self} - failed to write: {error}")
@@ -5,11 +5,17 @@ r"""
 import os
 import os.path as p
 import logging
+import hashlib
 from http import HTTPStatus
+from functools import cache
 import flask
-from werkzeug.exceptions import Unauthorized as HTTPUnauthorized, BadRequest as HTTPBadRequest, NotFound as HTTPNotFound
-from .utility import requires_authenticated, validate_user, to_bool
+from werkzeug.exceptions import HTTPException, Unauthorized as HTTPUnauthorized, BadRequest as HTTPBadRequest, \
+    NotFound as HTTPNotFound
+from .utility import requires_authenticated, validate_user, to_bool, send_file
+from .media_index import MediaIndex, SORT_KEYS
+from ..common.requested import RequestLog
 from . import optimization
+from . import metrics
 
 
 logger = logging.getLogger(__name__)
@@ -28,31 +34,108 @@ def files(resource: str):
     attempt_optimization = flask.request.args.get("optimize", default=False, type=to_bool)
     as_download = flask.request.args.get("download", default=False, type=to_bool)
 
-    root = p.abspath(os.getcwd())
-    fp = p.abspath(p.join(root, resource))
-    if fp in app.config['EXCLUDE']:
-        logger.warning(f"attempt to access excluded file ({resource})")
-        raise HTTPNotFound(resource)
-    if p.commonpath([root, fp]) != root:
-        logger.warning(f"attempt to access files outside root directory ({resource})")
-        raise HTTPNotFound(resource)
+    fp = resolve_resource(resource)
+    record_request(fp)
 
     if attempt_optimization and flask.current_app.config['JIT_OPTIMIZATION']:
         try:
-            response = optimization.optimize_file(fp)
+            with metrics.timed_phase("optimization"):
+                response = optimization.optimize_file(fp)
             if response is not None:
                 return response
         except NotImplementedError:  # this is fine
             pass
+        except HTTPException:  # invalid request (e.g. unknown resolution)
+            raise
         except Exception as error:  # no-fail
             logger.error(f"optimization for {resource!r} failed", exc_info=error)
 
     try:
-        return flask.send_file(fp, as_attachment=as_download)
+        return send_file(fp, as_attachment=as_download)
     except FileNotFoundError:
         raise HTTPNotFound(resource)
 
 
+def resolve_resource(resource: str) -> str:
+    r"""
+    absolute path of the resource. raises NotFound for excluded files or files outside the root directory
+    """
+    root = p.abspath(os.getcwd())
+    fp = p.abspath(p.join(root, resource))
+    if fp in app.config['EXCLUDE']:
+        logger.warning(f"attempt to access excluded file ({resource})")
+        raise HTTPNotFound(resource)
+    if p.commonpath([root, fp]) != root:
+        logger.warning(f"attempt to access files outside root directory ({resource})")
+        raise HTTPNotFound(resource)
+    return fp
+
+
+@cache
+def get_request_log() -> RequestLog:
+    return RequestLog(p.join(os.getcwd(), '.jarklin', 'requested.json'))
+
+
+def record_request(fp: str) -> None:
+    r"""
+    remembers the path so the cache generates it first (cache.priority: requested)
+    """
+    if not flask.current_app.config.get('TRACK_REQUESTS'):
+        return
+    resource = p.relpath(fp, os.getcwd())
+    if resource.split(os.sep, 1)[0] == ".jarklin":  # previews etc.
+        return
+    get_request_log().record(resource)
+
+
+def resolve_hls_resource(resource: str) -> str:
+    fp = resolve_resource(resource)
+    if not p.isfile(fp):
+        raise HTTPNotFound(resource)
+    if not optimization.allows_optimization(fp):
+        raise HTTPNotFound("optimization is not enabled for this file")
+    return fp
+
+
+@app.get("/hls/<path:resource>/master.m3u8")
+@requires_authenticated
+def hls_master_playlist(resource: str):
+    fp = resolve_hls_resource(resource)
+    record_request(fp)
+    return optimization.hls.master_playlist(fp)
+
+
+@app.get("/hls/<path:resource>/<resolution>/index.m3u8")
+@requires_authenticated
+def hls_media_playlist(resource: str, resolution: str):
+    return optimization.hls.media_playlist(resolve_hls_resource(resource), resolution=resolution)
+
+
+@app.get("/hls/<path:resource>/<resolution>/<int:index>.ts")
+@requires_authenticated
+def hls_segment(resource: str, resolution: str, index: int):
+    return optimization.hls.segment(resolve_hls_resource(resource), resolution=resolution, index=index)
+
+
+@app.get("/metrics")
+def get_metrics():
+    if not flask.current_app.config.get('METRICS_ENABLED'):
+        raise HTTPNotFound()
+    if flask.current_app.config.get('METRICS_PUBLIC'):
+        return metrics_response()
+    return requires_authenticated(metrics_response)()
+
+
+def metrics_response() -> flask.Response:
+    text = metrics.render()
+    try:  # written by the cache-generation
+        with open(p.join(os.getcwd(), '.jarklin', 'metrics.prom'), 'r') as file:
+            text += file.read()
+    except FileNotFoundError:
+        pass
+    return flask.Response(text, mimetype="text/plain; version=0.0.4")
+
+
 @app.get("/api/config")
 def get_config():
     return dict(
@@ -61,11 +144,52 @@ def get_config():
     )
 
 
+@cache
+def get_media_index() -> MediaIndex:
+    return MediaIndex(p.join(os.getcwd(), '.jarklin', 'media.json'))
+
+
+@app.get("/api/media")
+@requires_authenticated
+def get_media():
+    media_type = flask.request.args.get("type", default=None)
+    sort = flask.request.args.get("sort", default=None)
+    order = flask.request.args.get("order", default="asc")
+    offset = flask.request.args.get("offset", default=0, type=int)
+    limit = flask.request.args.get("limit", default=100, type=int)
+
+    if media_type not in {None, "video", "gallery"}:
+        raise HTTPBadRequest(f"Invalid type: {media_type!r}")
+    if sort is not None and sort not in SORT_KEYS:
+        raise HTTPBadRequest(f"Invalid sort: {sort!r}")
+    if order not in {"asc", "desc"}:
+        raise HTTPBadRequest(f"Invalid order: {order!r}")
+    if offset < 0 or not (0 < limit <= 1000):
+        raise HTTPBadRequest("offset must be positive and limit between 1 and 1000")
+
+    snapshot = get_media_index().refresh()
+    query = f"{snapshot.version}|{media_type}|{sort}|{order}|{offset}|{limit}"
+    etag = hashlib.md5(query.encode('utf-8')).hexdigest()
+    if flask.request.if_none_match.contains(etag):
+        response = flask.Response(status=HTTPStatus.NOT_MODIFIED)
+    else:
+        entries = snapshot.query(media_type=media_type, sort=sort, reverse=order == "desc")
+        response = flask.jsonify(
+            total=len(entries),
+            offset=offset,
+            limit=limit,
+            items=entries[offset:offset + limit],
+        )
+    response.set_etag(etag)
+    response.cache_control.no_cache = True  # always revalidate (cheap due to the etag)
+    return response
+
+
 @app.get("/api/video-resolutions")
 def get_video_resolutions():
     return {
         name: info._asdict()
-        for name, info in optimization.VIDEO_BITRATE_MAP.items()
+        for name, info in optimization.get_video_profiles().items()
     }
 
 
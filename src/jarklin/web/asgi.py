@@ -0,0 +1,214 @@
+# -*- coding=utf-8 -*-
+r"""
+asgi-application for the async server-mode (web.server_mode: async)
+
+the flask-app still handles every request (auth, path-checks, optimization) in a worker-thread,
+but the response-bodies are sent with async I/O so slow clients and long video-streams only hold a connection:
+- files (wsgi.file_wrapper) are read in chunks or sent zero-copy if the server supports it
+- async-iterable bodies (e.g. the ffmpeg-streams) run on the event-loop with asyncio-subprocesses
+- other bodies are advanced chunk by chunk in a worker-thread
+"""
+import io
+import os
+import sys
+import asyncio
+import logging
+import contextlib
+import typing as t
+from concurrent.futures import ThreadPoolExecutor
+from .utility import aiter_chunks
+
+
+__all__ = ['AsgiBridge', 'FileWrapper']
+
+
+logger = logging.getLogger(__name__)
+
+
+class FileWrapper:
+    r"""
+    wsgi.file_wrapper of the async server-mode. like the one of waitress prepare(size) limits it to the content-length
+    """
+
+    def __init__(self, file: t.BinaryIO, block_size: int = 64 * 1024):
+        self.file = file
+        self.block_size = block_size
+        self.remain: t.Optional[int] = None
+
+    def prepare(self, size: t.Optional[int] = None) -> int:
+        position = self.file.tell()
+        available = self.file.seek(0, os.SEEK_END) - position
+        self.file.seek(position)
+        self.remain = available if size is None else min(available, size)
+        return self.remain
+
+    def __iter__(self) -> t.Iterator[bytes]:
+        if self.remain is None:
+            self.prepare()
+        while self.remain > 0:
+            chunk = self.file.read(min(self.block_size, self.remain))
+            if not chunk:
+                break
+            self.remain -= len(chunk)
+            yield chunk
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class AsgiBridge:
+    def __init__(self, wsgi_app: t.Callable, threads: int = 16):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="jarklin-worker")
+
+    async def __call__(self, scope: dict, receive: t.Callable, send: t.Callable) -> None:
+        if scope['type'] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope['type'] == "http":
+            await self._http(scope, receive, send)
+        else:
+            logger.warning(f"unsupported connection type: {scope['type']!r}")
+
+    async def _lifespan(self, receive: t.Callable, send: t.Callable) -> None:
+        while True:
+            message = await receive()
+            if message['type'] == "lifespan.startup":
+                # the body-iteration (aiter_chunks) uses the default executor
+                asyncio.get_running_loop().set_default_executor(self.executor)
+                await send({'type': "lifespan.startup.complete"})
+            elif message['type'] == "lifespan.shutdown":
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                await send({'type': "lifespan.shutdown.complete"})
+                return
+
+    async def _http(self, scope: dict, receive: t.Callable, send: t.Callable) -> None:
+        loop = asyncio.get_running_loop()
+
+        body = []
+        while True:
+            message = await receive()
+            if message['type'] == "http.disconnect":
+                return
+            body.append(message.get('body', b""))
+            if not message.get('more_body', False):
+                break
+
+        environ = self._environ(scope, body=b"".join(body))
+        try:
+            status, headers, app_iter = await loop.run_in_executor(self.executor, self._call_app, environ)
+        except Exception as error:
+            logger.error("unhandled exception in the wsgi-application", exc_info=error)
+            await send({'type': "http.response.start", 'status': 500, 'headers': []})
+            await send({'type': "http.response.body", 'body': b"", 'more_body': False})
+            return
+
+        try:
+            await send({
+                'type': "http.response.start",
+                'status': int(status.split(" ", 1)[0]),
+                'headers': [(key.lower().encode('latin-1'), value.encode('latin-1')) for key, value in headers],
+            })
+            if scope['method'] == "HEAD":
+                await send({'type': "http.response.body", 'body': b"", 'more_body': False})
+                return
+
+            content_length = next((int(value) for key, value in headers if key.lower() == "content-length"), None)
+            sending = asyncio.ensure_future(self._send_body(scope, send, app_iter, content_length=content_length))
+            disconnect = asyncio.ensure_future(self._wait_for_disconnect(receive))
+            await asyncio.wait({sending, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+            if sending.done():
+                disconnect.cancel()
+                sending.result()
+            else:  # stops e.g. ffmpeg for a closed video-stream
+                logger.debug(f"client disconnected ({scope['path']})")
+                sending.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await sending
+        finally:
+            close = getattr(app_iter, 'close', None)
+            if close is not None:
+                await loop.run_in_executor(self.executor, close)
+
+    @staticmethod
+    async def _send_body(scope: dict, send: t.Callable, app_iter: t.Iterable[bytes],
+                         content_length: t.Optional[int]) -> None:
+        if isinstance(app_iter, FileWrapper):
+            remain = app_iter.prepare(content_length)
+            if "http.response.zerocopysend" in scope.get('extensions', {}):
+                await send({
+                    'type': "http.response.zerocopysend",
+                    'file': app_iter.file,
+                    'offset': app_iter.file.tell(),
+                    'count': remain,
+                    'more_body': False,
+                })
+                return
+
+        chunks = aiter_chunks(app_iter)
+        try:
+            async for chunk in chunks:
+                if chunk:
+                    await send({'type': "http.response.body", 'body': chunk, 'more_body': True})
+        finally:
+            await chunks.aclose()
+        await send({'type': "http.response.body", 'body': b"", 'more_body': False})
+
+    @staticmethod
+    async def _wait_for_disconnect(receive: t.Callable) -> None:
+        while (await receive())['type'] != "http.disconnect":
+            pass
+
+    def _call_app(self, environ: dict) -> t.Tuple[str, t.List[t.Tuple[str, str]], t.Iterable[bytes]]:
+        response = {}
+
+        def start_response(status: str, headers: t.List[t.Tuple[str, str]], exc_info=None):
+            if exc_info is not None and response:
+                raise exc_info[1].with_traceback(exc_info[2])
+            response.update(status=status, headers=headers)
+
+            def write(_data: bytes) -> None:
+                raise NotImplementedError("the write() callable is not supported")
+
+            return write
+
+        app_iter = self.wsgi_app(environ, start_response)
+        if not response:  # start_response() is allowed to be delayed until the first chunk
+            iterator = iter(app_iter)
+            first = next(iterator, b"")
+            body = [first, *iterator]
+            close = getattr(app_iter, 'close', None)
+            if close is not None:
+                close()
+            app_iter = body
+        return response['status'], response['headers'], app_iter
+
+    @staticmethod
+    def _environ(scope: dict, body: bytes) -> dict:
+        server_name, server_port = scope.get('server') or ("localhost", 80)
+        client = scope.get('client') or ("", 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', "").encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope['query_string'].decode('latin-1'),
+            'SERVER_NAME': server_name,
+            'SERVER_PORT': str(server_port),
+            'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+            'REMOTE_ADDR': client[0],
+            'REMOTE_PORT': str(client[1]),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', "http"),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+            'wsgi.file_wrapper': FileWrapper,
+        }
+        for raw_key, raw_value in scope['headers']:
+            key = raw_key.decode('latin-1').upper().replace("-", "_")
+            value = raw_value.decode('latin-1')
+            if key not in {"CONTENT_TYPE", "CONTENT_LENGTH"}:
+                key = f"HTTP_{key}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
@@ -0,0 +1,84 @@
+# -*- coding=utf-8 -*-
+r"""
+in-memory copy of the media-list written by the cache (.jarklin/media.json + journal)
+"""
+import os
+import logging
+import threading
+import typing as t
+from ..common.types import MediaEntry, PathSource
+from ..common.media import read_json_list, read_generation
+
+
+__all__ = ['MediaIndex', 'MediaSnapshot', 'SORT_KEYS']
+
+
+logger = logging.getLogger(__name__)
+
+
+SORT_KEYS: t.Dict[str, t.Callable[[MediaEntry], t.Any]] = {
+    'name': lambda entry: entry['name'].lower(),
+    'creation_time': lambda entry: entry['creation_time'],
+    'modification_time': lambda entry: entry['modification_time'],
+}
+
+
+class MediaSnapshot(t.NamedTuple):
+    r"""
+    the entries of one version. the cached (filtered/sorted) views are shared by all users of the snapshot
+    """
+    version: str
+    entries: t.List[MediaEntry]
+    views: t.Dict[tuple, t.List[MediaEntry]]
+
+    def query(self, media_type: t.Optional[str] = None, sort: t.Optional[str] = None,
+              reverse: bool = False) -> t.List[MediaEntry]:
+        r"""
+        returns the (filtered and sorted) entries. results are kept as long as the snapshot is current
+        """
+        key = (media_type, sort, reverse)
+        view = self.views.get(key)
+        if view is None:
+            view = self.entries
+            if media_type is not None:
+                view = [entry for entry in view if entry['meta']['type'] == media_type]
+            if sort is not None:
+                view = sorted(view, key=SORT_KEYS[sort], reverse=reverse)
+            elif reverse:
+                view = view[::-1]
+            self.views[key] = view
+        return view
+
+
+class MediaIndex:
+    def __init__(self, fp: PathSource):
+        self.fp = fp
+        self._lock = threading.Lock()
+        self._snapshot: t.Optional[MediaSnapshot] = None
+
+    def __repr__(self):
+        return f"<{type(self).__name__}: {self.fp!s}>"
+
+    def _current_version(self) -> str:
+        try:
+            mtime_ns = os.stat(self.fp).st_mtime_ns
+        except FileNotFoundError:
+            mtime_ns = 0
+        return f"{read_generation(self.fp)}-{mtime_ns}"
+
+    def refresh(self) -> MediaSnapshot:
+        r"""
+        reloads the entries if the cache changed them.
+        returns the current snapshot. its version always belongs to its entries
+        """
+        version = self._current_version()
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.version != version:
+            with self._lock:
+                snapshot = self._snapshot
+                if snapshot is None or snapshot.version != version:
+                    logger.debug(f"{self} - reloading ({version})")
+                    snapshot = self._snapshot = MediaSnapshot(
+                        version=version, entries=read_json_list(self.fp, key='path'), views={},
+                    )
+        return snapshot
@@ -0,0 +1,226 @@
+# -*- coding=utf-8 -*-
+r"""
+request-metrics of the web-server in the prometheus text-format (web.metrics)
+
+- latency until the response is ready per route (histogram)
+- duration of the phases of a request (auth, optimization, gzip)
+- bytes sent and the currently active response-streams
+- hits and misses of the optimization-caches
+
+the counters are only a few additions under a lock, so the overhead per request stays small
+"""
+import time
+import bisect
+import logging
+import threading
+import contextlib
+import collections
+import functools
+import typing as t
+
+
+__all__ = ['MetricsMiddleware', 'ROUTE_KEY', 'record_cache', 'timed_phase', 'phase_timer', 'render']
+
+
+logger = logging.getLogger(__name__)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROUTE_KEY = 'jarklin.route'
+
+
+class _Histogram:
+    def __init__(self, buckets: t.Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self, name: str, labels: str) -> t.Iterator[str]:
+        cumulative = 0
+        for bound, count in zip((*self.buckets, "+Inf"), self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels}{"," if labels else ""}le="{bound}"}} {cumulative}'
+        yield f"{name}_sum{{{labels}}} {self.sum}"
+        yield f"{name}_count{{{labels}}} {cumulative}"
+
+
+class _Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.latency: t.Dict[t.Tuple[str, str], _Histogram] = collections.defaultdict(_Histogram)
+        self.requests: t.Dict[t.Tuple[str, str, int], int] = collections.Counter()
+        self.bytes_sent: t.Dict[str, int] = collections.Counter()
+        self.active_streams = 0
+        self.phases: t.Dict[str, _Histogram] = collections.defaultdict(_Histogram)
+        self.cache: t.Dict[t.Tuple[str, str], int] = collections.Counter()
+
+
+_registry = _Registry()
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    r"""
+    counts a lookup in one of the optimization-caches
+    """
+    with _registry.lock:
+        _registry.cache[cache, "hit" if hit else "miss"] += 1
+
+
+@contextlib.contextmanager
+def timed_phase(phase: str) -> t.Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        with _registry.lock:
+            _registry.phases[phase].observe(duration)
+
+
+def phase_timer(phase: str) -> t.Callable[[t.Callable], t.Callable]:
+    r"""
+    decorator-version of timed_phase()
+    """
+    def decorator(fn: t.Callable) -> t.Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timed_phase(phase):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class MetricsMiddleware:
+    r"""
+    wsgi-middleware around the flask-app. the route is set by the app (ROUTE_KEY in the environ)
+    """
+
+    def __init__(self, app: t.Callable):
+        self.app = app
+
+    def __call__(self, environ: dict, start_response: t.Callable) -> t.Iterable[bytes]:
+        start = time.perf_counter()
+        response = {}
+
+        def tracked_start_response(status: str, headers: t.List[t.Tuple[str, str]], exc_info=None):
+            response.update(status=status, headers=headers)
+            return start_response(status, headers, exc_info)
+
+        app_iter = self.app(environ, tracked_start_response)
+        duration = time.perf_counter() - start
+
+        method = environ.get('REQUEST_METHOD', "")
+        route = environ.get(ROUTE_KEY, "<unmatched>")
+        status = int(response.get('status', "0").split(" ", 1)[0])
+        with _registry.lock:
+            _registry.latency[method, route].observe(duration)
+            _registry.requests[method, route, status] += 1
+            _registry.active_streams += 1
+
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if isinstance(file_wrapper, type) and isinstance(app_iter, file_wrapper):
+            # the server sends the file itself (possibly zero-copy). wrapping it would prevent that.
+            # counted with the content-length, as the actually sent bytes are unknown
+            content_length = next((int(value) for key, value in response.get('headers', [])
+                                   if key.lower() == "content-length"), 0)
+            return _track_file_wrapper(app_iter, route=route, size=content_length)
+        if hasattr(app_iter, '__aiter__'):
+            return _AsyncTrackedBody(app_iter, route=route)
+        return _TrackedBody(app_iter, route=route)
+
+
+def _finish_stream(route: str, sent: int) -> None:
+    with _registry.lock:
+        _registry.active_streams -= 1
+        _registry.bytes_sent[route] += sent
+
+
+def _track_file_wrapper(app_iter: t.Any, route: str, size: int) -> t.Any:
+    close = getattr(app_iter, 'close', None)
+
+    def tracked_close() -> None:
+        try:
+            if close is not None:
+                close()
+        finally:
+            _finish_stream(route, sent=size)
+
+    app_iter.close = tracked_close
+    return app_iter
+
+
+class _TrackedBody:
+    def __init__(self, app_iter: t.Iterable[bytes], route: str):
+        self.app_iter = app_iter
+        self.route = route
+        self.sent = 0
+        self._closed = False
+
+    def __iter__(self) -> t.Iterator[bytes]:
+        for chunk in self.app_iter:
+            self.sent += len(chunk)
+            yield chunk
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            close = getattr(self.app_iter, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            _finish_stream(self.route, sent=self.sent)
+
+
+class _AsyncTrackedBody(_TrackedBody):
+    r"""
+    keeps the async-iteration of the body available (async server-mode)
+    """
+
+    async def __aiter__(self) -> t.AsyncIterator[bytes]:
+        async for chunk in self.app_iter:
+            self.sent += len(chunk)
+            yield chunk
+
+
+def render() -> str:
+    r"""
+    all metrics in the prometheus text-format
+    """
+    lines = []
+
+    def metric(name: str, kind: str, help_text: str) -> None:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    with _registry.lock:
+        metric("jarklin_web_started_timestamp_seconds", "gauge", "start of the web-server")
+        lines.append(f"jarklin_web_started_timestamp_seconds {_registry.started}")
+        metric("jarklin_web_request_duration_seconds", "histogram", "time until the response is ready (per route)")
+        for (method, route), histogram in sorted(_registry.latency.items()):
+            lines.extend(histogram.samples("jarklin_web_request_duration_seconds",
+                                           labels=f'method="{method}",route="{_escape(route)}"'))
+        metric("jarklin_web_requests_total", "counter", "handled requests")
+        for (method, route, status), count in sorted(_registry.requests.items()):
+            lines.append(f'jarklin_web_requests_total{{method="{method}",route="{_escape(route)}",'
+                         f'status="{status}"}} {count}')
+        metric("jarklin_web_response_bytes_total", "counter", "bytes of the response-bodies")
+        for route, sent in sorted(_registry.bytes_sent.items()):
+            lines.append(f'jarklin_web_response_bytes_total{{route="{_escape(route)}"}} {sent}')
+        metric("jarklin_web_active_streams", "gauge", "responses that are currently sent")
+        lines.append(f"jarklin_web_active_streams {_registry.active_streams}")
+        metric("jarklin_web_phase_duration_seconds", "histogram", "duration of the phases of the requests")
+        for phase, histogram in sorted(_registry.phases.items()):
+            lines.extend(histogram.samples("jarklin_web_phase_duration_seconds", labels=f'phase="{phase}"'))
+        metric("jarklin_web_optimization_cache_requests_total", "counter", "lookups in the optimization-caches")
+        for (cache, result), count in sorted(_registry.cache.items()):
+            lines.append(f'jarklin_web_optimization_cache_requests_total{{cache="{cache}",result="{result}"}} {count}')
+    return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"')
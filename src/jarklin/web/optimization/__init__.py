@@ -6,21 +6,26 @@ import logging
 import mimetypes
 import flask
 from .image import optimize_image
-from .video import optimize_video, BITRATE_MAP as VIDEO_BITRATE_MAP
+from .video import optimize_video, get_video_profiles, BITRATE_MAP as VIDEO_BITRATE_MAP
+from . import hls
 
 
-__all__ = ['optimize_file', 'VIDEO_BITRATE_MAP']
+__all__ = ['optimize_file', 'allows_optimization', 'hls', 'get_video_profiles', 'VIDEO_BITRATE_MAP']
 
 
-def optimize_file(fp: str):
+def allows_optimization(fp: str) -> bool:
     mimetype, _ = mimetypes.guess_type(fp)
     if not mimetype:
-        return None
+        return False
     maintype, _, subtype = mimetype.partition("/")
     jit_optimization = flask.current_app.config.get('JIT_OPTIMIZATION', {})
-    allows_optimization = jit_optimization.get(mimetype, False) or jit_optimization.get(maintype, False)
-    if not allows_optimization:
+    return bool(jit_optimization.get(mimetype, False) or jit_optimization.get(maintype, False))
+
+
+def optimize_file(fp: str):
+    if not allows_optimization(fp):
         return None
+    maintype, _, _ = mimetypes.guess_type(fp)[0].partition("/")
 
     if maintype == "image":
         logging.debug("Attempt to optimize image")
@@ -0,0 +1,79 @@
+# -*- coding=utf-8 -*-
+r"""
+admission-control for the jit-optimization.
+every job costs load (e.g. relative to a 720p30 transcode). new jobs are only started while the total load
+stays within the capacity of the machine and not more than max_running jobs are running.
+requests wait up to a timeout for a free slot instead of piling up
+"""
+import math
+import logging
+import threading
+import typing as t
+
+
+__all__ = ['Admission', 'AdmissionSlot']
+
+
+logger = logging.getLogger(__name__)
+
+
+class Admission:
+    def __init__(self, capacity: float = math.inf, max_running: t.Optional[int] = None):
+        self.capacity = capacity
+        self.max_running = max_running
+        self.load = 0.0
+        self.running = 0
+        self._condition = threading.Condition()
+
+    def __repr__(self):
+        return f"<{type(self).__name__}: load={self.load:.2f}/{self.capacity:.2f} " \
+               f"running={self.running}/{self.max_running}>"
+
+    def _fits(self, cost: float) -> bool:
+        # an idle machine always admits one job, even if it costs more than the capacity
+        if self.running == 0:
+            return True
+        if self.max_running is not None and self.running >= self.max_running:
+            return False
+        return self.load + cost <= self.capacity
+
+    def try_acquire(self, cost: float = 1.0, timeout: float = 0.0) -> t.Optional['AdmissionSlot']:
+        r"""
+        reserves the load for a new job. waits up to timeout seconds for a free slot and returns None if there is none
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._fits(cost), timeout=timeout):
+                return None
+            self.load += cost
+            self.running += 1
+            logger.debug(f"{self} - admitted job with cost {cost:.2f}")
+            return AdmissionSlot(self, cost)
+
+    def _release(self, cost: float) -> None:
+        with self._condition:
+            self.load = max(0.0, self.load - cost)
+            self.running = max(0, self.running - 1)
+            self._condition.notify_all()
+
+
+class AdmissionSlot:
+    r"""
+    reserved load of a job. has to be released once the job finished
+    """
+
+    def __init__(self, admission: Admission, cost: float):
+        self._admission = admission
+        self.cost = cost
+        self._released = False
+
+    def release(self) -> None:
+        if self._released:
+            return
+        self._released = True
+        self._admission._release(self.cost)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
@@ -0,0 +1,128 @@
+# -*- coding=utf-8 -*-
+r"""
+on-disk cache for optimized files with a size-budget.
+the least recently used files are removed first (the modification-time is used as last-use)
+"""
+import os
+import time
+import uuid
+import functools
+import logging
+import threading
+import typing as t
+from pathlib import Path
+from ...common.types import PathSource
+
+
+__all__ = ['FileCache', 'get_file_cache']
+
+
+logger = logging.getLogger(__name__)
+
+
+class FileCache:
+    # .part-files are written to continuously. older ones are leftovers of a crashed process.
+    # newer ones may still be written by another process (e.g. other workers with the same directory)
+    STALE_PART_AGE = 60 * 60
+    # eviction goes below the budget, so the directory isn't listed again with the next commit
+    EVICT_TO = 0.9
+
+    def __init__(self, directory: PathSource, max_size: int):
+        self.directory = Path(directory)
+        self.max_size = max_size
+        self._lock = threading.RLock()
+        self._setup_done = False
+        self._total = 0  # tracked with every commit. re-counted by evict()
+
+    def __repr__(self):
+        return f"<{type(self).__name__}: {self.directory!s}>"
+
+    def _setup(self) -> None:
+        if self._setup_done:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        stale_before = time.time() - self.STALE_PART_AGE
+        for fp in self.directory.glob("*.part"):
+            try:
+                if fp.stat().st_mtime >= stale_before:
+                    continue
+                logger.debug(f"{self} - removing {fp.name}")
+                fp.unlink(missing_ok=True)
+            except FileNotFoundError:  # committed or removed in the meantime
+                pass
+        self._setup_done = True
+        self.evict()
+
+    def path(self, key: str) -> Path:
+        return self.directory.joinpath(key)
+
+    def get(self, key: str) -> t.Optional[Path]:
+        r"""
+        returns the path of the cached file and marks it as recently used. None if not cached
+        """
+        with self._lock:
+            self._setup()
+        fp = self.path(key)
+        try:
+            os.utime(fp)
+        except FileNotFoundError:
+            return None
+        return fp
+
+    def temp_path(self, key: str) -> Path:
+        r"""
+        a unique path to write the file to before it is put into the cache with commit()
+        """
+        with self._lock:
+            self._setup()
+        return self.directory.joinpath(f"{key}.{uuid.uuid4().hex[:8]}.part")
+
+    def commit(self, temp: PathSource, key: str) -> Path:
+        r"""
+        moves the finished file into the cache and removes old files if the budget is exceeded
+        """
+        fp = self.path(key)
+        size = os.stat(temp).st_size
+        with self._lock:
+            self._setup()
+            try:
+                replaced = fp.stat().st_size
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(temp, fp)
+            self._total += size - replaced
+            if self._total > self.max_size:
+                self.evict()
+        return fp
+
+    def evict(self) -> None:
+        r"""
+        lists the directory and removes the least recently used files until the size is below the budget
+        """
+        with self._lock:
+            entries: t.List[t.Tuple[float, int, Path]] = []
+            for fp in self.directory.iterdir():
+                if fp.suffix == ".part":
+                    continue
+                try:
+                    stat = fp.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, fp))
+            total = sum(size for _, size, _ in entries)
+            if total > self.max_size:
+                entries.sort()
+                while entries and total > self.max_size * self.EVICT_TO:
+                    _, size, fp = entries.pop(0)
+                    logger.debug(f"{self} - evicting {fp.name} ({size} bytes)")
+                    fp.unlink(missing_ok=True)
+                    total -= size
+            self._total = total
+
+
+@functools.cache
+def get_file_cache(directory: str, max_size: int) -> FileCache:
+    r"""
+    one instance per directory so the locking works across requests
+    """
+    return FileCache(directory=directory, max_size=max_size)
@@ -0,0 +1,196 @@
+# -*- coding=utf-8 -*-
+r"""
+HTTP-Live-Streaming of videos. the segments are only transcoded when they are requested
+
+master.m3u8                 one variant per video-profile (not larger than the video)
+{resolution}/index.m3u8     SEGMENT_DURATION long segments over the whole video
+{resolution}/{n}.ts         transcoded on request and kept in the transcode-cache
+"""
+import math
+import shlex
+import logging
+import threading
+import subprocess
+import typing as t
+import flask
+from werkzeug.exceptions import NotFound as HTTPNotFound, ServiceUnavailable as HTTPServiceUnavailable
+from ...common.executables import ffmpeg_executable
+from ...common.ffprobe.model import FFProbe
+from ..utility import send_file
+from ..metrics import record_cache
+from .video import OptimizationInfo, encoding_args, get_probe, get_transcode_cache, get_video_profiles, \
+    parse_bitrate, reserve, transcode_key
+
+
+__all__ = ['master_playlist', 'media_playlist', 'segment', 'SEGMENT_DURATION']
+
+
+logger = logging.getLogger(__name__)
+SEGMENT_DURATION = 6  # seconds
+PLAYLIST_MIMETYPE = "application/vnd.apple.mpegurl"
+SEGMENT_MIMETYPE = "video/mp2t"
+
+
+def _probe_or_404(fp: str) -> FFProbe:
+    probe = get_probe(fp)
+    if probe is None or not probe.video_streams:
+        raise HTTPNotFound("not a video")
+    return probe
+
+
+def renditions(probe: FFProbe) -> t.Dict[str, OptimizationInfo]:
+    r"""
+    the resolutions that don't upscale the video or increase its framerate
+    """
+    video = probe.main_video_stream
+    size = min(video.width, video.height)
+    fps = float(video.avg_frame_rate or 0) or 30
+    profiles = get_video_profiles()
+    available = {
+        name: info for name, info in profiles.items()
+        if info.height <= size and (info.max_fps <= 30 or fps > 30)
+    }
+    if not available:  # smaller than the smallest resolution
+        name = min(profiles.keys(), key=lambda key: profiles[key].height)
+        available[name] = profiles[name]
+    return available
+
+
+def master_playlist(fp: str) -> flask.Response:
+    probe = _probe_or_404(fp)
+    video = probe.main_video_stream
+    lines = ["#EXTM3U", "#EXT-X-VERSION:3"]
+    for name, info in renditions(probe).items():
+        # same calculation as the scale-filter
+        if video.width >= video.height:
+            height = min(info.height, video.height)
+            width = round(video.width * height / video.height / 2) * 2
+        else:
+            width = min(info.height, video.width)
+            height = round(video.height * width / video.width / 2) * 2
+        bandwidth = parse_bitrate(info.video_bitrate) + parse_bitrate(info.audio_bitrate)
+        lines.append(f"#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},RESOLUTION={width}x{height}")
+        lines.append(f"{name}/index.m3u8")
+    return _playlist_response(lines)
+
+
+def media_playlist(fp: str, resolution: str) -> flask.Response:
+    probe = _probe_or_404(fp)
+    if resolution not in renditions(probe):
+        raise HTTPNotFound(f"resolution {resolution!r} is not available")
+    duration = probe.format.duration
+    lines = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:3",
+        f"#EXT-X-TARGETDURATION:{SEGMENT_DURATION}",
+        "#EXT-X-MEDIA-SEQUENCE:0",
+        "#EXT-X-PLAYLIST-TYPE:VOD",
+    ]
+    for index in range(segment_count(duration)):
+        length = min(SEGMENT_DURATION, duration - index * SEGMENT_DURATION)
+        lines.append(f"#EXTINF:{length:.3f},")
+        lines.append(f"{index}.ts")
+    lines.append("#EXT-X-ENDLIST")
+    return _playlist_response(lines)
+
+
+def segment_count(duration: float) -> int:
+    return max(1, math.ceil(duration / SEGMENT_DURATION))
+
+
+def segment(fp: str, resolution: str, index: int) -> flask.Response:
+    probe = _probe_or_404(fp)
+    info = renditions(probe).get(resolution)
+    if info is None:
+        raise HTTPNotFound(f"resolution {resolution!r} is not available")
+    if not (0 <= index < segment_count(probe.format.duration)):
+        raise HTTPNotFound(f"segment {index} does not exist")
+
+    args = build_segment_args(fp=fp, info=info, index=index)
+    cache = get_transcode_cache()
+    if cache is None:
+        with reserve(info):
+            return flask.Response(_transcode(args), mimetype=SEGMENT_MIMETYPE)
+
+    key = transcode_key(fp=fp, args=args)
+
+    # viewers requesting the same segment wait for the first one instead of transcoding it again
+    with _segment_lock(key):
+        cached = cache.get(key)
+        record_cache("hls", hit=cached is not None)
+        if cached is None:
+            temp = cache.temp_path(key)
+            try:
+                with reserve(info):  # the player retries later if the machine is busy
+                    temp.write_bytes(_transcode(args))
+                cached = cache.commit(temp, key)
+            finally:
+                temp.unlink(missing_ok=True)
+    return send_file(cached, mimetype=SEGMENT_MIMETYPE, conditional=True, etag=key, max_age=3600)
+
+
+def build_segment_args(fp: str, info: OptimizationInfo, index: int) -> t.List[str]:
+    try:
+        ffmpeg = ffmpeg_executable()
+    except FileNotFoundError:
+        raise HTTPServiceUnavailable("ffmpeg executable not found")
+
+    start = index * SEGMENT_DURATION
+    return [
+        ffmpeg,
+        '-hide_banner',
+        '-loglevel', "error",
+        '-ss', f"{start}",  # input-seeking. only decodes from the keyframe before the segment
+        '-i', str(fp),
+        '-t', f"{SEGMENT_DURATION}",
+        '-map', "0:v:0", '-map', "0:a:0?",
+        '-sn',  # skip-subtitle-stream
+        *encoding_args(info),
+        '-ac', "2",  # supported by all hls-players
+        '-output_ts_offset', f"{start}",  # continuous timestamps across the segments
+        '-f', "mpegts",
+        "pipe:stdout",
+    ]
+
+
+def _transcode(args: t.List[str]) -> bytes:
+    logger.info(f"Running: {shlex.join(args)}")
+    try:
+        return subprocess.run(args, check=True, capture_output=True).stdout
+    except subprocess.CalledProcessError as error:
+        logger.error(f"segment transcoding failed:\n{error.stderr.decode(errors='replace')}")
+        raise
+
+
+_segment_locks: t.Dict[str, t.Tuple[threading.Lock, int]] = {}
+_segment_locks_lock = threading.Lock()
+
+
+class _segment_lock:
+    r"""
+    lock per segment-key that is removed again once nobody waits for it
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+
+    def __enter__(self):
+        with _segment_locks_lock:
+            lock, waiting = _segment_locks.get(self.key, (threading.Lock(), 0))
+            _segment_locks[self.key] = (lock, waiting + 1)
+        lock.acquire()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        with _segment_locks_lock:
+            lock, waiting = _segment_locks[self.key]
+            if waiting == 1:
+                del _segment_locks[self.key]
+            else:
+                _segment_locks[self.key] = (lock, waiting - 1)
+        lock.release()
+
+
+def _playlist_response(lines: t.List[str]) -> flask.Response:
+    response = flask.Response("\n".join(lines) + "\n", mimetype=PLAYLIST_MIMETYPE)
+    response.cache_control.no_cache = True
+    return response
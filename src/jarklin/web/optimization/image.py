@@ -4,19 +4,82 @@ r"""
 """
 import io
 import os
+import hashlib
+import logging
+import functools
+import typing as t
+from http import HTTPStatus
 from zlib import adler32
 import flask
 from PIL import Image
+from ._admission import Admission
+from ..utility import send_file
+from ..metrics import record_cache
+from ._cache import FileCache, get_file_cache
 
 
 __all__ = ['optimize_image']
 
 
+logger = logging.getLogger(__name__)
+DEFAULT_IMAGE_OPTIMIZATION_LIMIT = os.cpu_count() or 1
+
+
 def optimize_image(fp: str):
-    filesize = os.path.getsize(fp)
-    if filesize < flask.current_app.config.get('IMAGE_OPTIMIZATION_MINIMUM_SIZE', 1024 * 1024):
+    variant = find_variant(fp)
+    if variant is not None:
+        record_cache("image", hit=True)
+        return send_file(variant, mimetype="image/webp", as_attachment=False,
+                         download_name="optimized.webp", conditional=True)
+
+    stat = os.stat(fp)
+    if stat.st_size < flask.current_app.config.get('IMAGE_OPTIMIZATION_MINIMUM_SIZE', 1024 * 1024):
         return None
 
+    check = adler32(fp.encode('utf-8')) & 0xFFFFFFFF
+    etag = f"{stat.st_mtime}-{stat.st_size}-{check}-optimized"
+    if flask.request.if_none_match.contains(etag):  # the client still has it. no need to look at the image
+        response = flask.Response(status=HTTPStatus.NOT_MODIFIED)
+        response.set_etag(etag)
+        return response
+
+    cache = get_image_cache()
+    key = hashlib.sha1(etag.encode('utf-8')).hexdigest() + ".webp"
+    if cache is not None:
+        cached = cache.get(key)
+        record_cache("image", hit=cached is not None)
+        if cached is not None:
+            return send_file(cached, mimetype="image/webp", as_attachment=False,
+                             download_name="optimized.webp", conditional=True, etag=etag)
+
+    # when too many images are optimized at once the original is served instead
+    timeout = flask.current_app.config.get('IMAGE_OPTIMIZATION_QUEUE_TIMEOUT', 0.5)
+    slot = get_admission().try_acquire(timeout=timeout)
+    if slot is None:
+        logger.info(f"Serving original image. too many images are being optimized ({get_admission()})")
+        return None
+
+    with slot:
+        buffer = render(fp)
+    if buffer is None:
+        return None
+
+    if cache is not None:
+        temp = cache.temp_path(key)
+        try:
+            temp.write_bytes(buffer.getvalue())
+            cache.commit(temp, key)
+        finally:
+            temp.unlink(missing_ok=True)
+
+    return flask.send_file(buffer, "image/webp", as_attachment=False,
+                           download_name="optimized.webp", conditional=True, etag=etag)
+
+
+def render(fp: str) -> t.Optional[io.BytesIO]:
+    r"""
+    the image scaled down and encoded as webp. None for unsupported images
+    """
     with Image.open(fp) as image:
         # we don't support animated images
         if getattr(image, 'is_animated', False):
@@ -34,10 +97,49 @@ def optimize_image(fp: str):
         image.save(buffer, format='WEBP',
                    lossless=False, quality=75, method=3, exact=False)
         buffer.seek(0)
+    return buffer
 
-    stat = os.stat(fp)
-    check = adler32(fp.encode('utf-8')) & 0xFFFFFFFF
-    etag = f"{stat.st_mtime}-{stat.st_size}-{check}-optimized"
 
-    return flask.send_file(buffer, "image/webp", as_attachment=False,
-                           download_name="optimized.webp", conditional=False, etag=etag)
+def find_variant(fp: str) -> t.Optional[str]:
+    r"""
+    pre-rendered variant of a gallery-image (cache.gallery.variants).
+    the smallest one that is at least as wide as ?width= or the largest one
+    """
+    root = os.getcwd()
+    directory = os.path.join(root, '.jarklin', 'cache', os.path.relpath(os.path.dirname(fp), root), 'variants')
+    try:
+        widths = sorted(int(name) for name in os.listdir(directory) if name.isdigit())
+    except FileNotFoundError:
+        return None
+    if not widths:
+        return None
+
+    requested = flask.request.args.get("width", default=None, type=int)
+    preferred = widths[-1] if requested is None else next((width for width in widths if width >= requested), widths[-1])
+    # smaller images don't have the larger variants
+    for width in sorted((width for width in widths if width <= preferred), reverse=True):
+        variant = os.path.join(directory, str(width), f"{os.path.basename(fp)}.webp")
+        try:
+            if os.path.getmtime(variant) < os.path.getmtime(fp):  # outdated until the cache regenerates it
+                return None
+        except FileNotFoundError:
+            continue
+        return variant
+    return None
+
+
+def get_image_cache() -> t.Optional[FileCache]:
+    max_size = flask.current_app.config.get('IMAGE_OPTIMIZATION_CACHE_SIZE', 0)
+    if not max_size:
+        return None
+    return get_file_cache(os.path.join(os.getcwd(), '.jarklin', 'optimized-images'), max_size)
+
+
+def get_admission() -> Admission:
+    max_running = flask.current_app.config.get('IMAGE_OPTIMIZATION_LIMIT', DEFAULT_IMAGE_OPTIMIZATION_LIMIT)
+    return _get_admission(max_running)
+
+
+@functools.cache
+def _get_admission(max_running: int) -> Admission:
+    return Admission(max_running=max_running)
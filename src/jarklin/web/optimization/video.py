@@ -2,64 +2,625 @@
 r"""
 
 """
+import os
 import time
+import asyncio
 import shlex
+import hashlib
 import logging
+import functools
+import threading
+import contextlib
 import subprocess
 import typing as t
+from http import HTTPStatus
 import flask
-from werkzeug.exceptions import BadRequest as HTTPBadRequest, ServiceUnavailable as HTTPServiceUnavailable
+from werkzeug.datastructures import ContentRange
+from werkzeug.exceptions import BadRequest as HTTPBadRequest, ServiceUnavailable as HTTPServiceUnavailable, \
+    RequestedRangeNotSatisfiable as HTTPRequestedRangeNotSatisfiable
 from ...common.executables import ffmpeg_executable
+from ...common.ffprobe import get_ffprobe_cache
+from ...common.ffprobe.model import FFProbe
+from ..utility import send_file, aiter_chunks
+from ..metrics import record_cache
+from ._cache import FileCache, get_file_cache
+from ._admission import Admission, AdmissionSlot
 
 
-__all__ = ['optimize_video', 'BITRATE_MAP']
+__all__ = ['optimize_video', 'get_video_profiles', 'BITRATE_MAP', 'OptimizationInfo']
 
 
 logger = logging.getLogger(__name__)
 
 
+# mpegts-packet without content. used to fill up responses that were shorter than estimated
+NULL_PACKET = b"\x47\x1f\xff\x10" + b"\xff" * 184
+TS_PAYLOAD_SIZE = 184  # of the 188 bytes of a packet
+# mpegts-overhead besides the packet-headers: every pes-packet (a video-frame or about one aac-frame) starts a new
+# ts-packet (~1 packet of header and padding), and the tables (pat/pmt) are repeated every 100ms
+AAC_FRAMES_PER_SECOND = 48_000 / 1024
+TS_TABLE_BYTES_PER_SECOND = 2 * len(NULL_PACKET) * 10
+# on top of the estimation for bitrate-variations of the audio-encoder. the rest is filled with empty packets
+SIZE_ESTIMATION_HEADROOM = 1.05
+VBV_BUFFER_SECONDS = 2  # -bufsize as multiple of the video-bitrate
+# number of 720p30-transcodes the machine is assumed to handle in real-time (libx264 veryfast needs ~2-4 cores)
+DEFAULT_TRANSCODE_CAPACITY = max(1.0, (os.cpu_count() or 1) / 4)
+DEFAULT_VIDEO_OPTIMIZATION_LIMIT = 4  # ffmpeg-processes
+
+
 def optimize_video(fp: str):
-    def generator(args: t.List[str]):
-        logger.info(f"Running: {shlex.join(args)}")
-        process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=-1)
-        time.sleep(0.1)  # wait for startup and something in the buffer
+    probe = get_probe(fp)
+    start = flask.request.args.get("start", default=0.0, type=float)
+    if start < 0 or (probe is not None and start >= probe.format.duration):
+        raise HTTPBadRequest(f"Invalid start: {start}")
+    resolution = flask.request.args.get("resolution", None)
+    info = requested_resolution()
+    args = build_args(fp=fp, info=info, start=start)
+
+    cache = get_transcode_cache()
+    key = transcode_key(fp=fp, args=args) if cache is not None else None
+    if cache is not None:
+        cached = cache.get(key)
+        record_cache("video", hit=cached is not None)
+        if cached is not None:
+            logger.info(f"Serving cached transcode ({key})")
+            return send_file(cached, mimetype="video/mpeg", conditional=True, etag=key)
+
+    slot = None
+    if key not in _transcodes:  # likely a new process. attach_transcode() reserves one if this changes meanwhile
+        admitted, info, slot = admit(resolution=resolution, info=info)
+        if admitted != resolution:
+            resolution = admitted
+            args = build_args(fp=fp, info=info, start=start)
+            key = transcode_key(fp=fp, args=args) if cache is not None else None
+            cached = cache.get(key) if cache is not None else None
+            if cached is not None:
+                slot.release()
+                logger.info(f"Serving cached transcode ({key})")
+                response = send_file(cached, mimetype="video/mpeg", conditional=True, etag=key)
+                response.headers['X-Video-Resolution'] = resolution
+                return response
+
+    try:
+        if probe is None or info is None:
+            # no size-estimation possible (copied streams have no upper bound). just a stream without seeking
+            chunks = attach_transcode(cache, key=key, args=args, info=info, slot=slot) if cache is not None \
+                else FFmpegStream(args, slot=slot)
+            return flask.Response(chunks, mimetype="video/mpeg", direct_passthrough=True)
+
+        # the transcode is handled like a file of the estimated size. byte-offsets are mapped to timestamps
+        duration = probe.format.duration - start
+        size = estimate_size(probe=probe, info=info, duration=duration)
+        byte_range = flask.request.range
+        content_range = byte_range.range_for_length(size) if byte_range is not None else None
+        if byte_range is not None and content_range is None:
+            raise HTTPRequestedRangeNotSatisfiable(length=size)
+        offset, end = content_range if content_range is not None else (0, size)
+
+        chunks = attach_transcode(cache, key=key, args=args, info=info, offset=offset, slot=slot, length=size) \
+            if cache is not None else None
+        if chunks is None and offset == 0:
+            chunks = FFmpegStream(args, slot=slot)
+        elif chunks is None:
+            # the new stream starts at a packet-boundary. the rest of the packet at the offset is filled up
+            packet_offset = offset % len(NULL_PACKET)
+            timestamp = start + duration * (offset - packet_offset) / size
+            logger.info(f"Seeking to {timestamp:.3f}s for byte {offset}/{size}")
+            if slot is None:
+                slot = reserve(info)
+            chunks = FFmpegStream(build_args(fp=fp, info=info, start=timestamp), slot=slot)
+            if packet_offset:
+                chunks = PrefixedStream(NULL_PACKET[packet_offset:], chunks)
+    except BaseException:
+        if slot is not None:
+            slot.release()
+        raise
+
+    response = flask.Response(FittedStream(chunks, length=end - offset, at_end=end == size),
+                              mimetype="video/mpeg", direct_passthrough=True)
+    if resolution is not None:
+        response.headers['X-Video-Resolution'] = resolution
+    response.content_length = end - offset
+    response.accept_ranges = "bytes"
+    if content_range is not None:
+        response.status_code = HTTPStatus.PARTIAL_CONTENT
+        response.content_range = ContentRange("bytes", offset, end, size)
+    response.headers['X-Content-Duration'] = f"{duration:.3f}"  # allows seeking in firefox
+    return response
+
+
+class FFmpegStream:
+    r"""
+    the output of ffmpeg. the process is stopped if the client disconnects.
+    iterable for the threaded server and async-iterable (with asyncio-subprocess) for the async server
+    """
+
+    def __init__(self, args: t.List[str], slot: t.Optional[AdmissionSlot] = None):
+        self.args = args
+        self.slot = slot
+        self._iterator: t.Optional[t.Generator[bytes, None, None]] = None
+
+    def __iter__(self) -> t.Iterator[bytes]:
+        self._iterator = self._stream()
+        return self._iterator
+
+    def close(self) -> None:
+        if self._iterator is not None:
+            self._iterator.close()
+        elif self.slot is not None:  # never started
+            self.slot.release()
+
+    def _stream(self) -> t.Generator[bytes, None, None]:
+        logger.info(f"Running: {shlex.join(self.args)}")
         try:
-            while process.poll() is None:
-                line = process.stdout.read(1024)
-                logger.log(logging.NOTSET, f"Sending {len(line)} bytes")
-                yield line
+            process = subprocess.Popen(self.args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=-1)
+        except BaseException:
+            if self.slot is not None:
+                self.slot.release()
+            raise
+        try:
+            for chunk in iter(lambda: process.stdout.read1(Transcode.CHUNK_SIZE), b""):
+                logger.log(logging.NOTSET, f"Sending {len(chunk)} bytes")
+                yield chunk
         except GeneratorExit:
             process.terminate()
         except Exception as error:
             logging.critical("video optimization failed", exc_info=error)
+            process.terminate()
             raise error
         else:
+            process.wait()
             logger.info("video optimization completed")
             if process.returncode > 0:
                 stderr = process.stderr.read().decode()
                 logging.error(f"ffmpeg failed for unknown reason:\n{stderr}")
-                # raise subprocess.CalledProcessError(process.returncode, process.args)
+        finally:
+            process.stdout.close()
+            process.stderr.close()
+            if self.slot is not None:
+                self.slot.release()
 
-    return flask.Response(
-        flask.stream_with_context(generator(build_args(fp=fp))),
-        mimetype="video/mpeg",
-        direct_passthrough=True
-    )
+    async def __aiter__(self) -> t.AsyncIterator[bytes]:
+        logger.info(f"Running: {shlex.join(self.args)}")
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *self.args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+            )
+        except BaseException:
+            if self.slot is not None:
+                self.slot.release()
+            raise
+        try:
+            while chunk := await process.stdout.read(Transcode.CHUNK_SIZE):
+                yield chunk
+            await process.wait()
+            logger.info("video optimization completed")
+            if process.returncode > 0:
+                stderr = (await process.stderr.read()).decode()
+                logging.error(f"ffmpeg failed for unknown reason:\n{stderr}")
+        finally:
+            if process.returncode is None:  # client disconnected
+                process.terminate()
+                await process.wait()
+            if self.slot is not None:
+                self.slot.release()
+
+
+class PrefixedStream:
+    r"""
+    the chunks with some bytes before them
+    """
+
+    def __init__(self, prefix: bytes, chunks: t.Iterable[bytes]):
+        self.prefix = prefix
+        self.chunks = chunks
+
+    def __iter__(self) -> t.Iterator[bytes]:
+        yield self.prefix
+        yield from self.chunks
+
+    async def __aiter__(self) -> t.AsyncIterator[bytes]:
+        chunks = aiter_chunks(self.chunks)
+        try:
+            yield self.prefix
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await chunks.aclose()
+
+    def close(self) -> None:
+        close = getattr(self.chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+class FittedStream:
+    r"""
+    exactly length bytes of the chunks. shorter output is filled with empty mpegts-packets.
+    the length has to be an upper bound (estimate_size()). longer output can't be sent and is cut off.
+    at_end=False if the length is the one of a requested range, where cutting off is expected
+    """
+
+    def __init__(self, chunks: t.Iterable[bytes], length: int, at_end: bool = True):
+        self.chunks = chunks
+        self.length = length
+        self.at_end = at_end
+
+    def __iter__(self) -> t.Iterator[bytes]:
+        remaining = self.length
+        try:
+            for chunk in self.chunks:
+                if len(chunk) > remaining:
+                    self._warn_cut_off()
+                    yield chunk[:remaining]
+                    return
+                remaining -= len(chunk)
+                yield chunk
+            yield from self.padding(remaining)
+        finally:
+            self.close()
+
+    async def __aiter__(self) -> t.AsyncIterator[bytes]:
+        remaining = self.length
+        chunks = aiter_chunks(self.chunks)
+        try:
+            async for chunk in chunks:
+                if len(chunk) > remaining:
+                    self._warn_cut_off()
+                    yield chunk[:remaining]
+                    return
+                remaining -= len(chunk)
+                yield chunk
+            for padding in self.padding(remaining):
+                yield padding
+        finally:
+            await chunks.aclose()
+            self.close()
+
+    def close(self) -> None:
+        close = getattr(self.chunks, 'close', None)
+        if close is not None:
+            close()
+
+    def _warn_cut_off(self) -> None:
+        if self.at_end:
+            logger.warning(f"Transcode exceeded the estimated size ({self.length} bytes). Output is cut off")
+
+    @staticmethod
+    def padding(remaining: int) -> t.Iterator[bytes]:
+        while remaining > 0:
+            padding = (NULL_PACKET * 64)[:remaining]
+            remaining -= len(padding)
+            yield padding
+
+
+def estimate_size(probe: FFProbe, info: 'OptimizationInfo', duration: float) -> int:
+    r"""
+    upper bound of the size of the transcode. the video-bitrate is limited by maxrate and bufsize (encoding_args),
+    so the encoder never produces more than bitrate*duration+bufsize. the response is filled up to this size
+    """
+    video_bitrate = parse_bitrate(info.video_bitrate)
+    audio_bitrate = parse_bitrate(info.audio_bitrate) if probe.audio_streams else 0
+    payload = (video_bitrate * duration + video_bitrate * VBV_BUFFER_SECONDS + audio_bitrate * duration) / 8
+    fps = min([info.max_fps, *(stream.avg_frame_rate for stream in probe.video_streams if stream.avg_frame_rate)])
+    pes_per_second = fps + (AAC_FRAMES_PER_SECOND if probe.audio_streams else 0)
+    overhead = duration * (pes_per_second * len(NULL_PACKET) + TS_TABLE_BYTES_PER_SECOND)
+    size = round((payload * len(NULL_PACKET) / TS_PAYLOAD_SIZE + overhead) * SIZE_ESTIMATION_HEADROOM)
+    return max(len(NULL_PACKET), size + len(NULL_PACKET) - size % len(NULL_PACKET))
+
+
+def parse_bitrate(value: str) -> int:
+    units = {'k': 1_000, 'm': 1_000_000}
+    value = value.strip().lower()
+    if value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def get_transcode_cache() -> t.Optional[FileCache]:
+    max_size = flask.current_app.config.get('VIDEO_OPTIMIZATION_CACHE_SIZE', 0)
+    if not max_size:
+        return None
+    return get_file_cache(os.path.join(os.getcwd(), '.jarklin', 'transcodes'), max_size)
+
+
+def transcode_key(fp: str, args: t.List[str]) -> str:
+    stat = os.stat(fp)
+    identity = f"{stat.st_size}-{stat.st_mtime_ns}-{stat.st_ino}"
+    return hashlib.sha1("\0".join([identity, *args[1:]]).encode()).hexdigest() + ".ts"
+
+
+def attach_transcode(cache: FileCache, key: str, args: t.List[str], info: t.Optional['OptimizationInfo'],
+                     offset: int = 0, slot: t.Optional[AdmissionSlot] = None,
+                     length: t.Optional[int] = None) -> t.Optional['TranscodeFollower']:
+    r"""
+    follows the running transcode from the offset on or starts it (offset 0).
+    a new process always needs a slot: the given one, or one that is reserved if the transcode is not running
+    (anymore). returns None if the transcode did not reach the offset yet.
+    length is the estimated size the cached file is filled up to
+    """
+    while True:
+        with _transcodes_lock:
+            transcode = _transcodes.get(key)
+            if transcode is None:
+                if offset > 0:
+                    return None
+                if slot is not None:
+                    transcode = _transcodes[key] = Transcode(cache=cache, key=key, args=args, slot=slot,
+                                                             length=length)
+                    transcode.start()
+                    return transcode.follow(offset=offset)
+            elif transcode.size < offset:
+                return None
+            else:
+                logger.info(f"Attaching to running transcode ({key}) at {offset}")
+                if slot is not None:  # no new process required
+                    slot.release()
+                return transcode.follow(offset=offset)
+        slot = reserve(info)  # outside the lock, as it waits for a free slot
 
 
-def build_args(fp: str) -> t.List[str]:
+_transcodes: t.Dict[str, 'Transcode'] = {}
+_transcodes_lock = threading.Lock()
+
+
+class Transcode:
+    r"""
+    ffmpeg-process that writes into a temporary file of the cache. requests read along while it's growing.
+    the process is stopped if nobody read from it for ABANDON_AFTER seconds.
+    with a length (the estimated size) the file is filled up with empty packets, so the cached file has the same size
+    as the responses while it was running
+    """
+
+    CHUNK_SIZE = 64 * 1024
+    ABANDON_AFTER = 30
+
+    def __init__(self, cache: FileCache, key: str, args: t.List[str], slot: t.Optional[AdmissionSlot] = None,
+                 length: t.Optional[int] = None):
+        self.cache = cache
+        self.key = key
+        self.args = args
+        self.slot = slot
+        self.length = length
+        self.temp = cache.temp_path(key)
+        self.size = 0
+        self.finished = False
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._last_read = time.monotonic()
+        self._async_waiters: t.Set[t.Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+        self._file = open(self.temp, 'wb')
+
+    def __repr__(self):
+        return f"<{type(self).__name__}: {self.key}>"
+
+    def start(self) -> None:
+        threading.Thread(target=self._run, name=f"transcode-{self.key[:8]}", daemon=True).start()
+
+    def _run(self) -> None:
+        logger.info(f"Running: {shlex.join(self.args)}")
+        completed = abandoned = False
+        try:
+            with self._file, subprocess.Popen(self.args, stdout=subprocess.PIPE, stderr=subprocess.PIPE) as process:
+                for chunk in iter(lambda: process.stdout.read1(self.CHUNK_SIZE), b""):
+                    self._append(chunk)
+                    with self._condition:
+                        abandoned = not self._readers and time.monotonic() - self._last_read > self.ABANDON_AFTER
+                    if abandoned:
+                        logger.info(f"{self} - nobody is watching anymore. stopping")
+                        process.terminate()
+                        break
+                stderr = process.stderr.read().decode(errors='replace')
+                if process.wait() == 0 and self.length is not None:
+                    for padding in FittedStream.padding(self.length - self.size):
+                        self._append(padding)
+            if process.returncode == 0:
+                completed = True
+            elif not abandoned:
+                logger.error(f"{self} - ffmpeg failed ({process.returncode}):\n{stderr}")
+        except Exception as error:
+            logger.critical(f"{self} - video optimization failed", exc_info=error)
+        finally:
+            with _transcodes_lock:
+                if completed:
+                    logger.info(f"{self} - video optimization completed ({self.size} bytes)")
+                    self.cache.commit(self.temp, self.key)
+                else:
+                    self.temp.unlink(missing_ok=True)
+                _transcodes.pop(self.key, None)
+            if self.slot is not None:
+                self.slot.release()
+            with self._condition:
+                self.finished = True
+                self._notify()
+
+    def _append(self, chunk: bytes) -> None:
+        self._file.write(chunk)
+        self._file.flush()
+        with self._condition:
+            self.size += len(chunk)
+            self._notify()
+
+    def follow(self, offset: int = 0) -> 'TranscodeFollower':
+        r"""
+        everything the process wrote so far (from offset on) and the new output until it's finished.
+        has to be called while the temporary file still exists (under _transcodes_lock)
+        """
+        file = open(self.temp, 'rb')  # stays readable after being moved into the cache
+        file.seek(offset)
+        return TranscodeFollower(self, file)
+
+    def _notify(self) -> None:
+        r"""
+        wakes up the waiting readers. has to be called with the condition
+        """
+        self._condition.notify_all()
+        for loop, event in self._async_waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:  # loop is closed
+                pass
+
+
+class TranscodeFollower:
+    r"""
+    reads along a running transcode. iterable for the threaded server and async-iterable for the async server,
+    where waiting for new output doesn't hold a thread
+    """
+
+    def __init__(self, transcode: Transcode, file: t.BinaryIO):
+        self.transcode = transcode
+        self.file = file
+        self._iterator: t.Optional[t.Generator[bytes, None, None]] = None
+
+    def __iter__(self) -> t.Iterator[bytes]:
+        self._iterator = self._follow()
+        return self._iterator
+
+    def close(self) -> None:
+        if self._iterator is not None:
+            self._iterator.close()
+        self.file.close()
+
+    def _follow(self) -> t.Generator[bytes, None, None]:
+        transcode = self.transcode
+        with self._reading(), self.file:
+            while True:
+                chunk = self.file.read(Transcode.CHUNK_SIZE)
+                if chunk:
+                    yield chunk
+                    continue
+                with transcode._condition:
+                    if self.file.tell() < transcode.size:
+                        continue
+                    if transcode.finished:
+                        break
+                    transcode._condition.wait(timeout=1)
+
+    async def __aiter__(self) -> t.AsyncIterator[bytes]:
+        transcode = self.transcode
+        loop, event = asyncio.get_running_loop(), asyncio.Event()
+        with self._reading():
+            with transcode._condition:
+                transcode._async_waiters.add((loop, event))
+            try:
+                while True:
+                    # the new output was just written and is read from the page-cache. too short to need a thread
+                    chunk = self.file.read(Transcode.CHUNK_SIZE)
+                    if chunk:
+                        yield chunk
+                        continue
+                    event.clear()  # before checking, so a notification in between isn't lost
+                    with transcode._condition:
+                        if self.file.tell() < transcode.size:
+                            continue
+                        if transcode.finished:
+                            break
+                    await event.wait()
+            finally:
+                with transcode._condition:
+                    transcode._async_waiters.discard((loop, event))
+                self.file.close()
+
+    @contextlib.contextmanager
+    def _reading(self) -> t.Iterator[None]:
+        transcode = self.transcode
+        with transcode._condition:
+            transcode._readers += 1
+        try:
+            yield
+        finally:
+            with transcode._condition:
+                transcode._readers -= 1
+                transcode._last_read = time.monotonic()
+
+
+def requested_resolution() -> t.Optional['OptimizationInfo']:
     resolution = flask.request.args.get("resolution", None)
-    video_config: t.Optional[OptimizationInfo] = None
-    if resolution is not None:
-        logger.info(f"Resizing video... ({resolution})")
-        video_config = BITRATE_MAP.get(resolution, None)
-        if video_config is None:
-            raise HTTPBadRequest(f"Invalid resolution: {resolution!r}")
+    if resolution is None:
+        return None
+    video_config = get_video_profiles().get(resolution, None)
+    if video_config is None:
+        raise HTTPBadRequest(f"Invalid resolution: {resolution!r}")
+    return video_config
+
+
+def get_video_profiles() -> t.Dict[str, 'OptimizationInfo']:
+    r"""
+    BITRATE_MAP with the adjustments of the configuration (web.transcoding.profiles)
+    """
+    overrides = flask.current_app.config.get('VIDEO_PROFILES', {})
+    return {
+        name: info._replace(**overrides.get(name, {}))
+        for name, info in BITRATE_MAP.items()
+    }
+
+
+def get_admission() -> Admission:
+    capacity = flask.current_app.config.get('TRANSCODE_CAPACITY') or DEFAULT_TRANSCODE_CAPACITY
+    max_running = flask.current_app.config.get('VIDEO_OPTIMIZATION_LIMIT', DEFAULT_VIDEO_OPTIMIZATION_LIMIT)
+    return _get_admission(capacity, max_running)
+
+
+@functools.cache
+def _get_admission(capacity: float, max_running: int) -> Admission:
+    return Admission(capacity=capacity, max_running=max_running)
+
+
+def reserve(info: t.Optional['OptimizationInfo']) -> AdmissionSlot:
+    r"""
+    reserves the load for a new ffmpeg-process. waits a moment for a free slot and refuses the request if the
+    machine stays busy. copying the streams (no resolution) is cheap but still counts as running process
+    """
+    admission = get_admission()
+    timeout = flask.current_app.config.get('VIDEO_OPTIMIZATION_QUEUE_TIMEOUT', 5)
+    slot = admission.try_acquire(0 if info is None else info.cost, timeout=timeout)
+    if slot is None:
+        logger.warning(f"Refusing video optimization. too many videos are being transcoded ({admission})")
+        raise HTTPServiceUnavailable("too many videos are being transcoded", retry_after=30)
+    return slot
+
+
+def admit(resolution: t.Optional[str], info: t.Optional['OptimizationInfo']) \
+        -> t.Tuple[t.Optional[str], t.Optional['OptimizationInfo'], AdmissionSlot]:
+    r"""
+    reserves the load for a new transcode. if the machine is busy the transcode is either
+    downgraded to a cheaper resolution (web.transcoding.overload: downgrade) or has to wait in the queue
+    """
+    if info is None or flask.current_app.config.get('TRANSCODE_OVERLOAD', "downgrade") != "downgrade":
+        return resolution, info, reserve(info)
+
+    admission = get_admission()
+    cheaper = sorted(
+        ((name, other) for name, other in get_video_profiles().items() if other.cost < info.cost),
+        key=lambda item: item[1].cost, reverse=True,
+    )
+    for name, candidate in [(resolution, info), *cheaper]:
+        slot = admission.try_acquire(candidate.cost)
+        if slot is not None:
+            if name != resolution:
+                logger.info(f"Downgrading transcode from {resolution} to {name} ({admission})")
+            return name, candidate, slot
+    return resolution, info, reserve(info)
+
+
+def build_args(fp: str, info: t.Optional['OptimizationInfo'], start: float = 0) -> t.List[str]:
+    video_config = info
+    if video_config is not None:
+        logger.info(f"Resizing video... ({video_config.height}p)")
 
     video_stream = flask.request.args.get("video", default=None, type=int)
     audio_stream = flask.request.args.get("audio", default=None, type=int)
     subtitle_stream = flask.request.args.get("subtitle", default=None, type=int)
 
+    probe = get_probe(fp)
+    if probe is not None:
+        for kind, index, streams in (("video", video_stream, probe.video_streams),
+                                     ("audio", audio_stream, probe.audio_streams),
+                                     ("subtitle", subtitle_stream, probe.subtitle_streams)):
+            if index is not None and not (0 <= index < len(streams)):
+                raise HTTPBadRequest(f"Invalid {kind} stream: {index} (has {len(streams)})")
+
     try:
         ffmpeg = ffmpeg_executable()
     except FileNotFoundError:
@@ -69,8 +630,12 @@ def build_args(fp: str) -> t.List[str]:
         ffmpeg,
         '-hide_banner',
         '-loglevel', "error",
-        '-i', str(fp),
     ]
+    if start:
+        args.extend(['-ss', f"{start:.3f}"])  # input-seeking. only decodes from the keyframe before
+    args.extend(['-i', str(fp)])
+    if start:
+        args.extend(['-output_ts_offset', f"{start:.3f}"])  # timestamps stay the ones of the position in the video
 
     if video_stream is not None:
         logger.debug(f"Selecting video stream {video_stream}")
@@ -98,12 +663,8 @@ def build_args(fp: str) -> t.List[str]:
     if video_config:
         logger.debug("Applying video resolution")
         args.extend([
-            '-vf', fr"scale=if(lt(iw\,ih)\,min({video_config.height}\,iw)\,-2)"
-                   fr":if(gte(iw\,ih)\,min({video_config.height}\,ih)\,-2)",
+            *encoding_args(video_config),
             '-movflags', "faststart",  # web optimized. faster readiness
-            '-fpsmax', f"{video_config.max_fps}",
-            "-b:v", video_config.video_bitrate,
-            "-b:a", video_config.audio_bitrate,
             # "-acodec", "libmp3lame",  # audio-codec
             # "-scodec", "copy",  # copy subtitles
             '-f', "mpegts",
@@ -120,11 +681,62 @@ def build_args(fp: str) -> t.List[str]:
     return args
 
 
+def encoding_args(info: 'OptimizationInfo') -> t.List[str]:
+    r"""
+    scales down to the height (width for portrait-videos) of the resolution and limits bitrate and fps
+    """
+    args = [
+        '-vf', fr"scale=if(lt(iw\,ih)\,min({info.height}\,iw)\,-2)"
+               fr":if(gte(iw\,ih)\,min({info.height}\,ih)\,-2)",
+        '-fpsmax', f"{info.max_fps}",
+        '-c:v', "libx264",
+        '-preset', info.preset,
+    ]
+    if info.crf is not None:  # constant quality. the bitrate is only the upper limit
+        args.extend(['-crf', f"{info.crf}"])
+    else:
+        args.extend(['-b:v', info.video_bitrate])
+    args.extend([  # limits the size of the output (see estimate_size())
+        '-maxrate', info.video_bitrate,
+        '-bufsize', f"{parse_bitrate(info.video_bitrate) * VBV_BUFFER_SECONDS}",
+    ])
+    if info.threads:
+        args.extend(['-threads', f"{info.threads}"])
+    args.extend([
+        '-force_key_frames', f"expr:gte(t,n_forced*{info.keyint})",
+        '-c:a', "aac",
+        '-b:a', info.audio_bitrate,
+    ])
+    return args
+
+
+def get_probe(fp: str) -> t.Optional[FFProbe]:
+    r"""
+    the ffprobe-result shared with the cache. None if the file could not be probed
+    """
+    try:
+        return get_ffprobe_cache(os.getcwd()).probe(fp)
+    except Exception as error:
+        logger.warning(f"Failed to probe {fp!r}", exc_info=error)
+        return None
+
+
 class OptimizationInfo(t.NamedTuple):
     video_bitrate: str
     audio_bitrate: str
     max_fps: int
     height: int
+    preset: str = "veryfast"  # libx264-preset. larger resolutions need faster presets to transcode in real-time
+    crf: t.Optional[int] = None  # constant quality with video_bitrate as maximum instead of a fixed bitrate
+    threads: int = 0  # 0 lets ffmpeg decide
+    keyint: float = 2  # seconds between keyframes
+
+    @property
+    def cost(self) -> float:
+        r"""
+        load of a real-time transcode relative to 720p30
+        """
+        return (self.height / 720) ** 2 * (self.max_fps / 30)
 
 
 BITRATE_MAP: t.Dict[str, OptimizationInfo] = {
@@ -132,11 +744,18 @@ BITRATE_MAP: t.Dict[str, OptimizationInfo] = {
     '360p': OptimizationInfo(video_bitrate="500k", audio_bitrate="48k", max_fps=30, height=360),
     '480p': OptimizationInfo(video_bitrate="1000k", audio_bitrate="64k", max_fps=30, height=480),
     '720p': OptimizationInfo(video_bitrate="1500k", audio_bitrate="128k", max_fps=30, height=720),
-    '720p60': OptimizationInfo(video_bitrate="2250k", audio_bitrate="128k", max_fps=60, height=720),
-    '1080p': OptimizationInfo(video_bitrate="3000k", audio_bitrate="192k", max_fps=30, height=1080),
-    '1080p60': OptimizationInfo(video_bitrate="4500k", audio_bitrate="192k", max_fps=60, height=1080),
-    '1440p': OptimizationInfo(video_bitrate="6000k", audio_bitrate="320k", max_fps=30, height=1440),
-    '1440p60': OptimizationInfo(video_bitrate="9000k", audio_bitrate="320k", max_fps=60, height=1440),
-    '2160p': OptimizationInfo(video_bitrate="13000k", audio_bitrate="448k", max_fps=30, height=2160),
-    '2160p60': OptimizationInfo(video_bitrate="20000k", audio_bitrate="448k", max_fps=60, height=2160),
+    '720p60': OptimizationInfo(video_bitrate="2250k", audio_bitrate="128k", max_fps=60, height=720,
+                               preset="superfast"),
+    '1080p': OptimizationInfo(video_bitrate="3000k", audio_bitrate="192k", max_fps=30, height=1080,
+                              preset="superfast"),
+    '1080p60': OptimizationInfo(video_bitrate="4500k", audio_bitrate="192k", max_fps=60, height=1080,
+                                preset="ultrafast"),
+    '1440p': OptimizationInfo(video_bitrate="6000k", audio_bitrate="320k", max_fps=30, height=1440,
+                              preset="ultrafast"),
+    '1440p60': OptimizationInfo(video_bitrate="9000k", audio_bitrate="320k", max_fps=60, height=1440,
+                                preset="ultrafast"),
+    '2160p': OptimizationInfo(video_bitrate="13000k", audio_bitrate="448k", max_fps=30, height=2160,
+                              preset="ultrafast"),
+    '2160p60': OptimizationInfo(video_bitrate="20000k", audio_bitrate="448k", max_fps=60, height=2160,
+                                preset="ultrafast"),
 }
@@ -2,9 +2,16 @@
 r"""
 
 """
+import os
+import asyncio
+import typing as t
+from http import HTTPStatus
 from hmac import compare_digest
+from urllib.parse import quote
 import flask
+import werkzeug.utils
 from werkzeug.exceptions import Unauthorized as HTTPUnauthorized
+from .metrics import timed_phase
 
 
 def validate_user(username: str, password: str) -> True:
@@ -18,16 +25,17 @@ def requires_authenticated(fn):
     @wraps(fn)
     def wrapper(*args, **kwargs):
         if flask.current_app.config.get("USERPASS"):
-            authenticated = False
+            with timed_phase("auth"):
+                authenticated = False
 
-            auth = flask.request.authorization
-            if (auth is not None
-                    and auth.type == "basic"
-                    and validate_user(username=auth.username, password=auth.password)):
-                authenticated = True
+                auth = flask.request.authorization
+                if (auth is not None
+                        and auth.type == "basic"
+                        and validate_user(username=auth.username, password=auth.password)):
+                    authenticated = True
 
-            if 'username' in flask.session:
-                authenticated = True
+                if 'username' in flask.session:
+                    authenticated = True
 
             if not authenticated:
                 raise HTTPUnauthorized("currently not logged in")
@@ -39,3 +47,78 @@ def requires_authenticated(fn):
 def to_bool(value: str) -> bool:
     # important: this evaluates empty strings to true (/resource?download)
     return value.lower() in {"true", "yes", "1", ""}
+
+
+def send_file(fp: t.Union[str, os.PathLike], **kwargs) -> flask.Response:
+    r"""
+    flask.send_file() for files on disk that doesn't block a worker-thread while sending.
+    either the front-proxy sends the file (web.sendfile.method) or the file is handed to the server
+    """
+    method = flask.current_app.config.get('SENDFILE_METHOD', None)
+    if method in {"x-sendfile", "x-accel-redirect"}:
+        return _offload_file(fp, method=method, **kwargs)
+
+    response = flask.send_file(fp, **kwargs)
+    file_wrapper = flask.request.environ.get('wsgi.file_wrapper')
+    # werkzeug wraps ranges into an iterator that the server has to pull through the worker-thread.
+    # waitress' file_wrapper can send a part of the file (prepare(size) limits it to the content-length)
+    if response.status_code == HTTPStatus.PARTIAL_CONTENT and hasattr(file_wrapper, 'prepare'):
+        file = open(fp, 'rb')
+        file.seek(response.content_range.start)
+        response.close()
+        response.response = file_wrapper(file)
+    return response
+
+
+def _offload_file(fp: t.Union[str, os.PathLike], method: str, conditional: bool = True, **kwargs) -> flask.Response:
+    app = flask.current_app
+    kwargs.setdefault('max_age', app.get_send_file_max_age)
+    response = werkzeug.utils.send_file(
+        fp, environ=flask.request.environ, use_x_sendfile=True, conditional=False,
+        response_class=app.response_class, _root_path=app.root_path, **kwargs,
+    )
+    if conditional:
+        response = response.make_conditional(flask.request.environ)  # ranges are handled by the proxy
+    path = response.headers.pop('X-Sendfile')
+    if response.status_code != HTTPStatus.OK:  # e.g. 304. nothing to send
+        return response
+
+    if method == "x-accel-redirect":
+        prefix = app.config.get('SENDFILE_PREFIX', "/")
+        relative = os.path.relpath(path, os.getcwd()).replace(os.sep, "/")
+        response.headers['X-Accel-Redirect'] = f"{prefix.rstrip('/')}/{quote(relative)}"
+    else:
+        response.headers['X-Sendfile'] = path
+    return response
+
+
+async def aiter_chunks(chunks: t.Iterable[bytes]) -> t.AsyncGenerator[bytes, None]:
+    r"""
+    async-iteration over a response-body. synchronous iterables are advanced in a worker-thread
+    so the event-loop is never blocked (e.g. while waiting for a running transcode)
+    """
+    if hasattr(chunks, '__aiter__'):
+        iterator = chunks.__aiter__()
+        try:
+            async for chunk in iterator:
+                yield chunk
+        finally:
+            aclose = getattr(iterator, 'aclose', None)
+            if aclose is not None:
+                await aclose()
+        return
+
+    loop = asyncio.get_running_loop()
+    iterator = iter(chunks)
+    done = object()
+    while True:
+        future = loop.run_in_executor(None, next, iterator, done)
+        try:
+            chunk = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # the thread can't be interrupted. wait for it so the iterator can be closed afterwards
+            await asyncio.wait({future})
+            raise
+        if chunk is done:
+            break
+        yield chunk